@@ -0,0 +1,48 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Imports and exports generated quotes through src.bulk and reports the throughput.
+# Usage (from the repository root): python -m benchmarks.bench_bulk_import [amount]
+
+import io
+import random
+import sys
+import time
+
+from src.bulk import export_quotes, import_quotes
+from src.database import Database
+from benchmarks.common import BENCH_ALIAS, BENCH_VK_ID, WORDS, bench_database_auth
+
+AMOUNT = 500000
+AUTHORS = 1000
+TAGS = 200
+
+
+def generate_records(amount: int):
+    for i in range(amount):
+        yield {'vk_id': BENCH_VK_ID, 'author': 'автор {}'.format(i % AUTHORS),
+               'text': ' '.join(random.choice(WORDS) for _ in range(8)),
+               'tags': ['тег{}'.format(random.randrange(TAGS)) for _ in range(random.randrange(3))],
+               'attachment': '', 'private': random.random() < 0.2}
+
+
+def main(amount: int):
+    db = Database(bench_database_auth())
+    if not db.user_exists(vk_id=BENCH_VK_ID):
+        db.create_user(vk_id=BENCH_VK_ID, alias=BENCH_ALIAS)
+
+    start = time.perf_counter()
+    stats = import_quotes(db, generate_records(amount))
+    elapsed = time.perf_counter() - start
+    print('import: {} quotes in {:.1f} s, {:.0f} quotes/s'.format(stats['imported'], elapsed,
+                                                                  stats['imported'] / elapsed))
+
+    start = time.perf_counter()
+    rows = export_quotes(db, io.StringIO(), 'jsonl')
+    elapsed = time.perf_counter() - start
+    print('export: {} quotes in {:.1f} s, {:.0f} quotes/s'.format(rows, elapsed, rows / elapsed))
+    db.close_connection()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else AMOUNT)
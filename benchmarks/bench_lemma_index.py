@@ -0,0 +1,50 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Loads the lemma index from growing quote tables and compares its word search with the ILIKE over word forms
+# and the full-text search.
+# Usage (from the repository root): python -m benchmarks.bench_lemma_index [sizes...]
+
+import sys
+import time
+
+from src.database import Database
+from src.lemma_index import LemmaIndex
+from src.methods import SearchParams, get_word_states, warm_up_morph
+from benchmarks.common import BENCH_VK_ID, bench_database_auth, measure, seed_quotes
+
+SIZES = (100000, 1000000)
+QUERIES = ('любви', 'работать', 'светлое', 'городами')
+REPEAT = 20
+MAX_AMOUNT = 1000
+
+
+def main(sizes):
+    db = Database(bench_database_auth())
+    warm_up_morph()
+    for size in sizes:
+        seed_quotes(db, size)
+        index = LemmaIndex(db)
+        start = time.perf_counter()
+        index.load()
+        elapsed = time.perf_counter() - start
+        stats = index.stats()
+        print('{} quotes: loaded in {:.1f} s, {} lemmas, {} postings in {:.1f} MB'.format(
+            stats['quotes'], elapsed, stats['lemmas'], stats['postings'], stats['postings_bytes'] / 2 ** 20))
+
+        print('{:<12}{:>14}{:>14}{:>14}'.format('word', 'ILIKE, ms', 'tsvector, ms', 'index, ms'))
+        for word in QUERIES:
+            word_states = get_word_states(word)
+            ilike = measure(lambda: db.get_quotes_by_word_states(BENCH_VK_ID, word_states, SearchParams.ALL,
+                                                                 MAX_AMOUNT), REPEAT)
+            full_text = measure(lambda: db.get_quotes_by_word(BENCH_VK_ID, word, SearchParams.ALL, MAX_AMOUNT),
+                                REPEAT)
+            lemma = measure(lambda: index.get_quotes_by_word(BENCH_VK_ID, word, SearchParams.ALL, MAX_AMOUNT),
+                            REPEAT)
+            print('{:<12}{:>14.2f}{:>14.2f}{:>14.2f}'.format(word, ilike, full_text, lemma))
+        print()
+    db.close_connection()
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
@@ -0,0 +1,58 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Counts VK API round trips needed to deliver search results with and without execute batching.
+# Usage (from the repository root): python -m benchmarks.bench_outbound
+
+import time
+
+from src.bot_base import BotBase, SEARCH_QUOTES_AMOUNT
+from src.keyboard import Keyboard
+from tests.fake_vk import FakeVkServer
+
+SCENARIOS = (
+    ('short texts', 0.0, 40),
+    ('long texts', 0.0, 480),
+    ('half with attachments', 0.5, 200),
+    ('all with attachments', 1.0, 200),
+)
+
+
+class QuotesStub:
+    def __init__(self, attachment_share: float, length: int):
+        self.attachment_share = attachment_share
+        self.length = length
+
+    def get_quotes(self, quote_ids: list) -> list:
+        with_attachment = int(len(quote_ids) * self.attachment_share)
+        return [{'quote_id': quote_id, 'vk_id': 1, 'author': 'автор', 'text': 'ж' * self.length, 'private': False,
+                 'attachments': ['photo1_{}'.format(quote_id) if i < with_attachment else '']}
+                for i, quote_id in enumerate(quote_ids)]
+
+
+def deliver(bot: BotBase, vk: FakeVkServer, batched: bool) -> tuple:
+    vk.requests.clear()
+    start = time.perf_counter()
+    quote_ids = list(range(1, SEARCH_QUOTES_AMOUNT + 1))
+    if batched:
+        with bot.outbound.batch():
+            bot.print_quote_list(vk_id=1, quotes=quote_ids, keyboard=Keyboard.RETURN, print_quote_id=True)
+    else:
+        bot.print_quote_list(vk_id=1, quotes=quote_ids, keyboard=Keyboard.RETURN, print_quote_id=True)
+    return len(vk.requests), (time.perf_counter() - start) * 1000
+
+
+def main():
+    with FakeVkServer() as vk:
+        print('{:<24}{:>12}{:>12}{:>14}{:>14}'.format('search result', 'sends', 'batched', 'sends, ms', 'batched, ms'))
+        for name, attachment_share, length in SCENARIOS:
+            bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk.vk_session(),
+                          database=QuotesStub(attachment_share, length))
+            plain_trips, plain_time = deliver(bot, vk, batched=False)
+            batched_trips, batched_time = deliver(bot, vk, batched=True)
+            print('{:<24}{:>12}{:>12}{:>14.1f}{:>14.1f}'.format(name, plain_trips, batched_trips, plain_time,
+                                                                batched_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Measures BotBase.parse_message per message category: keyboard commands, quotes with parameters, searches
+# and plain text inputs.
+# Usage (from the repository root): python -m benchmarks.bench_parser [number]
+
+import sys
+import timeit
+
+import vk_api
+
+from src.bot_base import BotBase
+from src.methods import State
+
+NUMBER = 100000
+CATEGORIES = (
+    ('first command', 'Начать', State.BOT_MENU),
+    ('last command', 'Вернуться', State.SEARCH_BY_TAG),
+    ('quote', 'Жизнь прекрасна и удивительна', State.QUOTE_CREATION_BM),
+    ('quote with params', 'Жизнь прекрасна @a "Лев Толстой" @t "жизнь мир" @p', State.QUOTE_CREATION_MQ),
+    ('word search', 'жизнь @a', State.SEARCH_BY_WORD),
+    ('tag search', 'жизнь мир', State.SEARCH_BY_TAG),
+    ('quote id', '42', State.QUOTE_ADDING),
+)
+
+
+def main(number: int):
+    bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk_api.VkApi(token='fake'),
+                  database=object())
+    print('{:<20}{:>14}'.format('category', 'us/message'))
+    for name, raw_message, state in CATEGORIES:
+        elapsed = timeit.timeit(lambda: bot.parse_message(raw_message=raw_message, state=state), number=number)
+        print('{:<20}{:>14.2f}'.format(name, elapsed / number * 10 ** 6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER)
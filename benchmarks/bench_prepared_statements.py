@@ -0,0 +1,63 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compares the per-query cost of the hot session queries sent as plain text and as named prepared statements.
+# Every query is its own pooled unit of work run by POOL_MAX_CONNECTIONS threads, as the handlers run them, so
+# the PREPARE made by a connection opened during the run is measured too.
+# Usage (from the repository root): python -m benchmarks.bench_prepared_statements [iterations]
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.database import Database, POOL_MAX_CONNECTIONS, PREPARED_STATEMENTS, execute_prepared
+from src.methods import State
+from benchmarks.common import BENCH_VK_ID, bench_database_auth, seed_quotes
+
+ITERATIONS = 5000
+
+
+def measure(function, iterations: int) -> float:
+    # microseconds per call, the calls are spread over the threads of the handlers
+    with ThreadPoolExecutor(max_workers=POOL_MAX_CONNECTIONS) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda _: function(), range(iterations)))
+        return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run_plain(db: Database, statement: str, params: tuple):
+    with db.transaction() as cursor:
+        cursor.execute(statement, params)
+
+
+def run_prepared(db: Database, name: str, params: tuple):
+    with db.transaction() as cursor:
+        execute_prepared(cursor, name, params)
+
+
+def main(iterations: int):
+    db = Database(bench_database_auth())
+    seed_quotes(db, 1)
+    with db.transaction() as cursor:
+        cursor.execute('SELECT min("quote_id") FROM "quotes";')
+        quote_id = cursor.fetchone()[0]
+    args = {'user_exists': (BENCH_VK_ID,), 'get_user_state': (BENCH_VK_ID,),
+            'set_user_state': (State.BOT_MENU.value, BENCH_VK_ID), 'get_quote': (quote_id,)}
+
+    print('{:<16}{:>14}{:>14}{:>10}'.format('query', 'plain, us', 'prepared, us', 'saving'))
+    for name, params in args.items():
+        statement = PREPARED_STATEMENTS[name][1]
+        for i in range(len(params), 0, -1):
+            statement = statement.replace('${}'.format(i), '%s')
+
+        plain = measure(lambda: run_plain(db, statement, params), iterations)
+        prepared = measure(lambda: run_prepared(db, name, params), iterations)
+        print('{:<16}{:>14.1f}{:>14.1f}{:>9.0f}%'.format(name, plain, prepared, (1 - prepared / plain) * 100))
+    connections = db.get_pool()._pool
+    print('idle connections: {}, statements prepared: {}'.format(
+        len(connections), sum(len(connection.prepared) for connection in connections)))
+    db.close_connection()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS)
@@ -0,0 +1,149 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Replays message events through BotBase and reports the handling latency per Command and per State.
+# Events are synthetic user sessions (menu navigation, quote creation, word, tag and random search) or a
+# recorded JSONL file of raw long poll events. VK is the local fake server, the database an in-memory stand-in
+# unless --postgres is passed.
+# Usage (from the repository root): python -m benchmarks.bench_replay [--users N] [--events file] [--postgres]
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+from vk_api.bot_longpoll import VkBotLongPoll
+
+from src.bot_base import BotBase, COMMAND_PHRASES, Command, HANDLER_WORKERS
+from src.database import Database
+from src.methods import State, WordSearchEngine
+from src.outbound import SendQueue
+from benchmarks.common import WORDS, bench_database_auth
+from benchmarks.memory_database import MemoryDatabase
+from tests.fake_vk import FakeVkServer
+
+USERS = 200
+QUOTES_PER_USER = 3
+SEARCHES_PER_USER = 3
+TAGS = ('жизнь', 'любовь', 'работа', 'мир', 'дом')
+
+
+def message_event(vk_id: int, text: str, message_id: int) -> dict:
+    return {'type': 'message_new', 'group_id': 1, 'event_id': str(message_id),
+            'object': {'message': {'id': message_id, 'date': 0, 'from_id': vk_id, 'peer_id': vk_id, 'text': text,
+                                   'attachments': []},
+                       'client_info': {}}}
+
+
+def user_script(alias: str) -> list:
+    script = ['начать', alias, 'Создать цитату']
+    for _ in range(QUOTES_PER_USER):
+        script.append('{} @t {} @a "{}"'.format(' '.join(random.choices(WORDS, k=8)), random.choice(TAGS),
+                                                random.choice(WORDS)))
+    script += ['Вернуться', 'Найти цитату', 'Поиск по слову']
+    script += [random.choice(WORDS) for _ in range(SEARCHES_PER_USER)] + [random.choice(WORDS) + ' @a', 'Дальше']
+    script += ['Вернуться', 'Поиск по тегу']
+    script += [random.choice(TAGS) for _ in range(SEARCHES_PER_USER)] + ['Дальше']
+    script += ['Вернуться', 'Случайный поиск', 'Вернуться', 'Мои цитаты', 'Вернуться']
+    return script
+
+
+def synthetic_events(users: int) -> list:
+    # the sessions of all users interleaved, as they arrive to a busy bot
+    run = '{:04x}'.format(random.getrandbits(16))
+    first_vk_id = random.randrange(10 ** 8, 2 * 10 ** 8)
+    scripts = [[(first_vk_id + i, text) for text in user_script('r{}_{}'.format(run, i))] for i in range(users)]
+    events = []
+    for step in range(max(len(x) for x in scripts)):
+        for script in scripts:
+            if step < len(script):
+                events.append(message_event(*script[step], len(events) + 1))
+    return events
+
+
+def recorded_events(path: str) -> list:
+    with open(path, encoding='utf8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def percentile(timings: list, share: float) -> float:
+    return timings[max(0, math.ceil(share * len(timings)) - 1)]
+
+
+class LatencyRecorder:
+    # wraps BotBase.handle_event, a message is labeled by its command and by the state of its user before it
+    def __init__(self, bot: BotBase):
+        self.bot = bot
+        self.handle_event = bot.handle_event
+        self.lock = threading.Lock()
+        self.by_command = defaultdict(list)
+        self.by_state = defaultdict(list)
+
+    def __call__(self, event):
+        vk_id = event.message.from_id
+        state = self.bot.sessions.get_user_state(vk_id=vk_id) if self.bot.sessions.user_exists(vk_id=vk_id) \
+            else State.ALIAS_INPUT
+        command = COMMAND_PHRASES.get(event.message['text'].lower(), Command.NOT_FOUND)
+        start = time.perf_counter()
+        try:
+            self.handle_event(event)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.by_command[command.name].append(elapsed)
+                self.by_state[state.name].append(elapsed)
+
+
+def print_latencies(title: str, latencies: dict):
+    print('{:<20}{:>8}{:>10}{:>10}{:>10}'.format(title, 'events', 'p50, ms', 'p95, ms', 'p99, ms'))
+    for name, timings in sorted(latencies.items()):
+        timings.sort()
+        print('{:<20}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}'.format(name, len(timings), percentile(timings, 0.5),
+                                                              percentile(timings, 0.95),
+                                                              percentile(timings, 0.99)))
+    print()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay message events through BotBase')
+    parser.add_argument('--users', type=int, default=USERS, help='users of the synthetic sessions')
+    parser.add_argument('--events', help='JSONL file of recorded raw events instead of the synthetic ones')
+    parser.add_argument('--postgres', action='store_true', help='use the benchmark PostgreSQL database')
+    parser.add_argument('--word-search', choices=[x.name.lower() for x in WordSearchEngine],
+                        default=WordSearchEngine.FULL_TEXT.name.lower())
+    return parser.parse_args()
+
+
+def main(args):
+    raw_events = recorded_events(args.events) if args.events else synthetic_events(args.users)
+    events = [VkBotLongPoll.CLASS_BY_EVENT_TYPE.get(x['type'], VkBotLongPoll.DEFAULT_EVENT_CLASS)(x)
+              for x in raw_events]
+    database = Database(bench_database_auth()) if args.postgres else MemoryDatabase()
+
+    with FakeVkServer() as vk:
+        # VK limits are not measured here: the sender is not throttled
+        send_queue = SendQueue(vk.vk_session, rate=10 ** 6, burst=10 ** 6, workers=HANDLER_WORKERS)
+        bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk.vk_session(), database=database,
+                      send_queue=send_queue, word_search=WordSearchEngine[args.word_search.upper()])
+        recorder = LatencyRecorder(bot)
+        bot.handle_event = recorder
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            bot.run(iter(events))
+            elapsed = time.perf_counter() - start
+        send_queue.close()
+
+        print('{} events in {:.2f} s: {:.0f} events/s, {} messages in {} VK requests\n'.format(
+            len(events), elapsed, len(events) / elapsed, len(vk.sent), len(vk.requests)))
+    print_latencies('command', recorder.by_command)
+    print_latencies('state', recorder.by_state)
+    database.close_connection()
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,72 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compares the tag search resolving tags with ILIKE on every query against the in-memory tag ids and the GIN
+# index on quotes.tags, on 10k tags and 1M quotes by default.
+# Usage (from the repository root): python -m benchmarks.bench_tag_search [quotes] [tags]
+
+import random
+import sys
+
+from src.database import Database, QUOTE_VISIBILITY
+from src.methods import SearchParams
+from benchmarks.common import BENCH_VK_ID, bench_database_auth, measure, seed_quotes
+
+QUOTES = 1000000
+TAGS = 10000
+TAGS_PER_QUOTE = 3
+REPEAT = 20
+MAX_AMOUNT = 1000
+QUERIES = (1, 3)  # tags per search
+
+ILIKE_QUERY = """
+SELECT "quote_id" FROM "quotes"
+WHERE {} AND "tags" && (SELECT ARRAY_AGG("tag_id") FROM "tags" WHERE "text" ILIKE ANY(%(tags)s::TEXT[]))
+ORDER BY "quote_id" DESC
+LIMIT %(max_amount)s;
+""".format(QUOTE_VISIBILITY[SearchParams.ALL.value])
+
+
+def seed_tags(db: Database, tags: int):
+    # tags "Тег0".."Тег{tags - 1}", every untagged quote gets up to TAGS_PER_QUOTE random ones
+    with db.transaction() as cursor:
+        cursor.execute("""
+        INSERT INTO "tags" ("text") SELECT 'Тег' || "i" FROM generate_series(0, %(tags)s - 1) AS "i"
+        ON CONFLICT ("text") DO NOTHING;
+        """, {'tags': tags})
+        cursor.execute("""
+        UPDATE "quotes" SET "tags" = (
+            SELECT ARRAY_AGG("tag_id") FROM "tags"
+            WHERE "text" = ANY(ARRAY(SELECT 'Тег' || floor(random() * %(tags)s)::int
+                                     FROM generate_series(1, %(per_quote)s) WHERE "quote_id" > 0))
+        )
+        WHERE "tags" IS NULL;
+        """, {'tags': tags, 'per_quote': TAGS_PER_QUOTE})
+        cursor.execute('ANALYZE "quotes";')
+        cursor.execute('ANALYZE "tags";')
+
+
+def search_ilike(db: Database, tags: list) -> list:
+    with db.transaction() as cursor:
+        cursor.execute(ILIKE_QUERY, {'vk_id': BENCH_VK_ID, 'tags': tags, 'max_amount': MAX_AMOUNT})
+        return [x[0] for x in cursor.fetchall()]
+
+
+def main(quotes: int, tags: int):
+    db = Database(bench_database_auth())
+    seed_quotes(db, quotes)
+    seed_tags(db, tags)
+    db.get_quotes_by_tag(BENCH_VK_ID, ['тег0'], SearchParams.ALL, MAX_AMOUNT)  # loads the tag ids
+
+    print('{:<16}{:>14}{:>14}'.format('tags per search', 'ILIKE, ms', 'GIN, ms'))
+    for amount in QUERIES:
+        queries = [['тег{}'.format(random.randrange(tags)) for _ in range(amount)] for _ in range(REPEAT)]
+        ilike = measure(lambda: search_ilike(db, random.choice(queries)), REPEAT)
+        gin = measure(lambda: db.get_quotes_by_tag(BENCH_VK_ID, random.choice(queries), SearchParams.ALL,
+                                                   MAX_AMOUNT), REPEAT)
+        print('{:<16}{:>14.2f}{:>14.2f}'.format(amount, ilike, gin))
+    db.close_connection()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else QUOTES, int(sys.argv[2]) if len(sys.argv) > 2 else TAGS)
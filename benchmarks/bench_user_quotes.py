@@ -0,0 +1,97 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compares the user_quotes relation with the former users.quotes INTEGER[] for a user holding many quotes.
+# The array variant runs the statements the bot used before on a scratch table with the same array.
+# Usage (from the repository root): python -m benchmarks.bench_user_quotes [owned quotes]
+
+import sys
+
+from src.database import Database
+from src.methods import SearchParams
+from benchmarks.common import BENCH_VK_ID, bench_database_auth, measure, seed_quotes
+
+OWNED_QUOTES = 10000
+REPEAT = 50
+MAX_AMOUNT = 10
+WORD = 'любовь'
+
+ARRAY_ADD = """
+UPDATE "bench_user_arrays" SET "quotes" = array_append("quotes", %(quote_id)s)
+WHERE "vk_id" = %(vk_id)s AND NOT ("quotes" @> ARRAY[%(quote_id)s]::INTEGER[]);
+"""
+ARRAY_REMOVE = """
+UPDATE "bench_user_arrays" SET "quotes" = array_remove("quotes", %(quote_id)s)
+WHERE "vk_id" = %(vk_id)s AND ("quotes" @> ARRAY[%(quote_id)s]::INT[]);
+"""
+ARRAY_SEARCH = (None, """
+SELECT "quote_id" FROM "quotes", plainto_tsquery('russian', %(word)s) AS "query"
+WHERE "quote_id" = ANY((SELECT "quotes" FROM "bench_user_arrays" WHERE "vk_id" = %(vk_id)s)::int[])
+AND "text_tsv" @@ "query"
+ORDER BY ts_rank("text_tsv", "query") DESC
+LIMIT %(max_amount)s;
+""", """
+SELECT "quote_id" FROM "quotes", plainto_tsquery('russian', %(word)s) AS "query"
+WHERE "quote_id" <> ALL((SELECT "quotes" FROM "bench_user_arrays" WHERE "vk_id" = %(vk_id)s)::int[])
+AND "private" = '0' AND "text_tsv" @@ "query"
+ORDER BY ts_rank("text_tsv", "query") DESC
+LIMIT %(max_amount)s;
+""")
+
+
+def prepare(db: Database, owned: int) -> int:
+    # the benchmark user holds the first owned quotes, returns a quote the user does not hold
+    with db.transaction() as cursor:
+        cursor.execute("""
+        INSERT INTO "user_quotes" ("user_id", "quote_id")
+        SELECT (SELECT "user_id" FROM "users" WHERE "vk_id" = %(vk_id)s), "quote_id" FROM "quotes"
+        ORDER BY "quote_id" LIMIT %(owned)s
+        ON CONFLICT DO NOTHING;
+        CREATE TABLE IF NOT EXISTS "bench_user_arrays" ("vk_id" INTEGER PRIMARY KEY, "quotes" INTEGER[]);
+        DELETE FROM "bench_user_arrays";
+        INSERT INTO "bench_user_arrays"
+        SELECT %(vk_id)s, array_agg("quote_id" ORDER BY "quote_id")
+        FROM (SELECT "quote_id" FROM "quotes" ORDER BY "quote_id" LIMIT %(owned)s) AS "owned";
+        ANALYZE "user_quotes";
+        """, {'vk_id': BENCH_VK_ID, 'owned': owned})
+        cursor.execute('SELECT "quote_id" FROM "quotes" ORDER BY "quote_id" OFFSET %s LIMIT 1;', (owned,))
+        return cursor.fetchone()[0]
+
+
+def run_array(db: Database, *commands, **params):
+    with db.transaction() as cursor:
+        for command in commands:
+            cursor.execute(command, dict(params, vk_id=BENCH_VK_ID))
+
+
+def main(owned: int):
+    db = Database(bench_database_auth())
+    seed_quotes(db, owned * 2)
+    quote_id = prepare(db, owned)
+
+    def add_remove():
+        db.add_quote_to_user(vk_id=BENCH_VK_ID, quote_id=quote_id)
+        db.remove_user_quote(vk_id=BENCH_VK_ID, quote_id=quote_id)
+
+    rows = [
+        ('add + remove', measure(add_remove, REPEAT),
+         measure(lambda: run_array(db, ARRAY_ADD, ARRAY_REMOVE, quote_id=quote_id), REPEAT)),
+        ('my quotes', measure(lambda: db.get_my_quotes(vk_id=BENCH_VK_ID), REPEAT),
+         measure(lambda: run_array(db, 'SELECT "quotes" FROM "bench_user_arrays" WHERE "vk_id" = %(vk_id)s;'),
+                 REPEAT)),
+    ]
+    for search_param in (SearchParams.PRIVATE, SearchParams.PUBLIC):
+        rows.append(('search {}'.format(search_param.name.lower()),
+                     measure(lambda: db.get_quotes_by_word(BENCH_VK_ID, WORD, search_param, MAX_AMOUNT), REPEAT),
+                     measure(lambda: run_array(db, ARRAY_SEARCH[search_param.value], word=WORD,
+                                               max_amount=MAX_AMOUNT), REPEAT)))
+
+    print('user holding {} quotes'.format(owned))
+    print('{:<16}{:>18}{:>14}'.format('operation', 'user_quotes, ms', 'array, ms'))
+    for name, relation, array in rows:
+        print('{:<16}{:>18.2f}{:>14.2f}'.format(name, relation, array))
+    db.close_connection()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else OWNED_QUOTES)
@@ -0,0 +1,35 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compares the full-text word search with the ILIKE over word forms on growing quote tables.
+# Usage (from the repository root): python -m benchmarks.bench_word_search [sizes...]
+
+import sys
+
+from src.database import Database
+from src.methods import SearchParams, get_word_states
+from benchmarks.common import BENCH_VK_ID, bench_database_auth, measure, seed_quotes
+
+SIZES = (100000, 1000000)
+QUERIES = ('любви', 'работать', 'светлое', 'городами')
+REPEAT = 20
+MAX_AMOUNT = 10
+
+
+def main(sizes):
+    db = Database(bench_database_auth())
+    print('{:>10} {:<12}{:>14}{:>14}'.format('quotes', 'word', 'ILIKE, ms', 'tsvector, ms'))
+    for size in sizes:
+        seed_quotes(db, size)
+        for word in QUERIES:
+            word_states = get_word_states(word)
+            ilike = measure(lambda: db.get_quotes_by_word_states(BENCH_VK_ID, word_states, SearchParams.ALL,
+                                                                 MAX_AMOUNT), REPEAT)
+            full_text = measure(lambda: db.get_quotes_by_word(BENCH_VK_ID, word, SearchParams.ALL, MAX_AMOUNT),
+                                REPEAT)
+            print('{:>10} {:<12}{:>14.2f}{:>14.2f}'.format(size, word, ilike, full_text))
+    db.close_connection()
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
@@ -0,0 +1,69 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import statistics
+import time
+
+from src.database import Database
+
+BENCH_DATABASE_SUFFIX = '_bench'
+BENCH_VK_ID = 1
+BENCH_ALIAS = 'bench'
+WORDS = ('жизнь', 'любовь', 'время', 'работа', 'человек', 'слово', 'дорога', 'дом', 'друг', 'мир', 'правда',
+         'счастье', 'солнце', 'ночь', 'город', 'море', 'память', 'сердце', 'душа', 'судьба', 'всегда', 'никогда',
+         'сегодня', 'завтра', 'думать', 'знать', 'любить', 'ждать', 'верить', 'искать', 'светлый', 'тихий',
+         'новый', 'старый', 'большой', 'последний', 'главный', 'простой', 'живой', 'вечный')
+
+
+def load_access_data() -> dict:
+    with open('access_data.json') as json_file:
+        return json.load(json_file)
+
+
+def bench_database_auth() -> dict:
+    # benchmarks never touch the production database
+    database_auth = dict(load_access_data()['database_auth'])
+    database_auth['database'] += BENCH_DATABASE_SUFFIX
+    return database_auth
+
+
+def measure(function, repeat: int) -> float:
+    # median wall time of one call, milliseconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def count_quotes(db: Database) -> int:
+    with db.transaction() as cursor:
+        cursor.execute('SELECT count(*) FROM "quotes";')
+        return cursor.fetchone()[0]
+
+
+def seed_quotes(db: Database, amount: int, *, private_share=0.2):
+    # tops the quotes table up to amount rows of random texts owned by the benchmark user
+    if not db.user_exists(vk_id=BENCH_VK_ID):
+        db.create_user(vk_id=BENCH_VK_ID, alias=BENCH_ALIAS)
+    missing = amount - count_quotes(db)
+    if missing <= 0:
+        return
+    command = """
+    WITH "author" AS (
+        INSERT INTO "authors" ("title") VALUES (%(alias)s)
+        ON CONFLICT ("title") DO UPDATE SET "title" = EXCLUDED."title" RETURNING "author_id"
+    )
+    INSERT INTO "quotes" ("user_id", "author_id", "text", "private")
+    SELECT (SELECT "user_id" FROM "users" WHERE "vk_id" = %(vk_id)s), (SELECT "author_id" FROM "author"),
+           (SELECT string_agg("words"[1 + floor(random() * array_length("words", 1))::int], ' ')
+            FROM generate_series(1, 8) WHERE "g" > 0),
+           random() < %(private_share)s
+    FROM generate_series(1, %(amount)s) AS "g", (SELECT %(words)s::TEXT[] AS "words") AS "w";
+    """
+    with db.transaction() as cursor:
+        cursor.execute(command, {'alias': BENCH_ALIAS, 'vk_id': BENCH_VK_ID, 'private_share': private_share,
+                                 'amount': missing, 'words': list(WORDS)})
+        cursor.execute('ANALYZE "quotes";')
@@ -0,0 +1,177 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+import re
+import threading
+import time
+
+from src.methods import SearchParams, State
+
+WORD = re.compile(r'\w+')
+
+
+class MemoryDatabase:
+    """
+    In-memory stand-in for src.database.Database with the same methods and results, for measuring the bot
+    without PostgreSQL. The lexemes of a text are its lower-cased words: word search matches whole words, as the
+    full-text search matches lexemes, the search by word states matches substrings, as the ILIKE search does.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}  # vk_id -> {'state', 'alias', 'quotes'}
+        self.quotes = {}  # quote_id -> quote dict as returned by Database.get_quote
+        self.tags = {}  # tag -> quote ids
+        self.versions = {}  # quote_id -> version, new on creation and on a change of visibility
+        self.version = 0
+        self.events = {}  # event_id of a Callback API event -> time.time() of its receipt
+
+    def user_exists(self, vk_id: int) -> bool:
+        return vk_id in self.users
+
+    def alias_exists(self, alias: str) -> bool:
+        with self.lock:
+            return any(user['alias'] == alias for user in self.users.values())
+
+    def create_user(self, vk_id: int, alias: str):
+        with self.lock:
+            self.users[vk_id] = {'state': State.ALIAS_INPUT, 'alias': alias, 'quotes': [], 'search_results': None,
+                                 'search_position': 0}
+
+    def set_user_state(self, vk_id: int, state: State):
+        user = self.users[vk_id]
+        if user['state'] != state:
+            user.update(state=state, search_results=None, search_position=0)
+
+    def get_user_state(self, vk_id: int) -> State:
+        return self.users[vk_id]['state']
+
+    def start_search(self, vk_id: int, quote_ids: list):
+        self.users[vk_id].update(search_results=list(quote_ids), search_position=0)
+
+    def next_search_page(self, vk_id: int, amount: int) -> list:
+        user = self.users[vk_id]
+        if user['search_results'] is None:
+            return []
+        position = user['search_position']
+        user['search_position'] += amount
+        return user['search_results'][position:position + amount]
+
+    def search_remaining(self, vk_id: int) -> int:
+        user = self.users[vk_id]
+        return max(0, len(user['search_results'] or []) - user['search_position'])
+
+    def claim_event(self, event_id: str) -> bool:
+        with self.lock:
+            if event_id in self.events:
+                return False
+            self.events[event_id] = time.time()
+            return True
+
+    def release_event(self, event_id: str):
+        with self.lock:
+            self.events.pop(event_id, None)
+
+    def prune_events(self, max_age: int) -> int:
+        with self.lock:
+            old = [x for x, received_at in self.events.items() if received_at < time.time() - max_age]
+            for event_id in old:
+                del self.events[event_id]
+            return len(old)
+
+    def get_user_alias(self, vk_id: int) -> str:
+        return self.users[vk_id]['alias']
+
+    def set_user_alias(self, vk_id: int, alias: str):
+        self.users[vk_id]['alias'] = alias
+
+    def create_quote(self, vk_id: int, text: str, *, tags=None, author='', attachments=None, private=False) -> dict:
+        with self.lock:
+            quote_id = len(self.quotes) + 1
+            self.quotes[quote_id] = {'quote_id': quote_id, 'vk_id': vk_id, 'author': author, 'text': text,
+                                     'attachments': [attachments[0]] if attachments else [], 'private': private}
+            for tag in {x.lower() for x in tags or []}:
+                self.tags.setdefault(tag, []).append(quote_id)
+            self.users[vk_id]['quotes'].append(quote_id)
+            self.next_version(quote_id)
+            return self.quotes[quote_id]
+
+    def add_quote_to_user(self, vk_id: int, quote_id: int):
+        with self.lock:
+            quotes = self.users[vk_id]['quotes']
+            if quote_id not in quotes:
+                quotes.append(quote_id)
+
+    def remove_user_quote(self, vk_id: int, quote_id: int):
+        with self.lock:
+            quotes = self.users[vk_id]['quotes']
+            if quote_id in quotes:
+                quotes.remove(quote_id)
+            quote = self.quotes[quote_id]
+            if not quote['private'] and not any(quote_id in user['quotes'] for user in self.users.values()):
+                quote['private'] = True
+                self.next_version(quote_id)
+
+    def next_version(self, quote_id: int):
+        self.version += 1
+        self.versions[quote_id] = self.version
+
+    def get_quote(self, quote_id: int) -> dict or None:
+        return self.quotes.get(quote_id)
+
+    def get_quotes(self, quote_ids: list) -> list:
+        return [self.quotes[quote_id] for quote_id in quote_ids if quote_id in self.quotes]
+
+    def get_user_quotes(self, vk_id: int) -> list:
+        return [quote_id for quote_id, quote in self.quotes.items() if quote['vk_id'] == vk_id]
+
+    def get_quote_texts(self, after_version: int, max_amount: int) -> list:
+        with self.lock:
+            quote_ids = sorted((x for x in self.quotes if self.versions[x] > after_version), key=self.versions.get)
+            return [(x, self.quotes[x]['text'], self.quotes[x]['private'], self.versions[x])
+                    for x in quote_ids[:max_amount]]
+
+    def get_my_quotes(self, vk_id: int) -> list:
+        return list(self.users[vk_id]['quotes'])
+
+    def get_quotes_on_random(self, max_amount: int) -> list:
+        with self.lock:
+            public = [quote_id for quote_id, quote in self.quotes.items() if not quote['private']]
+        return random.sample(public, min(max_amount, len(public)))
+
+    def visible(self, vk_id: int, search_param: SearchParams) -> list:
+        own = set(self.users[vk_id]['quotes'])
+        with self.lock:
+            quotes = list(self.quotes.values())
+        if search_param == SearchParams.PRIVATE:
+            return [quote for quote in quotes if quote['quote_id'] in own]
+        if search_param == SearchParams.PUBLIC:
+            return [quote for quote in quotes if quote['quote_id'] not in own and not quote['private']]
+        if search_param == SearchParams.PUBLISHED:
+            return [quote for quote in quotes if not quote['private']]
+        return [quote for quote in quotes if quote['quote_id'] in own or not quote['private']]
+
+    def get_lexemes(self, texts: list) -> list:
+        return [sorted(set(WORD.findall(text.lower()))) for text in texts]
+
+    def get_quotes_by_word(self, vk_id: int, word: str, search_param: SearchParams, max_amount: int) -> list:
+        lexemes = set(self.get_lexemes([word])[0])
+        found = [quote['quote_id'] for quote in reversed(self.visible(vk_id, search_param))
+                 if lexemes and lexemes <= set(self.get_lexemes([quote['text']])[0])]
+        return found[:max_amount]
+
+    def get_quotes_by_word_states(self, vk_id: int, word_states: list, search_param: SearchParams,
+                                  max_amount: int) -> list:
+        found = [quote['quote_id'] for quote in reversed(self.visible(vk_id, search_param))
+                 if any(state in quote['text'].lower() for state in word_states)]
+        return found[:max_amount]
+
+    def get_quotes_by_tag(self, vk_id: int, tags: list, search_param: SearchParams, max_amount: int) -> list:
+        tagged = {quote_id for tag in tags for quote_id in self.tags.get(tag.lower(), [])}
+        found = [quote['quote_id'] for quote in reversed(self.visible(vk_id, search_param))
+                 if quote['quote_id'] in tagged]
+        return found[:max_amount]
+
+    def close_connection(self):
+        pass
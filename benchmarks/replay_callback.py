@@ -0,0 +1,107 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Replays message events as VK Callback API requests and reports the answers and the acknowledgement latency.
+# Without --url a local bot is started behind a CallbackServer, with the fake VK server and the in-memory
+# database, and the run waits until every accepted event is handled.
+# Usage (from the repository root):
+#     python -m benchmarks.replay_callback [--url URL --group-id N --secret S] [--users N] [--events file]
+
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from src.bot_base import BotBase
+from src.callback import CallbackServer
+from src.outbound import SendQueue
+from benchmarks.bench_replay import USERS, percentile, recorded_events, synthetic_events
+from benchmarks.memory_database import MemoryDatabase
+from tests.fake_vk import FakeVkServer
+
+CLIENTS = 8  # concurrent HTTP connections, as VK delivers events of a group in parallel
+SECRET = 'replay'
+
+
+def replay(url: str, raw_events: list, group_id: int, secret: str) -> tuple:
+    # (answers by status, acknowledgement times in ms); events of a user are posted in order by one client
+    local = threading.local()
+    answers = Counter()
+    timings = []
+    lock = threading.Lock()
+
+    def post_user(user_events):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        for raw_event in user_events:
+            raw_event = dict(raw_event, group_id=group_id, secret=secret)
+            start = time.perf_counter()
+            response = local.session.post(url, data=json.dumps(raw_event, ensure_ascii=False).encode('utf8'),
+                                          timeout=10)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                answers[response.status_code] += 1
+                timings.append(elapsed)
+
+    by_user = {}
+    for raw_event in raw_events:
+        by_user.setdefault(raw_event['object']['message']['from_id'], []).append(raw_event)
+    with ThreadPoolExecutor(CLIENTS) as executor:
+        list(executor.map(post_user, by_user.values()))
+    return answers, sorted(timings)
+
+
+def report(answers: Counter, timings: list, elapsed: float):
+    print('{} requests in {:.2f} s: {:.0f} requests/s, answers {}'.format(
+        len(timings), elapsed, len(timings) / elapsed, dict(answers)))
+    print('acknowledgement p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms'.format(
+        percentile(timings, 0.5), percentile(timings, 0.95), percentile(timings, 0.99)))
+
+
+def replay_local(raw_events: list):
+    with FakeVkServer() as vk:
+        send_queue = SendQueue(vk.vk_session, rate=10 ** 6, burst=10 ** 6)
+        bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk.vk_session(),
+                      database=MemoryDatabase(), send_queue=send_queue)
+        callback = CallbackServer(1, 'confirm', secret=SECRET, host='127.0.0.1')
+        callback.start()
+        runner = threading.Thread(target=bot.run, args=(callback.events(),))
+        runner.start()
+        start = time.perf_counter()
+        answers, timings = replay('http://127.0.0.1:{}/'.format(callback.server_address[1]), raw_events, 1,
+                                  SECRET)
+        acknowledged = time.perf_counter() - start
+        callback.close()
+        runner.join()
+        handled = time.perf_counter() - start
+        send_queue.close()
+    report(answers, timings, acknowledged)
+    print('all events handled in {:.2f} s, {} messages sent'.format(handled, len(vk.sent)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay events through the Callback API ingress')
+    parser.add_argument('--url', help='Callback API address of a running bot (default: start a local one)')
+    parser.add_argument('--group-id', type=int, default=1)
+    parser.add_argument('--secret', default=SECRET)
+    parser.add_argument('--users', type=int, default=USERS, help='users of the synthetic sessions')
+    parser.add_argument('--events', help='JSONL file of recorded raw events instead of the synthetic ones')
+    return parser.parse_args()
+
+
+def main(args):
+    raw_events = recorded_events(args.events) if args.events else synthetic_events(args.users)
+    if args.url is None:
+        replay_local(raw_events)
+        return
+    start = time.perf_counter()
+    answers, timings = replay(args.url, raw_events, args.group_id, args.secret)
+    report(answers, timings, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(parse_args())
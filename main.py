@@ -1,31 +1,100 @@
 # ! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
+import functools
 import json
-import traceback
+import logging
+import multiprocessing
 
+import vk_api
 
 from src.bot_base import BotBase, BotRuntimeError
+from src.callback import CallbackServer
+from src.database import Database
+from src.methods import Deployment, WordSearchEngine
+from src.log import LOG_FILE, LOG_QUEUE_SIZE, get_logger, setup_logging
+from src.metrics import start_metrics_server
+from src.outbound import SEND_BURST, SEND_RATE, SendQueue
+from src.workers import ShardedRunner
 
+logger = get_logger('main')
 
-def logs(s):
-    with open('logs.txt', 'a+', encoding='utf8') as df:
-        df.write(s + '\n')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='VK quotes bot')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes sharded by vk_id (default: single process)')
+    parser.add_argument('--instances', type=int, default=1,
+                        help='number of bot instances serving the group, e.g. behind a balancer of the Callback '
+                             'API; with more than one the user data, the search results and the received event '
+                             'ids are kept only in the database, and the send rate is shared (default: %(default)s)')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='load the morphological dictionaries at startup instead of on the first search')
+    parser.add_argument('--word-search', default='full_text', choices=[x.name.lower() for x in WordSearchEngine],
+                        help='engine of the search by word, lemma_index keeps an in-process index of all quotes '
+                             '(default: %(default)s)')
+    parser.add_argument('--callback-port', type=int, default=0,
+                        help='receive events from the VK Callback API on this port instead of the long poll, '
+                             'the confirmation string and the secret are taken from "callback_auth" of '
+                             'access_data.json (default: long poll)')
+    parser.add_argument('--callback-host', default='', help='address of the Callback API server (default: all)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve Prometheus metrics on /metrics at this port, with --workers the ingress uses '
+                             'the port and shard N port + 1 + N (default: disabled)')
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help='DEBUG records every handled message (default: %(default)s)')
+    parser.add_argument('--log-file', default=LOG_FILE, help='rotated log file (default: %(default)s)')
+    parser.add_argument('--log-format', default='json', choices=('json', 'text'))
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    log_level = getattr(logging, args.log_level)
+    # worker processes send their records to the listener of this process
+    log_queue = multiprocessing.get_context('spawn').Queue(LOG_QUEUE_SIZE) if args.workers else None
+    setup_logging(log_level, path=args.log_file, json_format=args.log_format == 'json', log_queue=log_queue)
+
     with open('access_data.json') as json_file:
         data = json.load(json_file)
 
+    word_search = WordSearchEngine[args.word_search.upper()]
     group_auth = data['group_auth']
     database_auth = data['database_auth']
 
-    bot = BotBase(group_auth=group_auth, database_auth=database_auth)
+    callback = None
+    if args.callback_port:
+        callback_auth = data['callback_auth']
+        callback = CallbackServer(group_auth['group_id'], callback_auth['confirmation'],
+                                  secret=callback_auth.get('secret'), port=args.callback_port,
+                                  host=args.callback_host,
+                                  db=Database(database_auth) if args.instances > 1 else None)
+        callback.start()
+
+    if args.workers:
+        ShardedRunner(group_auth=group_auth, database_auth=database_auth, shards=args.workers,
+                      instances=args.instances, warm_up=args.warm_up, word_search=word_search,
+                      metrics_port=args.metrics_port, log_queue=log_queue,
+                      log_level=log_level).run(callback.events() if callback else None)
+    else:
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        deployment, send_queue = Deployment.SINGLE_PROCESS, None
+        if args.instances > 1:
+            # the request rate of the group token is shared by the instances
+            deployment = Deployment.MULTI_INSTANCE
+            send_queue = SendQueue(functools.partial(vk_api.VkApi, token=group_auth['group_token']),
+                                   rate=SEND_RATE / args.instances, burst=max(1.0, SEND_BURST / args.instances))
+        bot = BotBase(group_auth=group_auth, database_auth=database_auth, warm_up=args.warm_up,
+                      word_search=word_search, deployment=deployment, send_queue=send_queue)
 
-    while True:
-        try:
-            bot.run()
-        except BotRuntimeError as e:
-            logs('Error accrued with code {}: {}\n'.format(e.code.value, e.what))
-        except Exception as e:
-            logs('Error:\n' + traceback.format_exc())
+        while True:
+            try:
+                # a new iterator per run, the queue of the server keeps the events the failed run did not take
+                bot.run(callback.events() if callback else None)
+                break
+            except BotRuntimeError as e:
+                logger.error('Error accrued with code %s: %s', e.code.value, e.what)
+            except Exception:
+                logger.exception('Error')
@@ -0,0 +1,61 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Bulk import and export of quotes with their authors and tags.
+# python quotes_io.py import quotes.csv
+# python quotes_io.py export quotes.jsonl
+# Fields: vk_id, author, text, tags, attachment, private (export adds quote_id). In CSV the tags are joined
+# with ';'. Quotes of users unknown to the bot are skipped, an empty author is the alias of the user.
+
+import argparse
+import json
+import os
+import sys
+
+from src.bulk import BULK_BATCH_SIZE, export_quotes, import_quotes, read_quotes
+from src.database import Database
+from src.log import setup_logging
+
+FORMATS = ('csv', 'jsonl')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Bulk import and export of quotes')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('path', help="CSV or JSONL file, '-' for stdin/stdout")
+    parser.add_argument('--format', choices=FORMATS,
+                        help='file format (default: taken from the file extension)')
+    parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE,
+                        help='quotes imported per transaction (default: %(default)s)')
+    args = parser.parse_args()
+    if args.format is None:
+        extension = os.path.splitext(args.path)[1].lstrip('.').lower()
+        if extension not in FORMATS:
+            parser.error('unknown file format, pass --format')
+        args.format = extension
+    return args
+
+
+def open_file(path: str, mode: str):
+    if path == '-':
+        return open((sys.stdin if mode == 'r' else sys.stdout).fileno(), mode, encoding='utf8', newline='',
+                    closefd=False)
+    return open(path, mode, encoding='utf8', newline='')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open('access_data.json') as json_file:
+        data = json.load(json_file)
+
+    setup_logging(path=None, json_format=False)
+    db = Database(database_auth=data['database_auth'])
+    try:
+        if args.action == 'import':
+            with open_file(args.path, 'r') as file:
+                import_quotes(db, read_quotes(file, args.format), batch_size=args.batch_size)
+        else:
+            with open_file(args.path, 'w') as file:
+                export_quotes(db, file, args.format)
+    finally:
+        db.close_connection()
@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 from enum import Enum
+import asyncio
 import re
+import time
 import requests
 import random
 import vk_api
@@ -11,14 +13,26 @@ from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
 from src.database import Database, SearchParams, State
 from src.phrases import UserPhrases, GroupPhrases, ErrorPhrases, KeyboardHints
 from src.keyboard import Keyboard, create_keyboard
-from src.methods import BotRuntimeError, get_word_states, check_args
+from src.methods import BotRuntimeError, Deployment, WordSearchEngine, get_word_states, check_args, warm_up_morph
+from src.dispatcher import EventDispatcher
+from src.session import SessionCache, SharedSessions
+from src.search_cache import SearchCache
+from src.lemma_index import LemmaIndex
+from src.quote_cache import QuoteCache, RenderedQuote
+from src.outbound import OutboundSender, SendQueue, SendPriority
+from src import metrics
+from src.log import get_logger
 
 VK_MESSAGE_LIMIT = 4096
 QUOTE_LENGTH_LIMIT = 500
 AUTHOR_NAME_LENGTH_LIMIT = 20
 TAG_LENGTH_LIMIT = 20
 RANDOM_SEARCH_QUOTES_AMOUNT = 5
-SEARCH_QUOTES_AMOUNT = 10
+SEARCH_QUOTES_AMOUNT = 10  # quotes per page of search results
+SEARCH_RESULTS_LIMIT = 1000  # matches of a search kept in the session for paging
+HANDLER_WORKERS = 16
+
+logger = get_logger('bot')
 
 
 class Command(Enum):
@@ -35,6 +49,61 @@ class Command(Enum):
     FAQ = 10
     RETURN = 11
     NOT_FOUND = 12
+    NEXT_PAGE = 13
+
+
+# keyboard phrases named differently from their command
+PHRASE_COMMANDS = {UserPhrases.START_RUS: Command.BOT_START, UserPhrases.START_EN: Command.BOT_START}
+
+
+def build_command_phrases(phrases=UserPhrases) -> dict:
+    # keyboard phrase -> command, a phrase without a command is a mistake in the tables
+    command_phrases = {}
+    for phrase in phrases:
+        command = PHRASE_COMMANDS.get(phrase) or Command.__members__.get(phrase.name)
+        if command is None:
+            raise ValueError('no command for the phrase {}'.format(phrase.name))
+        command_phrases[phrase.value] = command
+    return command_phrases
+
+
+# keyboard phrase -> command, other messages are parsed by the state of the user; a phrase is a command in every
+# state, so "дальше" itself can not be searched
+COMMAND_PHRASES = build_command_phrases()
+PARAM_SEPARATOR = '@'
+QUOTE_PARAM = re.compile(r'([atp]) (.*)', re.DOTALL)  # @a author, @t tags, @p private
+SEARCH_PARAMS = {'a': SearchParams.PUBLIC, 'p': SearchParams.PRIVATE}
+
+# command -> (hint, keyboard, new state) of the commands that only open a menu
+NAVIGATION = {
+    Command.SEARCH_QUOTE: (KeyboardHints.SEARCH_MENU, Keyboard.QUOTE_SEARCH, State.QUOTE_SEARCH),
+    Command.ADD_QUOTE: (KeyboardHints.QUOTE_ADDING, Keyboard.FAQ_AND_RETURN, State.QUOTE_ADDING),
+    Command.DELETE_QUOTE: (KeyboardHints.QUOTE_DELETING, Keyboard.FAQ_AND_RETURN, State.QUOTE_DELETING),
+    Command.SEARCH_BY_TAG: (KeyboardHints.SEARCH_BY_TAG, Keyboard.FAQ_AND_RETURN, State.SEARCH_BY_TAG),
+    Command.SEARCH_BY_WORD: (KeyboardHints.SEARCH_BY_WORD, Keyboard.FAQ_AND_RETURN, State.SEARCH_BY_WORD),
+    Command.CHANGE_ALIAS: (KeyboardHints.ALIAS_CHANGING, Keyboard.RETURN, State.ALIAS_CHANGING),
+}
+QUOTE_CREATION_STATES = {State.BOT_MENU: State.QUOTE_CREATION_BM, State.MY_QUOTES: State.QUOTE_CREATION_MQ}
+# state -> (state, hint, keyboard) after Command.RETURN
+RETURN_TARGETS = {
+    State.SEARCH_BY_WORD: (State.QUOTE_SEARCH, KeyboardHints.SEARCH_QUOTES_RETURN, Keyboard.QUOTE_SEARCH),
+    State.SEARCH_BY_TAG: (State.QUOTE_SEARCH, KeyboardHints.SEARCH_QUOTES_RETURN, Keyboard.QUOTE_SEARCH),
+    State.ALIAS_CHANGING: (State.BOT_MENU, KeyboardHints.BOT_MENU_RETURN, Keyboard.BOT_MENU),
+    State.QUOTE_CREATION_BM: (State.BOT_MENU, KeyboardHints.BOT_MENU_RETURN, Keyboard.BOT_MENU),
+    State.MY_QUOTES: (State.BOT_MENU, KeyboardHints.BOT_MENU_RETURN, Keyboard.BOT_MENU),
+    State.QUOTE_SEARCH: (State.BOT_MENU, KeyboardHints.BOT_MENU_RETURN, Keyboard.BOT_MENU),
+    State.QUOTE_CREATION_MQ: (State.MY_QUOTES, KeyboardHints.MY_QUOTES_RETURN, Keyboard.MY_QUOTES),
+    State.QUOTE_ADDING: (State.MY_QUOTES, KeyboardHints.MY_QUOTES_RETURN, Keyboard.MY_QUOTES),
+    State.QUOTE_DELETING: (State.MY_QUOTES, KeyboardHints.MY_QUOTES_RETURN, Keyboard.MY_QUOTES),
+}
+FAQ_PHRASES = {
+    State.QUOTE_CREATION_BM: GroupPhrases.QUOTE_FAQ,
+    State.QUOTE_CREATION_MQ: GroupPhrases.QUOTE_FAQ,
+    State.QUOTE_DELETING: GroupPhrases.DELETE_FAQ,
+    State.QUOTE_ADDING: GroupPhrases.ADD_FAQ,
+    State.SEARCH_BY_WORD: GroupPhrases.SEARCH_BY_WORD_FAQ,
+    State.SEARCH_BY_TAG: GroupPhrases.SEARCH_BY_TAG_FAQ,
+}
 
 
 class BotBase:
@@ -60,72 +129,130 @@ class BotBase:
             self.private = private
             self.search_param = search_param
 
-    def __init__(self, group_auth: dict, database_auth: dict):
+    def __init__(self, group_auth: dict, database_auth: dict, *, warm_up=False,
+                 word_search=WordSearchEngine.FULL_TEXT, bot_session=None, database=None, send_queue=None,
+                 deployment=Deployment.SINGLE_PROCESS):
         check_args({'group_auth': (group_auth, dict),
-                    'database_auth': (database_auth, dict)})
+                    'database_auth': (database_auth, dict),
+                    'word_search': (word_search, WordSearchEngine),
+                    'deployment': (deployment, Deployment)})
+        self.word_search = word_search
         self.group_token = group_auth['group_token']
         self.group_id = group_auth['group_id']
-        self.bot_session = vk_api.VkApi(token=self.group_token)
+        self.bot_session = bot_session or vk_api.VkApi(token=self.group_token)
         self.bot_api = self.bot_session.get_api()
-        self.db = Database(database_auth)
+        self.send_queue = send_queue or SendQueue((lambda: bot_session) if bot_session else self.create_session)
+        self.outbound = OutboundSender(self.send_queue)
+        self.db = database or Database(database_auth)
+        if deployment == Deployment.MULTI_INSTANCE:
+            # the next event of a user may go to another instance, the user's data are kept only in the database
+            self.sessions = SharedSessions(self.db)
+            self.searches = self.db
+        else:
+            self.sessions = SessionCache(self.db)
+            # the writes of other worker processes do not reach this process's caches
+            self.searches = SearchCache(self.db, cache_published=deployment == Deployment.SINGLE_PROCESS)
+        self.rendered_quotes = QuoteCache(self.db)
+        self.lemma_index = None
+        if word_search == WordSearchEngine.LEMMA_INDEX:
+            self.lemma_index = LemmaIndex(self.db)
+            self.lemma_index.load()
+        if warm_up:
+            self.initialize_data()
+
+    def create_session(self) -> vk_api.VkApi:
+        return vk_api.VkApi(token=self.group_token)
 
     def initialize_data(self):
-        pass
+        warm_up_morph()
+
+    def run(self, events=None):
+        asyncio.run(self.run_async(events))
+
+    async def run_async(self, events=None):
+        # events is any blocking iterator of bot events, by default the group long poll is listened
+        loop = asyncio.get_running_loop()
+        dispatcher = EventDispatcher(self.handle_event, max_workers=HANDLER_WORKERS)
+        try:
+            if events is not None:
+                await dispatcher.serve(events)
+                return
+            while True:
+                longpoll = await loop.run_in_executor(None, VkBotLongPoll, self.bot_session, self.group_id)
+                try:
+                    logger.info('Ожидание событий long poll')
+                    await dispatcher.serve(longpoll.listen())
+                except requests.exceptions.ReadTimeout:
+                    continue
+        finally:
+            dispatcher.close()
+
+    def get_event_labels(self, event: vk_api.bot_longpoll.VkBotMessageEvent) -> tuple or None:
+        # (command, state before the message) of a new message
+        if event.type != VkBotEventType.MESSAGE_NEW:
+            return None
+        vk_id = event.message.from_id
+        state = self.sessions.get_user_state(vk_id=vk_id) if self.sessions.user_exists(vk_id=vk_id) \
+            else State.ALIAS_INPUT
+        command = COMMAND_PHRASES.get(event.message['text'].lower(), Command.NOT_FOUND)
+        return command.name, state.name
+
+    def handle_event(self, event: vk_api.bot_longpoll.VkBotMessageEvent):
+        start = time.perf_counter()
+        labels = self.get_event_labels(event)
+        try:
+            with self.outbound.batch():
+                try:
+                    self.on_message(event)
+                except BotRuntimeError as e:
+                    metrics.errors_total.inc((e.code.name,))
+                    if e.need_reply:
+                        reply = "Ошибка: {}.".format(e.reply)
+                        self.send_message(peer_id=event.message.from_id, message=reply, keyboard=e.keyboard)
+                    else:
+                        logger.error('Ошибка с кодом %s: %s', e.code.name, e.what)
+                        raise e
+        finally:
+            if labels is not None:
+                metrics.handler_seconds.observe(labels, time.perf_counter() - start)
 
-    def run(self):
-        while True:
-            longpoll = VkBotLongPoll(self.bot_session, self.group_id)
-            try:
-                print('wait')
-                for event in longpoll.listen():
-                    print('got event')
-                    try:
-                        self.on_message(event)
-                    except BotRuntimeError as e:
-                        if e.need_reply:
-                            reply = "Ошибка: {}.".format(e.reply)
-                            self.send_message(peer_id=event.message.from_id, message=reply, keyboard=e.keyboard)
-                        else:
-                            print(e.code.value, e.what)
-                            self.db.close_connection()
-                            raise e
-
-            except requests.exceptions.ReadTimeout:
-                continue
+    @staticmethod
+    def render_quote(quote_id: int, quote: RenderedQuote, print_quote_id=False) -> tuple:
+        text = '<{}>\n'.format(quote_id) + quote.text if print_quote_id else quote.text
+        return text, quote.attachments
 
     def get_quote(self, quote_id: int, print_quote_id=False) -> tuple:
-        quote_data = self.db.get_quote(quote_id=quote_id)
-        quote = quote_data['text'] + '\n©' + quote_data['author']
-        if print_quote_id:
-            quote = '<{}>\n'.format(quote_id) + quote
-        print(quote_data['attachments'])
-        return quote, quote_data['attachments']
+        quote = self.rendered_quotes.get_quote(quote_id)
+        return self.render_quote(quote_id, quote, print_quote_id)
+
+    def get_quotes(self, quote_ids: list, print_quote_id=False) -> list:
+        return [self.render_quote(quote_id, quote, print_quote_id)
+                for quote_id, quote in self.rendered_quotes.get_quotes(quote_ids)]
 
     def print_quote_list(self, vk_id: int, quotes: list, keyboard: Keyboard, print_quote_id=False):
         message_rely = ''
-        print(quotes)
-        for quote in quotes:
-            new_quote = self.get_quote(quote, print_quote_id)
-            print(new_quote)
+        logger.debug('quote list %s', quotes)
+        for new_quote in self.get_quotes(quotes, print_quote_id):
             if not new_quote[1][0]:
                 if len(message_rely) + len(new_quote[0]) + 2 < VK_MESSAGE_LIMIT:
                     message_rely += "\n\n" + new_quote[0]
                 else:
-                    self.send_message(peer_id=vk_id, message=message_rely, keyboard=keyboard)
+                    self.send_message(peer_id=vk_id, message=message_rely, keyboard=keyboard, bulk=True)
                     message_rely = new_quote[0]
             else:
                 if message_rely:
-                    self.send_message(peer_id=vk_id, message=message_rely, keyboard=keyboard)
+                    self.send_message(peer_id=vk_id, message=message_rely, keyboard=keyboard, bulk=True)
                     message_rely = ''
-                self.send_message(peer_id=vk_id, message=new_quote[0], attachment=new_quote[1][0], keyboard=keyboard)
+                self.send_message(peer_id=vk_id, message=new_quote[0], attachment=new_quote[1][0], keyboard=keyboard,
+                                  bulk=True)
         if message_rely:
-            self.send_message(peer_id=vk_id, message=message_rely, keyboard=keyboard)
+            self.send_message(peer_id=vk_id, message=message_rely, keyboard=keyboard, bulk=True)
 
     def on_message(self, event: vk_api.bot_longpoll.VkBotMessageEvent):
         if event.type == VkBotEventType.MESSAGE_NEW:
             vk_id = event.message.from_id
-            user_exists = self.db.user_exists(vk_id=vk_id)
-            user_state = self.db.get_user_state(vk_id=vk_id) if user_exists else State.ALIAS_INPUT
+            user_exists = self.sessions.user_exists(vk_id=vk_id)
+            user_state = self.sessions.get_user_state(vk_id=vk_id) if user_exists else State.ALIAS_INPUT
             try:
                 parse_result = self.parse_message(raw_message=event.message['text'], state=user_state)
             except BotRuntimeError as e:
@@ -134,380 +261,328 @@ class BotBase:
                                       State.SEARCH_BY_WORD, State.SEARCH_BY_TAG]:
                         e.keyboard = Keyboard.FAQ_AND_RETURN
                     else:
-                        self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
+                        self.sessions.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
                         e.keyboard = Keyboard.BOT_MENU
                 raise e
             if parse_result.bot_command and user_exists or parse_result.command == Command.BOT_START:
-                if parse_result.command == Command.BOT_START:
-                    print("BOT_START")
-                    if user_exists:
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.BOT_MENU_RETURN.value,
-                                          keyboard=Keyboard.BOT_MENU)
-                        self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
-                    else:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.ALIAS_INPUT.value)
-
-                elif parse_result.command == Command.CREATE_QUOTE:
-                    print("CREATE_QUOTE")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_CREATING.value,
-                                      keyboard=Keyboard.FAQ_AND_RETURN)
-                    if user_state == State.BOT_MENU:
-                        self.db.set_user_state(vk_id=vk_id, state=State.QUOTE_CREATION_BM)
-                    elif user_state == State.MY_QUOTES:
-                        self.db.set_user_state(vk_id=vk_id, state=State.QUOTE_CREATION_MQ)
-                    else:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
-                                              "unknown command \"{}\"".format(parse_result.command), False)
-
-                elif parse_result.command == Command.MY_QUOTES:
-                    print("MY_QUOTES")
-                    quotes = self.db.get_my_quotes(vk_id=vk_id)
-                    if quotes:
-                        self.print_quote_list(vk_id=vk_id, quotes=quotes, keyboard=Keyboard.MY_QUOTES,
-                                              print_quote_id=True)
-                    else:
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.MY_QUOTES_EMPTY.value,
-                                          keyboard=Keyboard.MY_QUOTES)
-                    self.db.set_user_state(vk_id=vk_id, state=State.MY_QUOTES)
-
-                elif parse_result.command == Command.SEARCH_QUOTE:
-                    print("SEARCH_QUOTE")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.SEARCH_MENU.value,
-                                      keyboard=Keyboard.QUOTE_SEARCH)
-                    self.db.set_user_state(vk_id=vk_id, state=State.QUOTE_SEARCH)
-
-                elif parse_result.command == Command.ADD_QUOTE:
-                    print("ADD_QUOTE")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_ADDING.value
-                                      , keyboard=Keyboard.FAQ_AND_RETURN)
-                    self.db.set_user_state(vk_id=vk_id, state=State.QUOTE_ADDING)
-
-                elif parse_result.command == Command.DELETE_QUOTE:
-                    print("DELETE_QUOTE")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_DELETING.value,
-                                      keyboard=Keyboard.FAQ_AND_RETURN)
-                    self.db.set_user_state(vk_id=vk_id, state=State.QUOTE_DELETING)
-
-                elif parse_result.command == Command.SEARCH_BY_TAG:
-                    print("SEARCH_BY_TAG")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.SEARCH_BY_TAG.value,
-                                      keyboard=Keyboard.FAQ_AND_RETURN)
-                    self.db.set_user_state(vk_id=vk_id, state=State.SEARCH_BY_TAG)
-
-                elif parse_result.command == Command.SEARCH_BY_WORD:
-                    print("SEARCH_BY_WORD")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.SEARCH_BY_WORD.value,
-                                      keyboard=Keyboard.FAQ_AND_RETURN)
-                    self.db.set_user_state(vk_id=vk_id, state=State.SEARCH_BY_WORD)
-
-                elif parse_result.command == Command.RANDOM_SEARCH:
-                    print("RANDOM_SEARCH")
-                    quotes = self.db.get_quotes_on_random(max_amount=RANDOM_SEARCH_QUOTES_AMOUNT)
-                    self.print_quote_list(vk_id=vk_id, quotes=quotes, keyboard=Keyboard.QUOTE_SEARCH,
-                                          print_quote_id=True)
-
-                elif parse_result.command == Command.CHANGE_ALIAS:
-                    print("CHANGE_ALIAS")
-                    self.send_message(peer_id=vk_id, message=KeyboardHints.ALIAS_CHANGING.value,
-                                      keyboard=Keyboard.RETURN)
-                    self.db.set_user_state(vk_id=vk_id, state=State.ALIAS_CHANGING)
-
-                elif parse_result.command == Command.RETURN:
-                    if user_state in [State.SEARCH_BY_WORD, State.SEARCH_BY_TAG]:
-                        self.db.set_user_state(vk_id=vk_id, state=State.QUOTE_SEARCH)
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.SEARCH_QUOTES_RETURN.value,
-                                          keyboard=Keyboard.QUOTE_SEARCH)
-                    elif user_state in [State.ALIAS_CHANGING, State.QUOTE_CREATION_BM, State.MY_QUOTES,
-                                        State.QUOTE_SEARCH]:
-                        self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.BOT_MENU_RETURN.value,
-                                          keyboard=Keyboard.BOT_MENU)
-                    elif user_state in [State.QUOTE_CREATION_MQ, State.QUOTE_ADDING, State.QUOTE_DELETING]:
-                        self.db.set_user_state(vk_id=vk_id, state=State.MY_QUOTES)
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.MY_QUOTES_RETURN.value,
-                                          keyboard=Keyboard.MY_QUOTES)
-                    else:
-                        self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
-                                              "unknown command \"{}\"".format(parse_result.command), True,
-                                              reply=ErrorPhrases.STATE_ERROR, keyboard=Keyboard.BOT_MENU)
-
-                elif parse_result.command == Command.FAQ:
-                    if user_state in [State.QUOTE_CREATION_BM, State.QUOTE_CREATION_MQ]:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.QUOTE_FAQ.value,
-                                          keyboard=Keyboard.RETURN)
-                    elif user_state == State.QUOTE_DELETING:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.DELETE_FAQ.value,
-                                          keyboard=Keyboard.RETURN)
-                    elif user_state == State.QUOTE_ADDING:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.ADD_FAQ.value,
-                                          keyboard=Keyboard.RETURN)
-                    elif user_state == State.SEARCH_BY_WORD:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.SEARCH_BY_WORD_FAQ.value,
-                                          keyboard=Keyboard.RETURN)
-                    elif user_state == State.SEARCH_BY_TAG:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.SEARCH_BY_TAG_FAQ.value,
-                                          keyboard=Keyboard.RETURN)
-                    else:
-                        self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
-                                              "unknown command \"{}\"".format(parse_result.command), True,
-                                              reply=ErrorPhrases.STATE_ERROR, keyboard=Keyboard.BOT_MENU)
-
-                else:
-                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
-                                          "unknown command \"{}\"".format(parse_result.command), False)
-
+                handler = self.handlers.get((parse_result.command, user_state)) \
+                          or self.handlers.get((parse_result.command, None), BotBase.on_unknown_command)
+            elif not user_exists:
+                handler = BotBase.on_alias_input
             else:
-                if not user_exists:
-                    if user_state == State.ALIAS_INPUT:
-                        alias = parse_result.text
-                        if not self.db.alias_exists(alias=alias):
-                            self.send_message(peer_id=vk_id,
-                                              message="Псевдоним ©{} успешно установлен.".format(alias),
-                                              keyboard=Keyboard.BOT_MENU)
-                            self.db.create_user(vk_id=vk_id, alias=alias)
-                            self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
-                        else:
-                            raise BotRuntimeError(BotRuntimeError.ErrorCodes.ALIAS_ERROR, "alias already exists", True,
-                                                  reply=ErrorPhrases.ALIAS_ALREADY_EXISTS.value)
-                    else:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.STATE_ERROR,
-                                              "unexpected state for unauthorized user", False)
-                elif user_state in [State.QUOTE_CREATION_BM, State.QUOTE_CREATION_MQ]:
-                    if len(event.message.attachments) > 1:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.ATTACHMENT_ERROR,
-                                              "invalid amount of attachments", True,
-                                              reply=ErrorPhrases.QUOTE_CREATION_ERROR_12.value,
-                                              keyboard=Keyboard.FAQ_AND_RETURN)
-                    print(event.message.attachments)
-                    attachment = ''
-                    if event.message.attachments:
-                        attachment = event.message.attachments[0]
-                        if attachment['type'] == 'photo':
-                            print(attachment)
-                            if 'access_key' in attachment['photo'].keys():
-                                attachment = 'photo{}_{}_{}'.format(attachment['photo']['owner_id'],
-                                                                    attachment['photo']['id'],
-                                                                    attachment['photo']['access_key'])
-                            else:
-                                attachment = 'photo{}_{}'.format(attachment['photo']['owner_id'],
-                                                                 attachment['photo']['id'])
-                        elif attachment['type'] == 'audio':
-                            if 'access_key' in attachment['audio'].keys():
-                                attachment = 'audio{}_{}_{}'.format(attachment['audio']['owner_id'],
-                                                                    attachment['audio']['id'],
-                                                                    attachment['audio']['access_key'])
-                            else:
-                                attachment = 'audio{}_{}'.format(attachment['audio']['owner_id'],
-                                                                 attachment['audio']['id'])
-                        else:
-                            raise BotRuntimeError(BotRuntimeError.ErrorCodes.ATTACHMENT_ERROR,
-                                                  "invalid type of attachment", True,
-                                                  reply=ErrorPhrases.QUOTE_CREATION_ERROR_13.value,
-                                                  keyboard=Keyboard.FAQ_AND_RETURN)
-
-                    author = parse_result.author if parse_result.author else self.db.get_user_alias(vk_id=vk_id)
-                    print(parse_result.text, author)
-                    quote_id = self.db.create_quote(vk_id=vk_id, text=parse_result.text, tags=parse_result.tags,
-                                                    author=author, attachments=[attachment])
-                    saved_quote = self.get_quote(quote_id=quote_id)
-                    print(saved_quote)
-                    reply = 'Высказывание сохранено:\n' + saved_quote[0]
-                    self.send_message(peer_id=vk_id, message=reply, attachment=saved_quote[1][0],
-                                      keyboard=Keyboard.FAQ_AND_RETURN)
-
-                elif user_state in [State.SEARCH_BY_WORD, State.SEARCH_BY_TAG]:
-                    print("SEARCH_BY: WORD / TAG")
-                    if user_state == State.SEARCH_BY_WORD:
-                        quotes = self.db.get_quotes_by_word(vk_id=vk_id,
-                                                            word_states=get_word_states(word=parse_result.text),
-                                                            search_param=parse_result.search_param,
-                                                            max_amount=SEARCH_QUOTES_AMOUNT)
-                    else:
-                        quotes = self.db.get_quotes_by_tag(vk_id=vk_id, tags=parse_result.tags,
-                                                           search_param=parse_result.search_param,
-                                                           max_amount=SEARCH_QUOTES_AMOUNT)
-                    if quotes:
-                        self.print_quote_list(vk_id=vk_id, quotes=quotes, keyboard=Keyboard.RETURN,
-                                              print_quote_id=True)
-                    else:
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.SEARCH_EMPTY.value,
-                                          keyboard=Keyboard.FAQ_AND_RETURN)
-
-                elif user_state == State.ALIAS_CHANGING:
-                    alias = parse_result.text
-                    if not self.db.alias_exists(alias=alias):
-                        self.send_message(peer_id=vk_id, message=GroupPhrases.ALIAS_CHANGED.value,
-                                          keyboard=Keyboard.BOT_MENU)
-                        self.db.set_user_alias(vk_id=vk_id, alias=alias)
-                        self.db.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
-                    else:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.ALIAS_ERROR, "alias already exists", True,
-                                              reply=ErrorPhrases.ALIAS_ALREADY_EXISTS.value, keyboard=Keyboard.RETURN)
-
-                elif user_state in [State.QUOTE_ADDING, State.QUOTE_DELETING]:
-                    quote = self.db.get_quote(quote_id=int(parse_result.text))
-                    if quote is None:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.ID_ERROR, "id not exists", True,
-                                              reply=ErrorPhrases.QUOTE_ID_NOT_EXISTS.value,
-                                              keyboard=Keyboard.FAQ_AND_RETURN)
-                    if user_state == State.QUOTE_ADDING:
-                        self.db.add_quote_to_user(vk_id=vk_id, quote_id=int(parse_result.text))
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_ADDED.value,
-                                          keyboard=Keyboard.RETURN)
-                    else:
-                        self.db.remove_user_quote(vk_id=vk_id, quote_id=int(parse_result.text))
-                        self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_DELETED.value,
-                                          keyboard=Keyboard.RETURN)
-
-                else:
-                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.STATE_ERROR, "command not found", True,
-                                          reply=ErrorPhrases.STATE_ERROR.value, keyboard=Keyboard.BOT_MENU)
-
-            print(event.message['from_id'], event.message['text'])
+                handler = self.handlers.get((Command.NOT_FOUND, user_state), BotBase.on_unknown_input)
+            handler(self, vk_id, user_state, parse_result, event)
+            logger.debug('message handled', extra={'vk_id': vk_id, 'state': user_state.name,
+                                                   'command': parse_result.command.name})
         elif event.type == VkBotEventType.MESSAGE_REPLY:
             if event.object.text == GroupPhrases.GREETINGS.value:
                 self.send_message(peer_id=event.object.from_id, message=GroupPhrases.ALIAS_INPUT.value)
 
-    def parse_message(self, raw_message: str, state: State) -> ParseResult:
-        message = raw_message.lower()
-        print('msg:', message, 'state:', state)
-        if message in [UserPhrases.START_RUS.value, UserPhrases.START_EN.value]:
-            return self.ParseResult(True, command=Command.BOT_START)
-        elif message == UserPhrases.CREATE_QUOTE.value:
-            return self.ParseResult(True, command=Command.CREATE_QUOTE)
-        elif message == UserPhrases.ADD_QUOTE.value:
-            return self.ParseResult(True, command=Command.ADD_QUOTE)
-        elif message == UserPhrases.DELETE_QUOTE.value:
-            return self.ParseResult(True, command=Command.DELETE_QUOTE)
-        elif message == UserPhrases.SEARCH_QUOTE.value:
-            return self.ParseResult(True, command=Command.SEARCH_QUOTE)
-        elif message == UserPhrases.SEARCH_BY_WORD.value:
-            return self.ParseResult(True, command=Command.SEARCH_BY_WORD)
-        elif message == UserPhrases.SEARCH_BY_TAG.value:
-            return self.ParseResult(True, command=Command.SEARCH_BY_TAG)
-        elif message == UserPhrases.RANDOM_SEARCH.value:
-            return self.ParseResult(True, command=Command.RANDOM_SEARCH)
-        elif message == UserPhrases.MY_QUOTES.value:
-            return self.ParseResult(True, command=Command.MY_QUOTES)
-        elif message == UserPhrases.CHANGE_ALIAS.value:
-            return self.ParseResult(True, command=Command.CHANGE_ALIAS)
-        elif message == UserPhrases.FAQ.value:
-            return self.ParseResult(True, command=Command.FAQ)
-        elif message == UserPhrases.RETURN.value:
-            return self.ParseResult(True, command=Command.RETURN)
-        elif state in [State.QUOTE_CREATION_BM, State.QUOTE_CREATION_MQ]:
-            if message[0] == '@':
-                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, 'empty quote', True,
-                                      reply=ErrorPhrases.QUOTE_CREATION_ERROR_1.value)
-            else:
-                splited = re.split(r'@', raw_message + ' ')
-                text = splited[0].strip()
-                if len(text) > QUOTE_LENGTH_LIMIT:
-                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "quote length limit exceeded",
-                                          True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_11.value)
-                author = ''
-                private = False
-                tags = None
-                print(splited)
-                for param in splited[1:]:
-                    if not param:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "empty param passed", True,
-                                              reply=ErrorPhrases.QUOTE_CREATION_ERROR_2.value)
-                    elif param[:2] not in ['a ', 't ', 'p ']:
-                        raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "unknown param passed", True,
-                                              reply=ErrorPhrases.QUOTE_CREATION_ERROR_3.value)
-                    if param[0] == 'a':
-                        if author != '':
-                            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several authors passed",
-                                                  True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_6.value)
-                        author_name = param[1:].strip()
-                        if author_name[0] == '"' and author_name[-1] == '"':
-                            if not len(author_name[1:-1]):
-                                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "empty quotes passed",
-                                                      True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_4.value)
-                            elif author_name[1:-1].count('"'):
-                                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several authors passed",
-                                                      True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_5.value)
-                            author_name = author_name[1:-1]
-
-                        else:
-                            if author_name.count(' '):
-                                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "quotes expected",
-                                                      True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_7.value)
-                        if len(author_name) > AUTHOR_NAME_LENGTH_LIMIT:
-                            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "author name length limit",
-                                                  True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_15.value)
-                        author = author_name
-
-                    elif param[0] == 't':
-                        if tags is not None:
-                            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several tag param passed",
-                                                  True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_8.value)
-                        tag_args = param[1:].strip()
-                        if tag_args[0] == '"' and tag_args[-1] == '"':
-                            if not len(tag_args[1:-1]):
-                                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "empty quotes passed",
-                                                      True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_4.value)
-                            elif tag_args[1:-1].count('"'):
-                                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR,
-                                                      "several quotes args passed",
-                                                      True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_9.value)
-                            tags = tag_args[1:-1].split()
-                            for tag in tags:
-                                if len(tag) > TAG_LENGTH_LIMIT:
-                                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "tag length limit",
-                                                          True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_14.value)
-                        else:
-                            if tag_args.count(' '):
-                                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "quotes expected",
-                                                      True, reply=ErrorPhrases.QUOTE_CREATION_ERROR_10.value)
-                            else:
-                                tags = [tag_args]
-                    else:
-                        private = True
-
-                print([text, author, tags, private])
-
-                return self.ParseResult(False, text=text, tags=tags, author=author, private=private)
-
-        elif state in [State.SEARCH_BY_WORD, State.SEARCH_BY_TAG]:
-            splited = re.split(r'@', raw_message)
-            if len(splited) > 2:
-                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several args passed", True,
-                                      reply=ErrorPhrases.SEARCH_ERROR_1.value)
-            word = splited[0].strip()
-            if state == State.SEARCH_BY_WORD and word.count(' '):
-                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several words passed", True,
-                                      reply=ErrorPhrases.SEARCH_ERROR_3.value)
-            search_param = SearchParams.ALL
-            if len(splited) == 2:
-                param = splited[1].strip()
-                if param in ['a', 'p']:
-                    if param == 'a':
-                        search_param = SearchParams.PUBLIC
-                    else:
-                        search_param = SearchParams.PRIVATE
-                else:
-                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "unknown param passed", True,
-                                          reply=ErrorPhrases.SEARCH_ERROR_2.value)
-            if state == State.SEARCH_BY_WORD:
-                return self.ParseResult(False, text=word, search_param=search_param)
-            else:
-                return self.ParseResult(False, tags=word.split(), search_param=search_param)
+    # handlers of on_message: (vk_id, state of the user, parsed message, event)
 
-        elif state in [State.ALIAS_CHANGING, State.ALIAS_INPUT, State.QUOTE_ADDING, State.QUOTE_DELETING]:
-            alias = raw_message.strip()
-            return self.ParseResult(False, text=alias)
+    def on_bot_start(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        if self.sessions.user_exists(vk_id=vk_id):
+            self.send_message(peer_id=vk_id, message=KeyboardHints.BOT_MENU_RETURN.value, keyboard=Keyboard.BOT_MENU)
+            self.sessions.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
+        else:
+            self.send_message(peer_id=vk_id, message=GroupPhrases.ALIAS_INPUT.value)
+
+    def on_navigation(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        hint, keyboard, state = NAVIGATION[parse_result.command]
+        self.send_message(peer_id=vk_id, message=hint.value, keyboard=keyboard)
+        self.sessions.set_user_state(vk_id=vk_id, state=state)
+
+    def on_create_quote(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_CREATING.value, keyboard=Keyboard.FAQ_AND_RETURN)
+        state = QUOTE_CREATION_STATES.get(user_state)
+        if state is None:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
+                                  "unknown command \"{}\"".format(parse_result.command), False)
+        self.sessions.set_user_state(vk_id=vk_id, state=state)
+
+    def on_my_quotes(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        quotes = self.db.get_my_quotes(vk_id=vk_id)
+        if quotes:
+            self.print_quote_list(vk_id=vk_id, quotes=quotes, keyboard=Keyboard.MY_QUOTES, print_quote_id=True)
+        else:
+            self.send_message(peer_id=vk_id, message=KeyboardHints.MY_QUOTES_EMPTY.value, keyboard=Keyboard.MY_QUOTES)
+        self.sessions.set_user_state(vk_id=vk_id, state=State.MY_QUOTES)
+
+    def on_random_search(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        quotes = self.db.get_quotes_on_random(max_amount=RANDOM_SEARCH_QUOTES_AMOUNT)
+        self.print_quote_list(vk_id=vk_id, quotes=quotes, keyboard=Keyboard.QUOTE_SEARCH, print_quote_id=True)
+
+    def on_return(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        state, hint, keyboard = RETURN_TARGETS.get(user_state, (State.BOT_MENU, None, None))
+        self.sessions.set_user_state(vk_id=vk_id, state=state)
+        if hint is None:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
+                                  "unknown command \"{}\"".format(parse_result.command), True,
+                                  reply=ErrorPhrases.STATE_ERROR.value, keyboard=Keyboard.BOT_MENU)
+        self.send_message(peer_id=vk_id, message=hint.value, keyboard=keyboard)
+
+    def on_faq(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        faq = FAQ_PHRASES.get(user_state)
+        if faq is None:
+            self.sessions.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
+                                  "unknown command \"{}\"".format(parse_result.command), True,
+                                  reply=ErrorPhrases.STATE_ERROR.value, keyboard=Keyboard.BOT_MENU)
+        self.send_message(peer_id=vk_id, message=faq.value, keyboard=Keyboard.RETURN)
+
+    def on_unknown_command(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        raise BotRuntimeError(BotRuntimeError.ErrorCodes.COMMAND_ERROR,
+                              "unknown command \"{}\"".format(parse_result.command), False)
+
+    def on_alias_input(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        if user_state != State.ALIAS_INPUT:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.STATE_ERROR,
+                                  "unexpected state for unauthorized user", False)
+        alias = parse_result.text
+        if self.db.alias_exists(alias=alias):
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.ALIAS_ERROR, "alias already exists", True,
+                                  reply=ErrorPhrases.ALIAS_ALREADY_EXISTS.value)
+        self.send_message(peer_id=vk_id, message="Псевдоним ©{} успешно установлен.".format(alias),
+                          keyboard=Keyboard.BOT_MENU)
+        self.sessions.create_user(vk_id=vk_id, alias=alias)
+        self.sessions.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
+
+    def on_quote_input(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        if len(event.message.attachments) > 1:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.ATTACHMENT_ERROR, "invalid amount of attachments", True,
+                                  reply=ErrorPhrases.QUOTE_CREATION_ERROR_12.value, keyboard=Keyboard.FAQ_AND_RETURN)
+        attachment = ''
+        if event.message.attachments:
+            attachment = event.message.attachments[0]
+            if attachment['type'] not in ['photo', 'audio']:
+                raise BotRuntimeError(BotRuntimeError.ErrorCodes.ATTACHMENT_ERROR, "invalid type of attachment", True,
+                                      reply=ErrorPhrases.QUOTE_CREATION_ERROR_13.value,
+                                      keyboard=Keyboard.FAQ_AND_RETURN)
+            media = attachment[attachment['type']]
+            attachment = '{}{}_{}'.format(attachment['type'], media['owner_id'], media['id'])
+            if 'access_key' in media:
+                attachment += '_' + media['access_key']
+
+        author = parse_result.author if parse_result.author else self.sessions.get_user_alias(vk_id=vk_id)
+        quote_data = self.searches.create_quote(vk_id=vk_id, text=parse_result.text, tags=parse_result.tags,
+                                                author=author, attachments=[attachment])
+        if self.lemma_index is not None:
+            self.lemma_index.add_quote(quote_data['quote_id'], quote_data['text'], quote_data['private'])
+        saved_quote = self.render_quote(quote_data['quote_id'], self.rendered_quotes.put(quote_data))
+        logger.debug('quote created', extra={'vk_id': vk_id, 'quote_id': quote_data['quote_id']})
+        reply = 'Высказывание сохранено:\n' + saved_quote[0]
+        self.send_message(peer_id=vk_id, message=reply, attachment=saved_quote[1][0], keyboard=Keyboard.FAQ_AND_RETURN)
+
+    def on_search_input(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        if user_state == State.SEARCH_BY_WORD and self.word_search == WordSearchEngine.FULL_TEXT:
+            quotes = self.searches.get_quotes_by_word(vk_id=vk_id, word=parse_result.text,
+                                                      search_param=parse_result.search_param,
+                                                      max_amount=SEARCH_RESULTS_LIMIT)
+        elif user_state == State.SEARCH_BY_WORD and self.word_search == WordSearchEngine.LEMMA_INDEX:
+            quotes = self.lemma_index.get_quotes_by_word(vk_id=vk_id, word=parse_result.text,
+                                                         search_param=parse_result.search_param,
+                                                         max_amount=SEARCH_RESULTS_LIMIT)
+        elif user_state == State.SEARCH_BY_WORD:
+            quotes = self.searches.get_quotes_by_word_states(vk_id=vk_id,
+                                                             word_states=get_word_states(word=parse_result.text),
+                                                             search_param=parse_result.search_param,
+                                                             max_amount=SEARCH_RESULTS_LIMIT)
+        else:
+            quotes = self.searches.get_quotes_by_tag(vk_id=vk_id, tags=parse_result.tags,
+                                                     search_param=parse_result.search_param,
+                                                     max_amount=SEARCH_RESULTS_LIMIT)
+        if quotes:
+            self.sessions.start_search(vk_id=vk_id, quote_ids=quotes)
+            self.print_search_page(vk_id=vk_id)
         else:
+            self.send_message(peer_id=vk_id, message=GroupPhrases.SEARCH_EMPTY.value, keyboard=Keyboard.FAQ_AND_RETURN)
+
+    def on_next_page(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        # served from the ids kept by the search, the quotes table is not searched again
+        if not self.sessions.search_remaining(vk_id=vk_id):
+            self.send_message(peer_id=vk_id, message=KeyboardHints.SEARCH_END.value, keyboard=Keyboard.FAQ_AND_RETURN)
+            return
+        self.print_search_page(vk_id=vk_id)
+
+    def on_next_page_outside_search(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        # the cursor of a search is dropped with the search state, a late "дальше" has nothing to show
+        self.sessions.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
+        raise BotRuntimeError(BotRuntimeError.ErrorCodes.STATE_ERROR, "no search to continue", True,
+                              reply=ErrorPhrases.STATE_ERROR.value, keyboard=Keyboard.BOT_MENU)
+
+    def print_search_page(self, vk_id: int):
+        quotes = self.sessions.next_search_page(vk_id=vk_id, amount=SEARCH_QUOTES_AMOUNT)
+        keyboard = Keyboard.SEARCH_RESULTS if self.sessions.search_remaining(vk_id=vk_id) else Keyboard.RETURN
+        self.print_quote_list(vk_id=vk_id, quotes=quotes, keyboard=keyboard, print_quote_id=True)
+
+    def on_alias_change(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        alias = parse_result.text
+        if self.db.alias_exists(alias=alias):
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.ALIAS_ERROR, "alias already exists", True,
+                                  reply=ErrorPhrases.ALIAS_ALREADY_EXISTS.value, keyboard=Keyboard.RETURN)
+        self.send_message(peer_id=vk_id, message=GroupPhrases.ALIAS_CHANGED.value, keyboard=Keyboard.BOT_MENU)
+        self.sessions.set_user_alias(vk_id=vk_id, alias=alias)
+        self.sessions.set_user_state(vk_id=vk_id, state=State.BOT_MENU)
+
+    def on_quote_id_input(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        quote_id = int(parse_result.text)
+        quote = self.rendered_quotes.get_quote(quote_id)
+        if quote is None:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.ID_ERROR, "id not exists", True,
+                                  reply=ErrorPhrases.QUOTE_ID_NOT_EXISTS.value, keyboard=Keyboard.FAQ_AND_RETURN)
+        if user_state == State.QUOTE_ADDING:
+            self.searches.add_quote_to_user(vk_id=vk_id, quote_id=quote_id)
+            self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_ADDED.value, keyboard=Keyboard.RETURN)
+        else:
+            self.searches.remove_user_quote(vk_id=vk_id, quote_id=quote_id)
+            # the quote is hidden from the search once nobody keeps it
+            self.rendered_quotes.invalidate(quote_id)
+            if self.lemma_index is not None:
+                self.lemma_index.set_private(quote_id, self.rendered_quotes.get_quote(quote_id).private)
+            self.send_message(peer_id=vk_id, message=KeyboardHints.QUOTE_DELETED.value, keyboard=Keyboard.RETURN)
+
+    def on_unknown_input(self, vk_id: int, user_state: State, parse_result: ParseResult, event):
+        raise BotRuntimeError(BotRuntimeError.ErrorCodes.STATE_ERROR, "command not found", True,
+                              reply=ErrorPhrases.STATE_ERROR.value, keyboard=Keyboard.BOT_MENU)
+
+    # (command, state of the user) -> handler, state None matches any state; messages that are not commands
+    # come as Command.NOT_FOUND
+    handlers = {
+        (Command.BOT_START, None): on_bot_start,
+        (Command.CREATE_QUOTE, None): on_create_quote,
+        (Command.SEARCH_QUOTE, None): on_navigation,
+        (Command.MY_QUOTES, None): on_my_quotes,
+        (Command.SEARCH_BY_WORD, None): on_navigation,
+        (Command.SEARCH_BY_TAG, None): on_navigation,
+        (Command.RANDOM_SEARCH, None): on_random_search,
+        (Command.ADD_QUOTE, None): on_navigation,
+        (Command.DELETE_QUOTE, None): on_navigation,
+        (Command.CHANGE_ALIAS, None): on_navigation,
+        (Command.FAQ, None): on_faq,
+        (Command.RETURN, None): on_return,
+        (Command.NEXT_PAGE, State.SEARCH_BY_WORD): on_next_page,
+        (Command.NEXT_PAGE, State.SEARCH_BY_TAG): on_next_page,
+        (Command.NEXT_PAGE, None): on_next_page_outside_search,
+        (Command.NOT_FOUND, State.QUOTE_CREATION_BM): on_quote_input,
+        (Command.NOT_FOUND, State.QUOTE_CREATION_MQ): on_quote_input,
+        (Command.NOT_FOUND, State.SEARCH_BY_WORD): on_search_input,
+        (Command.NOT_FOUND, State.SEARCH_BY_TAG): on_search_input,
+        (Command.NOT_FOUND, State.ALIAS_CHANGING): on_alias_change,
+        (Command.NOT_FOUND, State.QUOTE_ADDING): on_quote_id_input,
+        (Command.NOT_FOUND, State.QUOTE_DELETING): on_quote_id_input,
+    }
+
+    def parse_message(self, raw_message: str, state: State) -> ParseResult:
+        command = COMMAND_PHRASES.get(raw_message.lower())
+        if command is not None:
+            return self.ParseResult(True, command=command)
+        parser = self.parsers.get(state)
+        if parser is None:
             raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "unknown parse behavior", True,
                                   reply=ErrorPhrases.PARSE_UNKNOWN_BEHAVIOR.value)
-
-    def send_message(self, peer_id: int, *, message='', attachment='', keyboard=Keyboard.EMPTY):
+        return parser(self, raw_message, state)
+
+    @staticmethod
+    def parse_param_value(value: str, several_error: ErrorPhrases, spaces_error: ErrorPhrases) -> str:
+        # a parameter value is one word or a text in a pair of quotes
+        if not value:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "empty param passed", True,
+                                  reply=ErrorPhrases.QUOTE_CREATION_ERROR_2.value)
+        if value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+            if not value:
+                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "empty quotes passed", True,
+                                      reply=ErrorPhrases.QUOTE_CREATION_ERROR_4.value)
+            if '"' in value:
+                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several quotes args passed", True,
+                                      reply=several_error.value)
+        elif ' ' in value:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "quotes expected", True,
+                                  reply=spaces_error.value)
+        return value
+
+    def parse_quote(self, raw_message: str, state: State) -> ParseResult:
+        splited = (raw_message + ' ').split(PARAM_SEPARATOR)
+        text = splited[0].strip()
+        if not text:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, 'empty quote', True,
+                                  reply=ErrorPhrases.QUOTE_CREATION_ERROR_1.value)
+        if len(text) > QUOTE_LENGTH_LIMIT:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "quote length limit exceeded", True,
+                                  reply=ErrorPhrases.QUOTE_CREATION_ERROR_11.value)
+        author = ''
+        private = False
+        tags = None
+        for param in splited[1:]:
+            token = QUOTE_PARAM.fullmatch(param)
+            if not param:
+                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "empty param passed", True,
+                                      reply=ErrorPhrases.QUOTE_CREATION_ERROR_2.value)
+            elif token is None:
+                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "unknown param passed", True,
+                                      reply=ErrorPhrases.QUOTE_CREATION_ERROR_3.value)
+            key, value = token.group(1), token.group(2).strip()
+            if key == 'a':
+                if author:
+                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several authors passed", True,
+                                          reply=ErrorPhrases.QUOTE_CREATION_ERROR_6.value)
+                author = self.parse_param_value(value, ErrorPhrases.QUOTE_CREATION_ERROR_5,
+                                                ErrorPhrases.QUOTE_CREATION_ERROR_7)
+                if len(author) > AUTHOR_NAME_LENGTH_LIMIT:
+                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "author name length limit", True,
+                                          reply=ErrorPhrases.QUOTE_CREATION_ERROR_15.value)
+            elif key == 't':
+                if tags is not None:
+                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several tag param passed", True,
+                                          reply=ErrorPhrases.QUOTE_CREATION_ERROR_8.value)
+                tags = self.parse_param_value(value, ErrorPhrases.QUOTE_CREATION_ERROR_9,
+                                              ErrorPhrases.QUOTE_CREATION_ERROR_10).split()
+                if any(len(tag) > TAG_LENGTH_LIMIT for tag in tags):
+                    raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "tag length limit", True,
+                                          reply=ErrorPhrases.QUOTE_CREATION_ERROR_14.value)
+            else:
+                private = True
+        return self.ParseResult(False, text=text, tags=tags, author=author, private=private)
+
+    def parse_search(self, raw_message: str, state: State) -> ParseResult:
+        splited = raw_message.split(PARAM_SEPARATOR)
+        if len(splited) > 2:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several args passed", True,
+                                  reply=ErrorPhrases.SEARCH_ERROR_1.value)
+        word = splited[0].strip()
+        if state == State.SEARCH_BY_WORD and ' ' in word:
+            raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "several words passed", True,
+                                  reply=ErrorPhrases.SEARCH_ERROR_3.value)
+        search_param = SearchParams.ALL
+        if len(splited) == 2:
+            search_param = SEARCH_PARAMS.get(splited[1].strip())
+            if search_param is None:
+                raise BotRuntimeError(BotRuntimeError.ErrorCodes.PARSE_ERROR, "unknown param passed", True,
+                                      reply=ErrorPhrases.SEARCH_ERROR_2.value)
+        if state == State.SEARCH_BY_WORD:
+            return self.ParseResult(False, text=word, search_param=search_param)
+        return self.ParseResult(False, tags=word.split(), search_param=search_param)
+
+    def parse_text(self, raw_message: str, state: State) -> ParseResult:
+        return self.ParseResult(False, text=raw_message.strip())
+
+    # state of the user -> parser of a message that is not a command
+    parsers = {
+        State.QUOTE_CREATION_BM: parse_quote,
+        State.QUOTE_CREATION_MQ: parse_quote,
+        State.SEARCH_BY_WORD: parse_search,
+        State.SEARCH_BY_TAG: parse_search,
+        State.ALIAS_CHANGING: parse_text,
+        State.ALIAS_INPUT: parse_text,
+        State.QUOTE_ADDING: parse_text,
+        State.QUOTE_DELETING: parse_text,
+    }
+
+    def send_message(self, peer_id: int, *, message='', attachment='', keyboard=Keyboard.EMPTY, bulk=False):
         check_args({'peer_id': (peer_id, int), 'message': (message, str), 'attachment': (attachment, str),
-                    'keyboard': (keyboard, Keyboard)})
-        self.bot_api.messages.send(
+                    'keyboard': (keyboard, Keyboard), 'bulk': (bulk, bool)})
+        self.outbound.send(
+            priority=SendPriority.BULK if bulk else SendPriority.INTERACTIVE,
             random_id=random.getrandbits(32),
             peer_id=peer_id,
             message=message,
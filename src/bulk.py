@@ -0,0 +1,229 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import sys
+import time
+
+BULK_BATCH_SIZE = 100000  # quotes imported per transaction
+QUOTE_FIELDS = ('vk_id', 'author', 'text', 'tags', 'attachment', 'private')
+EXPORT_FIELDS = ('quote_id',) + QUOTE_FIELDS
+TEXT_LIMIT = 500
+TITLE_LIMIT = 20  # authors and tags
+ATTACHMENT_LIMIT = 64
+CSV_TAGS_SEPARATOR = ';'
+TRUE_VALUES = ('1', 't', 'true', 'yes')
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+IMPORT_COMMANDS = ("""
+CREATE TEMP TABLE "quotes_staging" (
+    "line" INTEGER NOT NULL,
+    "vk_id" INTEGER NOT NULL,
+    "author" VARCHAR(20) NOT NULL,
+    "text" VARCHAR(500) NOT NULL,
+    "tags" VARCHAR(20)[],
+    "attachment" VARCHAR(64),
+    "private" BOOL NOT NULL
+) ON COMMIT DROP;
+""", """
+COPY "quotes_staging" FROM STDIN;
+""", """
+ANALYZE "quotes_staging";
+
+---авторы и теги создаются одним запросом на пакет, автором по умолчанию считается псевдоним пользователя
+INSERT INTO "authors" ("title")
+SELECT DISTINCT coalesce(nullif("quotes_staging"."author", ''), "users"."alias") FROM "quotes_staging"
+INNER JOIN "users" ON "users"."vk_id" = "quotes_staging"."vk_id"
+ON CONFLICT ("title") DO NOTHING;
+
+INSERT INTO "tags" ("text")
+SELECT DISTINCT unnest("tags") FROM "quotes_staging"
+ON CONFLICT ("text") DO NOTHING;
+
+---идентификаторы выдаются в порядке строк файла, цитаты неизвестных пользователей пропускаются
+CREATE TEMP TABLE "quotes_resolved" ON COMMIT DROP AS
+SELECT nextval(pg_get_serial_sequence('quotes', 'quote_id'))::INTEGER AS "quote_id", "staged".* FROM (
+    SELECT "users"."user_id", "authors"."author_id", "quotes_staging"."text",
+           (SELECT array_agg("tags"."tag_id") FROM "tags"
+            WHERE "tags"."text" = ANY("quotes_staging"."tags")) AS "tags",
+           "quotes_staging"."attachment", "quotes_staging"."private"
+    FROM "quotes_staging"
+    INNER JOIN "users" ON "users"."vk_id" = "quotes_staging"."vk_id"
+    INNER JOIN "authors" ON "authors"."title" = coalesce(nullif("quotes_staging"."author", ''), "users"."alias")
+    ORDER BY "quotes_staging"."line"
+) AS "staged";
+
+INSERT INTO "quotes" ("quote_id", "user_id", "author_id", "text", "tags", "attachment", "private")
+OVERRIDING SYSTEM VALUE
+SELECT "quote_id", "user_id", "author_id", "text", "tags", "attachment", "private" FROM "quotes_resolved";
+
+INSERT INTO "user_quotes" ("user_id", "quote_id")
+SELECT "user_id", "quote_id" FROM "quotes_resolved";
+
+UPDATE "authors" SET "quotes" = "authors"."quotes" || "added"."quotes"
+FROM (SELECT "author_id", array_agg("quote_id" ORDER BY "quote_id") AS "quotes"
+      FROM "quotes_resolved" GROUP BY "author_id") AS "added"
+WHERE "authors"."author_id" = "added"."author_id";
+
+UPDATE "tags" SET "quotes" = "tags"."quotes" || "added"."quotes"
+FROM (SELECT "tag_id", array_agg("quote_id" ORDER BY "quote_id") AS "quotes"
+      FROM "quotes_resolved", unnest("tags") AS "tag_id" GROUP BY "tag_id") AS "added"
+WHERE "tags"."tag_id" = "added"."tag_id";
+
+UPDATE "users" SET "tags" = (SELECT array_agg(DISTINCT "tag_id" ORDER BY "tag_id")
+                             FROM unnest("users"."tags" || "added"."tags") AS "tag_id")
+FROM (SELECT "user_id", array_agg(DISTINCT "tag_id") AS "tags"
+      FROM "quotes_resolved", unnest("tags") AS "tag_id" GROUP BY "user_id") AS "added"
+WHERE "users"."user_id" = "added"."user_id";
+
+SELECT count(*) FROM "quotes_resolved";
+""")
+
+EXPORT_QUERY = """
+SELECT "quotes"."quote_id", "users"."vk_id", "authors"."title" AS "author", "quotes"."text",
+       ARRAY(SELECT "tags"."text" FROM "tags" WHERE "tags"."tag_id" = ANY("quotes"."tags")
+             ORDER BY "tags"."text") AS "tags",
+       "quotes"."attachment", "quotes"."private"
+FROM "quotes"
+INNER JOIN "users" ON "quotes"."user_id" = "users"."user_id"
+INNER JOIN "authors" ON "quotes"."author_id" = "authors"."author_id"
+ORDER BY "quotes"."quote_id"
+"""
+EXPORT_COMMANDS = {
+    'csv': """
+    COPY (SELECT "quote_id", "vk_id", "author", "text", array_to_string("tags", '{}') AS "tags", "attachment",
+                 "private"
+          FROM ({}) AS "exported") TO STDOUT WITH (FORMAT csv, HEADER);
+    """.format(CSV_TAGS_SEPARATOR, EXPORT_QUERY),
+    'jsonl': """
+    COPY (SELECT row_to_json("exported") FROM ({}) AS "exported") TO STDOUT;
+    """.format(EXPORT_QUERY),
+}
+
+
+def report(action: str, amount: int, start: float, skipped=None):
+    elapsed = time.perf_counter() - start
+    line = '{}: {} ({:.0f} в секунду)'.format(action, amount, amount / elapsed if elapsed else 0)
+    if skipped is not None:
+        line += ', пропущено: {}'.format(skipped)
+    print(line, file=sys.stderr)
+
+
+def read_quotes(file, file_format: str):
+    if file_format == 'csv':
+        for record in csv.DictReader(file):
+            record['tags'] = (record.get('tags') or '').split(CSV_TAGS_SEPARATOR)
+            yield record
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def normalize_quote(record: dict) -> tuple or None:
+    # (vk_id, author, text, tags, attachment, private) or None if the record can not be stored
+    try:
+        vk_id = int(record['vk_id'])
+        text = str(record['text'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    author = str(record.get('author') or '')
+    tags = list(dict.fromkeys(str(x).strip() for x in record.get('tags') or [] if str(x).strip()))
+    attachment = str(record.get('attachment') or '')
+    private = parse_bool(record.get('private', False))
+    if not text or len(text) > TEXT_LIMIT or len(author) > TITLE_LIMIT or len(attachment) > ATTACHMENT_LIMIT \
+            or any(len(x) > TITLE_LIMIT for x in tags):
+        return None
+    return vk_id, author, text, tags, attachment, private
+
+
+def copy_value(value) -> str:
+    # a field of the COPY text format
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        value = '{' + ','.join('"{}"'.format(x.replace('\\', '\\\\').replace('"', '\\"')) for x in value) + '}'
+    return str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(quotes: list, first_line: int) -> io.StringIO:
+    rows = io.StringIO()
+    for line, quote in enumerate(quotes, first_line):
+        rows.write('\t'.join(copy_value(x) for x in (line,) + quote))
+        rows.write('\n')
+    rows.seek(0)
+    return rows
+
+
+def import_batch(db, quotes: list, first_line: int) -> int:
+    # not retried on a lost connection: the batch could be already committed
+    with db.transaction() as cursor:
+        cursor.execute(IMPORT_COMMANDS[0])
+        cursor.copy_expert(IMPORT_COMMANDS[1], copy_rows(quotes, first_line))
+        cursor.execute(IMPORT_COMMANDS[2])
+        return cursor.fetchone()[0]
+
+
+def import_quotes(db, records, *, batch_size=BULK_BATCH_SIZE) -> dict:
+    stats = {'imported': 0, 'skipped': 0}
+    start = time.perf_counter()
+    batch, line = [], 0
+    for record in records:
+        quote = normalize_quote(record)
+        if quote is None:
+            stats['skipped'] += 1
+            continue
+        batch.append(quote)
+        if len(batch) >= batch_size:
+            imported = import_batch(db, batch, line)
+            stats['imported'] += imported
+            stats['skipped'] += len(batch) - imported
+            line += len(batch)
+            batch = []
+            report('Импортировано цитат', stats['imported'], start, stats['skipped'])
+    if batch:
+        imported = import_batch(db, batch, line)
+        stats['imported'] += imported
+        stats['skipped'] += len(batch) - imported
+    report('Импортировано цитат', stats['imported'], start, stats['skipped'])
+    return stats
+
+
+class ExportWriter:
+    # receives the COPY output, the server sends one row per write
+    def __init__(self, file, file_format: str, *, report_every=BULK_BATCH_SIZE):
+        self.file = file
+        self.file_format = file_format
+        self.report_every = report_every
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf8')
+        if self.file_format == 'jsonl':
+            # row_to_json escapes control characters itself, COPY only doubles its backslashes
+            data = data.replace('\\\\', '\\')
+        self.file.write(data)
+        self.rows += 1
+        if not self.rows % self.report_every:
+            report('Выгружено строк', self.rows, self.start)
+
+
+def export_quotes(db, file, file_format: str) -> int:
+    writer = ExportWriter(file, file_format)
+    with db.transaction() as cursor:
+        cursor.copy_expert(EXPORT_COMMANDS[file_format], writer)
+    rows = writer.rows - (file_format == 'csv')  # the header
+    report('Выгружено цитат', rows, writer.start)
+    return rows
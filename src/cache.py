@@ -0,0 +1,84 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping bounded by size and optionally by entry age (ttl, seconds). on_evict(key, value) is
+    called, under the lock of the cache, for every entry that leaves it or is replaced.
+    """
+
+    def __init__(self, maxsize: int, *, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.items = OrderedDict()  # key -> (expiration time or None, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (item[0] is None or item[0] > time.monotonic()):
+                self.items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self.items[key]
+                self.evicted(key, item)
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            replaced = self.items.get(key)
+            self.items[key] = (expires, value)
+            self.items.move_to_end(key)
+            if replaced is not None:
+                self.evicted(key, replaced)
+            while len(self.items) > self.maxsize:
+                self.evicted(*self.items.popitem(last=False))
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None:
+                return default
+            self.evicted(key, item)
+            return item[1]
+
+    def evict(self, predicate) -> int:
+        # drops the entries for which predicate(key, value) is true
+        with self.lock:
+            keys = [key for key, item in self.items.items() if predicate(key, item[1])]
+            for key in keys:
+                self.evicted(key, self.items.pop(key))
+            return len(keys)
+
+    def evicted(self, key, item: tuple):
+        if self.on_evict is not None:
+            self.on_evict(key, item[1])
+
+    def keys(self) -> list:
+        with self.lock:
+            return list(self.items)
+
+    def clear(self):
+        with self.lock:
+            items, self.items = self.items, OrderedDict()
+            for key, item in items.items():
+                self.evicted(key, item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {'size': len(self.items), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0}
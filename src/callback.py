@@ -0,0 +1,156 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vk_api.bot_longpoll import VkBotLongPoll
+
+from src.cache import LRUCache
+from src.log import get_logger
+from src.metrics import callback_events_total
+
+CALLBACK_QUEUE_SIZE = 1000  # events accepted and not yet taken by the dispatcher
+CALLBACK_MAX_BODY = 1024 * 1024
+SEEN_EVENTS_SIZE = 10000  # event ids remembered to drop the deliveries repeated by VK
+EVENT_IDS_MAX_AGE = 24 * 60 * 60  # seconds an event id is kept in the database when several instances serve
+EVENT_IDS_PRUNE_INTERVAL = 60
+CONFIRMATION_TYPE = 'confirmation'
+OK = 'ok'
+
+logger = get_logger('callback')
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    # VK keeps the connection open between events, the answer is sent without waiting for Nagle's algorithm
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'CallbackServer'
+
+    def reply(self, code: int, body: str):
+        data = body.encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > CALLBACK_MAX_BODY:
+            self.reply(413, 'too large')
+            return
+        try:
+            raw_event = json.loads(self.rfile.read(length))
+            if not isinstance(raw_event, dict):
+                raise ValueError('object expected')
+        except ValueError:
+            callback_events_total.inc(('invalid',))
+            self.reply(400, 'invalid json')
+            return
+        code, body = self.server.accept(raw_event)
+        self.reply(code, body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CallbackServer(ThreadingHTTPServer):
+    """
+    VK Callback API ingress: answers the confirmation request, checks the group and the secret, acknowledges an
+    event at once and puts it in a bounded queue read by events(). When the queue is full the event is refused
+    with 503 and VK delivers it again later. The ids of received events are remembered to drop the deliveries
+    repeated by VK: in this process, or, given db, in the database, when several bot instances behind a balancer
+    serve the group. The events of a user are handled in order only within one instance, with several of them two
+    quick messages of a user may be handled concurrently.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, group_id: int, confirmation: str, *, secret=None, port=0, host='',
+                 queue_size=CALLBACK_QUEUE_SIZE, db=None):
+        super().__init__((host, port), CallbackHandler)
+        self.group_id = int(group_id)
+        self.confirmation = confirmation
+        self.secret = secret
+        self.events_queue = queue.Queue(queue_size)
+        self.seen = LRUCache(SEEN_EVENTS_SIZE)
+        self.seen_lock = threading.Lock()
+        self.db = db
+        self.pruned_at = time.monotonic()
+
+    def accept(self, raw_event: dict) -> tuple:
+        # (HTTP status, body) of the answer to VK
+        try:
+            group_id = int(raw_event.get('group_id'))
+        except (TypeError, ValueError):
+            group_id = None
+        if group_id != self.group_id:
+            callback_events_total.inc(('forbidden',))
+            return 403, 'unknown group'
+        if raw_event.get('type') == CONFIRMATION_TYPE:
+            return 200, self.confirmation
+        if self.secret is not None and raw_event.get('secret') != self.secret:
+            callback_events_total.inc(('forbidden',))
+            return 403, 'wrong secret'
+        event_id = raw_event.get('event_id')
+        try:
+            if event_id is not None and not self.claim(event_id):
+                callback_events_total.inc(('duplicate',))
+                return 200, OK
+        except Exception:
+            logger.exception('Не удалось проверить событие %s', event_id)
+            callback_events_total.inc(('error',))
+            return 503, 'busy'
+        try:
+            self.events_queue.put_nowait(raw_event)
+        except queue.Full:
+            if event_id is not None:
+                self.release(event_id)
+            callback_events_total.inc(('full',))
+            return 503, 'busy'
+        callback_events_total.inc(('accepted',))
+        return 200, OK
+
+    def claim(self, event_id: str) -> bool:
+        # False for an event received before; a claimed event is released when it is refused
+        if self.db is None:
+            with self.seen_lock:
+                if self.seen.get(event_id) is not None:
+                    return False
+                self.seen.put(event_id, True)
+                return True
+        if time.monotonic() - self.pruned_at > EVENT_IDS_PRUNE_INTERVAL:
+            self.pruned_at = time.monotonic()
+            self.db.prune_events(EVENT_IDS_MAX_AGE)
+        return self.db.claim_event(event_id)
+
+    def release(self, event_id: str):
+        try:
+            if self.db is None:
+                self.seen.pop(event_id)
+            else:
+                self.db.release_event(event_id)
+        except Exception:
+            logger.exception('Не удалось освободить событие %s', event_id)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='callback', daemon=True).start()
+        logger.info('Callback API принимает события на порту %s', self.server_address[1])
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self.events_queue.put(None)
+
+    def events(self):
+        # blocking iterator of bot events for BotBase.run or ShardedRunner, ends after close()
+        while True:
+            raw_event = self.events_queue.get()
+            if raw_event is None:
+                return
+            event_class = VkBotLongPoll.CLASS_BY_EVENT_TYPE.get(raw_event['type'], VkBotLongPoll.DEFAULT_EVENT_CLASS)
+            yield event_class(raw_event)
@@ -1,347 +1,770 @@
 # ! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
-from psycopg2 import Error
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2 import Error, InterfaceError, OperationalError
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, connection as pg_connection
+from psycopg2.pool import ThreadedConnectionPool
 from src.methods import State, SearchParams
+from src.metrics import db_query_seconds, timed
+from src.log import get_logger
+
+POOL_MIN_CONNECTIONS = 1  # connections opened with the pool, later ones are opened on demand and kept
+POOL_MAX_CONNECTIONS = 16
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 0.1  # seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 2
+SEARCH_CANDIDATES_LIMIT = 1000  # public quotes fetched when random probes find too few
+RANDOM_PROBES_FACTOR = 4  # random quote ids probed per requested quote
+TAG_IDS_REFRESH_INTERVAL = 60  # seconds, tags created by other processes under a known text appear after it
+USER_QUOTES_MIGRATION_BATCH = 1000  # users moved from the users.quotes arrays per transaction
+
+# the quote is created or added by the user, quotes of a search are filtered by it per SearchParams
+OWN_QUOTE = """EXISTS (
+    SELECT 1 FROM "user_quotes"
+    WHERE "user_quotes"."quote_id" = "quotes"."quote_id"
+    AND "user_quotes"."user_id" = (SELECT "user_id" FROM "users" WHERE "vk_id" = %(vk_id)s)
+)"""
+QUOTE_VISIBILITY = (
+    """("private" = '0' OR {})""".format(OWN_QUOTE),
+    OWN_QUOTE,
+    """"private" = '0' AND NOT {}""".format(OWN_QUOTE),
+    """"private" = '0'""",
+)
+
+logger = get_logger('database')
+
+# hot queries run as named server-side prepared statements: name -> (argument types, statement)
+PREPARED_STATEMENTS = {
+    'user_exists': ('INTEGER', """SELECT EXISTS (SELECT "vk_id" FROM "users" WHERE "vk_id" = $1)"""),
+    'get_user_state': ('INTEGER', """SELECT "state" FROM "users" WHERE "vk_id" = $1"""),
+    # a new state ends the paging through the search results
+    'set_user_state': ('INTEGER, INTEGER', """
+        UPDATE "users" SET "state" = $1, "search_results" = NULL, "search_position" = 0
+        WHERE "vk_id" = $2 AND "state" <> $1
+        """),
+    'next_search_page': ('INTEGER, INTEGER', """
+        UPDATE "users" SET "search_position" = "search_position" + $2
+        WHERE "vk_id" = $1 AND "search_results" IS NOT NULL
+        RETURNING "search_results"["search_position" - $2 + 1:"search_position"]
+        """),
+    'get_quote': ('INTEGER', """
+        SELECT "vk_id", "title", "text", "attachment", "private" FROM "quotes"
+        INNER JOIN "authors"
+        ON "quotes"."author_id" = "authors"."author_id"
+        INNER JOIN "users"
+        ON "quotes"."user_id" = "users"."user_id"
+        WHERE "quote_id" = $1
+        """),
+}
+
+
+class PreparingConnection(pg_connection):
+    # remembers the statements prepared in its session, a reconnected one starts empty
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class RetainingConnectionPool(ThreadedConnectionPool):
+    # psycopg2 closes a returned connection once minconn ones are idle; here up to maxconn idle connections are
+    # kept, so a connection and the statements prepared in it outlive the unit of work
+    def _putconn(self, conn, key=None, close=False):
+        minconn, self.minconn = self.minconn, self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+    def discard_idle(self):
+        # once one connection is lost the idle ones are likely dead too, e.g. after a restart of the server
+        with self._lock:
+            for conn in self._pool:
+                conn.close()
+            self._pool.clear()
+
+
+def execute_prepared(cursor, name: str, params: tuple):
+    connection = cursor.connection
+    if name not in connection.prepared:
+        types, statement = PREPARED_STATEMENTS[name]
+        cursor.execute(f"PREPARE {name} ({types}) AS {statement}")
+        connection.prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def sample_quote_ids(quote_ids: list, max_amount: int) -> list:
+    return random.sample(quote_ids, min(max_amount, len(quote_ids)))
+
+
+def reconnecting(method):
+    # a broken connection is dropped by transaction(), the unit of work is repeated on a fresh one
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        delay = RECONNECT_DELAY
+        for attempt in range(RECONNECT_ATTEMPTS):
+            try:
+                return method(self, *args, **kwargs)
+            except (OperationalError, InterfaceError) as error:
+                if attempt == RECONNECT_ATTEMPTS - 1:
+                    raise
+                logger.warning("Потеряно соединение с PostgreSQL, повторная попытка через %s с: %s", delay, error)
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+    return wrapper
 
 
 class Database:
-    def __init__(self, database_auth: dict):
+    def __init__(self, database_auth: dict, *, min_connections=POOL_MIN_CONNECTIONS,
+                 max_connections=POOL_MAX_CONNECTIONS):
+        self.database_auth = database_auth
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.pool_slots = threading.BoundedSemaphore(max_connections)
+        self.tag_ids = None  # case-folded tag text -> ids of the tags, loaded by the first tag search
+        self.tag_ids_loaded_at = 0
+        self.tag_ids_lock = threading.Lock()
         try:
-            self.connection, self.cursor = None, None
             self.create_database(database_auth=database_auth)
-            self.create_tables(database_auth=database_auth)
+            self.create_tables()
         except (Exception, Error) as error:
-            print("Ошибка при работе с PostgreSQL", error)
+            logger.exception("Ошибка при работе с PostgreSQL: %s", error)
             self.close_connection()
 
     def create_database(self, database_auth: dict):
-        self.connection = psycopg2.connect(user=database_auth['user'],
-                                           password=database_auth['password'],
-                                           host=database_auth['host'],
-                                           port=database_auth['port'])
-        self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        self.cursor = self.connection.cursor()
-        self.cursor.execute(f"SELECT 1 FROM pg_catalog.pg_database WHERE datname = '{database_auth['database']}'")
-        exists = self.cursor.fetchone()
-        if not exists:
-            self.cursor.execute(f"CREATE DATABASE {database_auth['database']}")
-            self.close_connection()
+        connection = psycopg2.connect(user=database_auth['user'],
+                                      password=database_auth['password'],
+                                      host=database_auth['host'],
+                                      port=database_auth['port'])
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (database_auth['database'],))
+                exists = cursor.fetchone()
+                if not exists:
+                    cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(database_auth['database'])))
+        finally:
+            connection.close()
+
+    def get_pool(self) -> RetainingConnectionPool:
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = RetainingConnectionPool(self.min_connections, self.max_connections,
+                                                   user=self.database_auth['user'],
+                                                   password=self.database_auth['password'],
+                                                   host=self.database_auth['host'],
+                                                   port=self.database_auth['port'],
+                                                   database=self.database_auth['database'],
+                                                   connection_factory=PreparingConnection)
+            return self.pool
+
+    @contextmanager
+    def transaction(self):
+        # every unit of work gets its own pooled connection and cursor, it is committed on success
+        with self.pool_slots:
+            pool = self.get_pool()
+            connection = pool.getconn()
+            broken = False
+            try:
+                with connection.cursor() as cursor:
+                    yield cursor
+                connection.commit()
+            except (OperationalError, InterfaceError):
+                broken = True
+                raise
+            except BaseException:
+                if not connection.closed:
+                    connection.rollback()
+                raise
+            finally:
+                if pool.closed:
+                    connection.close()
+                else:
+                    pool.putconn(connection, close=broken or bool(connection.closed))
+                    if broken:
+                        # the retry of reconnecting opens a fresh connection instead of trying the idle ones
+                        pool.discard_idle()
+
+    @reconnecting
+    def create_tables(self):
+        with self.transaction() as cursor:
+            logger.info("Информация о сервере PostgreSQL: %s", cursor.connection.get_dsn_parameters())
+            cursor.execute("SELECT version();")
+            record = cursor.fetchone()
+            logger.info("Вы подключены к - %s", record[0])
+
+            commands = (
+                """
+                CREATE TABLE IF NOT EXISTS tags (
+                    tag_id INTEGER GENERATED ALWAYS AS IDENTITY,
+                    "text" VARCHAR(20) UNIQUE NOT NULL,
+                    quotes INTEGER[],
+                    PRIMARY KEY (tag_id)
+                );
+                """,
+                """                 
+                CREATE TABLE IF NOT EXISTS "users"(
+                    "user_id" INTEGER GENERATED ALWAYS AS IDENTITY,
+                    "vk_id" INTEGER UNIQUE NOT NULL, 
+                    "quotes" INTEGER[],
+                    "tags" INTEGER[],
+                    "alias" VARCHAR(20) UNIQUE NOT NULL,
+                    "state" INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY ("user_id")
+                );
+                """,
+                """                 
+                CREATE TABLE IF NOT EXISTS "authors"(
+                    "author_id" INTEGER GENERATED ALWAYS AS IDENTITY,
+                    "title" VARCHAR(20) UNIQUE NOT NULL,
+                    "quotes" INTEGER[] ,
+                    PRIMARY KEY ("author_id")
+                );
+                """,
+                """            
+                CREATE TABLE IF NOT EXISTS "quotes"(
+                    "quote_id" INTEGER GENERATED ALWAYS AS IDENTITY,
+                    "user_id" INTEGER NOT NULL, 
+                    "author_id" INTEGER NOT NULL, 
+                    "text" VARCHAR(500) NOT NULL,
+                    "tags" INTEGER[],
+                    "attachment" VARCHAR(64),
+                    "private" BOOL NOT NULL,
+                    PRIMARY KEY ("quote_id"),
+                    FOREIGN KEY ("user_id")  REFERENCES "users" ("user_id"),
+                    FOREIGN KEY ("author_id")  REFERENCES "authors" ("author_id")
+                );
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS "user_quotes"(
+                    "user_id" INTEGER NOT NULL,
+                    "quote_id" INTEGER NOT NULL,
+                    "added_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY ("user_id", "quote_id"),
+                    FOREIGN KEY ("user_id")  REFERENCES "users" ("user_id"),
+                    FOREIGN KEY ("quote_id")  REFERENCES "quotes" ("quote_id")
+                );
+                """
+            )
 
-    def create_tables(self, database_auth: dict):
-        self.connection = psycopg2.connect(user=database_auth['user'],
-                                           password=database_auth['password'],
-                                           host=database_auth['host'],
-                                           port=database_auth['port'],
-                                           database=database_auth['database'])
-
-        self.cursor = self.connection.cursor()
-        print("Информация о сервере PostgreSQL")
-        print(self.connection.get_dsn_parameters(), "\n")
-        self.cursor.execute("SELECT version();")
-        record = self.cursor.fetchone()
-        print("Вы подключены к - ", record, "\n")
-
-        commands = (
-            """
-            CREATE TABLE IF NOT EXISTS tags (
-                tag_id INTEGER GENERATED ALWAYS AS IDENTITY,
-                "text" VARCHAR(20) UNIQUE NOT NULL,
-                quotes INTEGER[],
-                PRIMARY KEY (tag_id)
-            );
-            """,
-            """                 
-            CREATE TABLE IF NOT EXISTS "users"(
-                "user_id" INTEGER GENERATED ALWAYS AS IDENTITY,
-                "vk_id" INTEGER UNIQUE NOT NULL, 
-                "quotes" INTEGER[],
-                "tags" INTEGER[],
-                "alias" VARCHAR(20) UNIQUE NOT NULL,
-                "state" INTEGER NOT NULL DEFAULT 0,
-                PRIMARY KEY ("user_id")
-            );
-            """,
-            """                 
-            CREATE TABLE IF NOT EXISTS "authors"(
-                "author_id" INTEGER GENERATED ALWAYS AS IDENTITY,
-                "title" VARCHAR(20) UNIQUE NOT NULL,
-                "quotes" INTEGER[] ,
-                PRIMARY KEY ("author_id")
-            );
-            """,
-            """            
-            CREATE TABLE IF NOT EXISTS "quotes"(
-                "quote_id" INTEGER GENERATED ALWAYS AS IDENTITY,
-                "user_id" INTEGER NOT NULL, 
-                "author_id" INTEGER NOT NULL, 
-                "text" VARCHAR(500) NOT NULL,
-                "tags" INTEGER[],
-                "attachment" VARCHAR(64),
-                "private" BOOL NOT NULL,
-                PRIMARY KEY ("quote_id"),
-                FOREIGN KEY ("user_id")  REFERENCES "users" ("user_id"),
-                FOREIGN KEY ("author_id")  REFERENCES "authors" ("author_id")
-            );
-            """
-        )
+            for command in commands:
+                cursor.execute(command)
+                logger.info("Таблица успешно создана в PostgreSQL")
+
+            migrations = (
+                """
+                ---полнотекстовый поиск: существующие строки заполняются при добавлении столбца
+                ALTER TABLE "quotes"
+                ADD COLUMN IF NOT EXISTS "text_tsv" TSVECTOR
+                GENERATED ALWAYS AS (to_tsvector('russian', "text")) STORED;
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS "quotes_text_tsv_idx" ON "quotes" USING GIN ("text_tsv");
+                """,
+                """
+                ---случайный поиск проходит по публичным цитатам в порядке идентификаторов
+                CREATE INDEX IF NOT EXISTS "quotes_public_idx" ON "quotes" ("quote_id") WHERE "private" = '0';
+                """,
+                """
+                ---владельцы цитаты: удаление проверяет, остался ли у цитаты кто-то ещё
+                CREATE INDEX IF NOT EXISTS "user_quotes_quote_id_idx" ON "user_quotes" ("quote_id");
+                """,
+                """
+                ---поиск по тегу: теги сравниваются без учёта регистра по индексу
+                ALTER TABLE "tags"
+                ADD COLUMN IF NOT EXISTS "text_key" VARCHAR(20)
+                GENERATED ALWAYS AS (lower("text")) STORED;
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS "tags_text_key_idx" ON "tags" ("text_key");
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS "quotes_tags_idx" ON "quotes" USING GIN ("tags");
+                """,
+                """
+                ---версия цитаты: новая при создании и при смене видимости, индекс лемм читает изменения по ней
+                CREATE SEQUENCE IF NOT EXISTS "quotes_version_seq" AS BIGINT;
+                ALTER TABLE "quotes"
+                ADD COLUMN IF NOT EXISTS "version" BIGINT NOT NULL DEFAULT nextval('quotes_version_seq');
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS "quotes_version_idx" ON "quotes" ("version");
+                """,
+                """
+                CREATE OR REPLACE FUNCTION "quotes_next_version"() RETURNS TRIGGER AS $$
+                BEGIN
+                    NEW."version" := nextval('quotes_version_seq');
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS "quotes_private_version" ON "quotes";
+                CREATE TRIGGER "quotes_private_version" BEFORE UPDATE OF "private" ON "quotes"
+                FOR EACH ROW WHEN (OLD."private" IS DISTINCT FROM NEW."private")
+                EXECUTE FUNCTION "quotes_next_version"();
+                """,
+                """
+                ---результаты поиска и позиция листания хранятся в базе, когда группу обслуживают несколько экземпляров
+                ALTER TABLE "users"
+                ADD COLUMN IF NOT EXISTS "search_results" INTEGER[],
+                ADD COLUMN IF NOT EXISTS "search_position" INTEGER NOT NULL DEFAULT 0;
+                """,
+                """
+                ---идентификаторы событий Callback API: повторная доставка отбрасывается любым экземпляром
+                CREATE TABLE IF NOT EXISTS "callback_events"(
+                    "event_id" VARCHAR(64) NOT NULL,
+                    "received_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY ("event_id")
+                );
+                CREATE INDEX IF NOT EXISTS "callback_events_received_at_idx" ON "callback_events" ("received_at");
+                """
+            )
 
-        for command in commands:
-            self.cursor.execute(command)
-            self.connection.commit()
-            print("Таблица успешно создана в PostgreSQL")
+            for command in migrations:
+                cursor.execute(command)
+                logger.info("Миграция успешно применена в PostgreSQL")
 
-    def close_connection(self):
-        if self.connection:
-            self.cursor.close()
-            self.connection.close()
-            print("Соединение с PostgreSQL закрыто")
+        self.migrate_user_quotes()
+
+    @reconnecting
+    def migrate_user_quotes(self):
+        # moves the users.quotes arrays to user_quotes a batch of users per transaction, so the tables are never
+        # locked for long; a moved array is cleared and the rerun after a crash continues where it stopped
+        command = """
+        WITH "batch" AS (
+            SELECT "user_id", "quotes" FROM "users"
+            WHERE "quotes" IS NOT NULL
+            ORDER BY "user_id"
+            LIMIT %s
+            FOR UPDATE
+        ), "moved" AS (
+            INSERT INTO "user_quotes" ("user_id", "quote_id", "added_at")
+            SELECT "batch"."user_id", "item"."quote_id", now() + "item"."position" * INTERVAL '1 microsecond'
+            FROM "batch", unnest("batch"."quotes") WITH ORDINALITY AS "item" ("quote_id", "position")
+            WHERE EXISTS (SELECT 1 FROM "quotes" WHERE "quotes"."quote_id" = "item"."quote_id")
+            ON CONFLICT DO NOTHING
+        )
+        UPDATE "users" SET "quotes" = NULL
+        FROM "batch"
+        WHERE "users"."user_id" = "batch"."user_id";
+        """
+        while True:
+            with self.transaction() as cursor:
+                cursor.execute(command, (USER_QUOTES_MIGRATION_BATCH,))
+                if not cursor.rowcount:
+                    return
+                logger.info("Перенесены цитаты пользователей в user_quotes: %s", cursor.rowcount)
 
+    def close_connection(self):
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+                logger.info("Соединение с PostgreSQL закрыто")
+
+    @timed(db_query_seconds)
+    @reconnecting
     def user_exists(self, vk_id: int) -> bool:
-        command = f"""SELECT EXISTS (SELECT "vk_id" FROM "users" WHERE "vk_id" = {vk_id});"""
-        self.cursor.execute(command)
-        user_exists = self.cursor.fetchone()[0]
-        return user_exists
+        with self.transaction() as cursor:
+            execute_prepared(cursor, 'user_exists', (vk_id,))
+            user_exists = cursor.fetchone()[0]
+            return user_exists
 
+    @timed(db_query_seconds)
+    @reconnecting
     def alias_exists(self, alias: str) -> bool:
-        command = f"""SELECT EXISTS (SELECT "alias" FROM "users" WHERE "alias" = '{alias}');"""
-        self.cursor.execute(command)
-        alias_exists = self.cursor.fetchone()[0]
-        return alias_exists
-
+        command = """SELECT EXISTS (SELECT "alias" FROM "users" WHERE "alias" = %s);"""
+        with self.transaction() as cursor:
+            cursor.execute(command, (alias,))
+            alias_exists = cursor.fetchone()[0]
+            return alias_exists
+
+    @timed(db_query_seconds)
+    @reconnecting
     def create_user(self, vk_id: int, alias: str):
-        command = f"""
+        command = """
         INSERT INTO "users" ("vk_id", "quotes", "tags", "alias")
-        VALUES ({vk_id}, NULL, NULL, '{alias}');
+        VALUES (%s, NULL, NULL, %s);
         """
-        self.cursor.execute(command)
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute(command, (vk_id, alias))
 
+    @timed(db_query_seconds)
+    @reconnecting
     def set_user_state(self, vk_id: int, state: State):
-        command = f"""UPDATE "users" SET "state" = {state.value} WHERE "vk_id" = {vk_id};"""
-        self.cursor.execute(command)
-        self.connection.commit()
+        with self.transaction() as cursor:
+            execute_prepared(cursor, 'set_user_state', (state.value, vk_id))
 
+    @timed(db_query_seconds)
+    @reconnecting
     def get_user_state(self, vk_id: int) -> State:
-        command = f"""SELECT "state" FROM "users" WHERE "vk_id" = {vk_id};"""
-        self.cursor.execute(command)
-        state = self.cursor.fetchone()[0]
-        print(state)
-        return State(state)
-
+        with self.transaction() as cursor:
+            execute_prepared(cursor, 'get_user_state', (vk_id,))
+            state = cursor.fetchone()[0]
+            return State(state)
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def start_search(self, vk_id: int, quote_ids: list):
+        command = """UPDATE "users" SET "search_results" = %s::INTEGER[], "search_position" = 0 WHERE "vk_id" = %s;"""
+        with self.transaction() as cursor:
+            cursor.execute(command, (quote_ids, vk_id))
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def next_search_page(self, vk_id: int, amount: int) -> list:
+        # the paging started by start_search moves on in the same statement, so any instance serves the next page
+        with self.transaction() as cursor:
+            execute_prepared(cursor, 'next_search_page', (vk_id, amount))
+            row = cursor.fetchone()
+            return row[0] if row is not None else []
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def search_remaining(self, vk_id: int) -> int:
+        command = """
+        SELECT greatest(0, cardinality("search_results") - "search_position") FROM "users" WHERE "vk_id" = %s;
+        """
+        with self.transaction() as cursor:
+            cursor.execute(command, (vk_id,))
+            row = cursor.fetchone()
+            return row[0] if row is not None and row[0] is not None else 0
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def claim_event(self, event_id: str) -> bool:
+        # False when the event was already received by any instance
+        command = """
+        INSERT INTO "callback_events" ("event_id") VALUES (%s) ON CONFLICT DO NOTHING RETURNING "event_id";
+        """
+        with self.transaction() as cursor:
+            cursor.execute(command, (event_id,))
+            return cursor.fetchone() is not None
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def release_event(self, event_id: str):
+        # the event was refused, its repeated delivery is accepted
+        with self.transaction() as cursor:
+            cursor.execute("""DELETE FROM "callback_events" WHERE "event_id" = %s;""", (event_id,))
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def prune_events(self, max_age: int) -> int:
+        command = """DELETE FROM "callback_events" WHERE "received_at" < now() - make_interval(secs => %s);"""
+        with self.transaction() as cursor:
+            cursor.execute(command, (max_age,))
+            return cursor.rowcount
+
+    @timed(db_query_seconds)
+    @reconnecting
     def get_user_alias(self, vk_id: int) -> str:
-        command = f"""SELECT "alias" FROM "users" WHERE "vk_id" = {vk_id};"""
-        self.cursor.execute(command)
-        alias = self.cursor.fetchone()[0]
-        print(alias)
-        return alias
-
+        command = """SELECT "alias" FROM "users" WHERE "vk_id" = %s;"""
+        with self.transaction() as cursor:
+            cursor.execute(command, (vk_id,))
+            alias = cursor.fetchone()[0]
+            return alias
+
+    @timed(db_query_seconds)
+    @reconnecting
     def set_user_alias(self, vk_id: int, alias: str):
-        command = f"""UPDATE "users" SET "alias" = '{alias}' WHERE "vk_id" = {vk_id};"""
-        self.cursor.execute(command)
-        self.connection.commit()
+        command = """UPDATE "users" SET "alias" = %s WHERE "vk_id" = %s;"""
+        with self.transaction() as cursor:
+            cursor.execute(command, (alias, vk_id))
 
-    def create_quote(self, vk_id: int, text: str, *, tags=None, author='', attachments=None, private=False) -> int:
+    # not retried on a lost connection: the quote could be already committed
+    @timed(db_query_seconds)
+    def create_quote(self, vk_id: int, text: str, *, tags=None, author='', attachments=None, private=False) -> dict:
         if tags is None:
             tags = []
         if attachments is None:
             attachments = []
 
-        tags_str = ', '.join(["('{}')".format(x) for x in list(set(tags))])
-
-        create_tags_arr = f"""
-        WITH ins AS (
-        INSERT INTO tags ("text") VALUES {tags_str}
-        ON CONFLICT("text") DO UPDATE SET "text"=EXCLUDED."text" RETURNING tag_id)
-        SELECT array_agg(tag_id) INTO tags_arr FROM ins;
-        """ if tags else ''
-
-        create_attachment = f"attachment = '{attachments[0]}';" if attachments else ''
-
+        params = {
+            'vk_id': vk_id,
+            'text': text,
+            'tags': list(set(tags)),
+            'author': author,
+            'attachment': attachments[0] if attachments else None,
+            'private': private
+        }
+        # one statement: the quote id is taken from the identity sequence first, so the author and tag upserts
+        # append it to their arrays in place and every row is modified once
         command = """
-        DO $$
-            DECLARE q_id quotes.quote_id%TYPE;
-            DECLARE attachment quotes.attachment%TYPE;
-            DECLARE a_id authors.author_id%TYPE;
-            DECLARE tags_arr INTEGER[];
-        BEGIN
-            {create_tags_arr}
-            {create_attachment}
-
-            INSERT INTO authors ("title") 
-            VALUES ('{author}') ON CONFLICT(title) DO UPDATE SET title=EXCLUDED.title
-            RETURNING author_id INTO a_id;
-
-            INSERT INTO quotes (user_id, author_id, "text", tags, attachment, "private")
-            VALUES (
-                (SELECT user_id FROM users WHERE vk_id = {vk_id}), a_id, '{text}', tags_arr, attachment, '{private}'
-            )
-            RETURNING quote_id INTO q_id;
-
-            UPDATE authors
-            SET quotes = array_append(quotes, q_id)
-            WHERE author_id = a_id;
-
+        WITH "new_quote" AS (
+            SELECT nextval(pg_get_serial_sequence('quotes', 'quote_id'))::INTEGER AS "quote_id"
+        ), "author" AS (
+            INSERT INTO authors ("title", quotes)
+            SELECT %(author)s, ARRAY["quote_id"] FROM "new_quote"
+            ON CONFLICT ("title") DO UPDATE SET quotes = array_append(authors.quotes, EXCLUDED.quotes[1])
+            RETURNING author_id
+        ), "tag" AS (
+            INSERT INTO tags ("text", quotes)
+            SELECT unnest(%(tags)s::VARCHAR[]), ARRAY["quote_id"] FROM "new_quote"
+            ON CONFLICT ("text") DO UPDATE SET quotes = array_append(tags.quotes, EXCLUDED.quotes[1])
+            RETURNING tag_id, "text_key"
+        ), "quote" AS (
+            INSERT INTO quotes (quote_id, user_id, author_id, "text", tags, attachment, "private")
+            OVERRIDING SYSTEM VALUE
+            SELECT "quote_id", (SELECT user_id FROM users WHERE vk_id = %(vk_id)s), (SELECT author_id FROM "author"),
+                   %(text)s, (SELECT array_agg(tag_id) FROM "tag"), %(attachment)s, %(private)s
+            FROM "new_quote"
+            RETURNING quote_id, user_id, tags, "text", attachment, "private"
+        ), "user_tags" AS (
             UPDATE users
-            SET 
-                quotes = array_append(quotes, q_id),
-                tags = (SELECT array_agg(arr ORDER BY arr) from (SELECT DISTINCT unnest(tags || tags_arr) AS arr) s)
-            WHERE vk_id = {vk_id};
-
-            UPDATE tags 
-            SET quotes = array_append(quotes, q_id) 
-            WHERE tags.tag_id = ANY (tags_arr::int[]);
-        END $$;
-        SELECT MAX("quote_id") FROM "quotes"
-        INNER JOIN "users"
-        ON "quotes"."user_id" = "users"."user_id"
-        WHERE "text" = '{text}' and "vk_id" = {vk_id};
-        """.format(vk_id=vk_id, text=text, tags=tags_str, author=author, private=(1 if private else 0),
-                   create_tags_arr=create_tags_arr, create_attachment=create_attachment)
-        print(command)
-        self.cursor.execute(command)
-        quote_id = self.cursor.fetchone()[0]
-        self.connection.commit()
-        print(quote_id)
-        return quote_id
-
+            SET tags = (SELECT array_agg(arr ORDER BY arr)
+                        FROM (SELECT DISTINCT unnest(users.tags || "quote".tags) AS arr) s)
+            FROM "quote"
+            WHERE users.user_id = "quote".user_id
+        ), "link" AS (
+            INSERT INTO user_quotes (user_id, quote_id)
+            SELECT user_id, quote_id FROM "quote"
+        )
+        SELECT quote_id, %(vk_id)s, %(author)s, "text", attachment, "private",
+               (SELECT json_agg(json_build_array("text_key", tag_id)) FROM "tag")
+        FROM "quote";
+        """
+        with self.transaction() as cursor:
+            cursor.execute(command, params)
+            quote = cursor.fetchone()
+            logger.debug('quote %s created', quote[0])
+            self.add_tag_ids(quote[6] or [])
+            return self.make_quote(quote[0], quote[1:6])
+
+    @timed(db_query_seconds)
+    @reconnecting
     def add_quote_to_user(self, vk_id: int, quote_id: int):
         command = """
-        UPDATE users
-        SET quotes[1]={quote_id}
-        WHERE  vk_id = {vk_id} and ((select quotes is null from users WHERE vk_id = {vk_id}) = 'true');
-        UPDATE users
-        SET quotes = array_append(quotes, {quote_id})
-        WHERE  vk_id = {vk_id} and not ("quotes" @> '{{ {quote_id} }}'::integer[]);
-        """.format(quote_id=quote_id, vk_id=vk_id)
-        self.cursor.execute(command)
-        self.connection.commit()
-
-    def remove_user_quote(self, vk_id: int, quote_id: int):
-        command = f"""
-        UPDATE users
-        SET quotes = array_remove( quotes, {quote_id} )  
-        WHERE vk_id= {vk_id} and (quotes @> '{{{quote_id}}}'::INT[]);
-        update quotes
-        set private = '1'
-        where private = '0' and quote_id={quote_id} and not exists((select quotes from users
-        where (quotes @> '{{{quote_id}}}'::INT[]) group by quotes having count(quotes)=1));
+        INSERT INTO user_quotes (user_id, quote_id)
+        SELECT user_id, %(quote_id)s FROM users WHERE vk_id = %(vk_id)s
+        ON CONFLICT DO NOTHING;
         """
-        self.cursor.execute(command)
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute(command, {'quote_id': quote_id, 'vk_id': vk_id})
 
-    def get_quote(self, quote_id: int) -> dict or None:
-        command = f"""
-        SELECT "vk_id", "title", "text", "attachment", "private" FROM "quotes"
-        INNER JOIN "authors"
-        ON "quotes"."author_id" = "authors"."author_id"
-        INNER JOIN "users"
-        ON "quotes"."user_id" = "users"."user_id"
-        WHERE "quote_id"={quote_id};
+    @timed(db_query_seconds)
+    @reconnecting
+    def remove_user_quote(self, vk_id: int, quote_id: int):
+        command = """
+        DELETE FROM user_quotes
+        WHERE user_id = (SELECT user_id FROM users WHERE vk_id = %(vk_id)s) AND quote_id = %(quote_id)s;
+        ---цитата, которую больше никто не хранит, скрывается из поиска
+        UPDATE quotes
+        SET private = '1'
+        WHERE private = '0' AND quote_id = %(quote_id)s
+        AND NOT EXISTS (SELECT 1 FROM user_quotes WHERE quote_id = %(quote_id)s);
         """
-        self.cursor.execute(command)
-        quote = self.cursor.fetchone()
-
-        print(quote)
-        if quote is None:
-            return quote
+        with self.transaction() as cursor:
+            cursor.execute(command, {'quote_id': quote_id, 'vk_id': vk_id})
 
-        request_result = {
+    @staticmethod
+    def make_quote(quote_id: int, quote: tuple) -> dict:
+        return {
+            'quote_id': quote_id,
             'vk_id': quote[0],  # vk_id of creator
             'author': quote[1],
             'text': quote[2],
             'attachments': [quote[3]] if quote[3] is not None else [],
             'private': quote[4]
         }
-        print(request_result)
-        return request_result
 
+    @timed(db_query_seconds)
+    @reconnecting
+    def get_quote(self, quote_id: int) -> dict or None:
+        with self.transaction() as cursor:
+            execute_prepared(cursor, 'get_quote', (quote_id,))
+            quote = cursor.fetchone()
+
+            if quote is None:
+                return quote
+
+            return self.make_quote(quote_id, quote)
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def get_quotes(self, quote_ids: list) -> list:
+        # one round trip for the whole list, quotes come in the order of quote_ids, unknown ids are skipped
+        command = """
+        SELECT "quote_id", "vk_id", "title", "text", "attachment", "private" FROM "quotes"
+        INNER JOIN "authors"
+        ON "quotes"."author_id" = "authors"."author_id"
+        INNER JOIN "users"
+        ON "quotes"."user_id" = "users"."user_id"
+        WHERE "quote_id" = ANY(%s::INTEGER[]);
+        """
+        with self.transaction() as cursor:
+            cursor.execute(command, (list(quote_ids),))
+            quotes = {x[0]: self.make_quote(x[0], x[1:]) for x in cursor.fetchall()}
+        return [quotes[quote_id] for quote_id in quote_ids if quote_id in quotes]
+
+    @timed(db_query_seconds)
+    @reconnecting
     def get_user_quotes(self, vk_id: int) -> list:
-        command = f"""
+        command = """
         SELECT "quote_id" FROM "quotes"
         INNER JOIN "users"
         ON "quotes"."user_id" = "users"."user_id"
-        WHERE "vk_id" = {vk_id};
+        WHERE "vk_id" = %s;
         """
-        self.cursor.execute(command)
-        quote_ids = [x[0] for x in self.cursor.fetchall()]
-        return quote_ids
+        with self.transaction() as cursor:
+            cursor.execute(command, (vk_id,))
+            quote_ids = [x[0] for x in cursor.fetchall()]
+            return quote_ids
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def get_quote_texts(self, after_version: int, max_amount: int) -> list:
+        # keyset page of (quote_id, text, private, version) in the order of versions
+        command = """
+        SELECT "quote_id", "text", "private", "version" FROM "quotes"
+        WHERE "version" > %s
+        ORDER BY "version"
+        LIMIT %s;
+        """
+        with self.transaction() as cursor:
+            cursor.execute(command, (after_version, max_amount))
+            return cursor.fetchall()
 
+    @timed(db_query_seconds)
+    @reconnecting
     def get_my_quotes(self, vk_id: int) -> list:
-        command = f"""
-        SELECT "quotes" FROM "users" 
-        WHERE "vk_id" = {vk_id};
+        command = """
+        SELECT "quote_id" FROM "user_quotes"
+        WHERE "user_id" = (SELECT "user_id" FROM "users" WHERE "vk_id" = %s)
+        ORDER BY "added_at", "quote_id";
         """
-        self.cursor.execute(command)
-        quote_ids = self.cursor.fetchone()[0]
-        print(quote_ids)
-        return quote_ids
+        with self.transaction() as cursor:
+            cursor.execute(command, (vk_id,))
+            quote_ids = [x[0] for x in cursor.fetchall()]
+            return quote_ids
 
+    @timed(db_query_seconds)
+    @reconnecting
     def get_quotes_on_random(self, max_amount: int) -> list:
-        command = f"""
-        SELECT "quote_id" FROM "quotes"
-        WHERE "private" = '0'
-        ORDER BY RANDOM()
-        LIMIT {max_amount};
+        # random ids from the identity range are probed for the next public quote instead of sorting the table
+        command = """
+        WITH "bounds" AS (
+            SELECT MIN("quote_id") AS "low", MAX("quote_id") AS "high" FROM "quotes" WHERE "private" = '0'
+        ), "probes" AS (
+            SELECT "low" + floor(random() * ("high" - "low" + 1))::int AS "probe_id"
+            FROM "bounds", generate_series(1, %(probes)s)
+        )
+        SELECT DISTINCT "found"."quote_id" FROM "probes"
+        CROSS JOIN LATERAL (
+            SELECT "quote_id" FROM "quotes"
+            WHERE "quote_id" >= "probes"."probe_id" AND "private" = '0'
+            ORDER BY "quote_id"
+            LIMIT 1
+        ) AS "found";
         """
-        self.cursor.execute(command)
-        quote_ids = [x[0] for x in self.cursor.fetchall()]
-        return quote_ids
-
-    def get_quotes_by_word(self, vk_id: int, word_states: list, search_param: SearchParams, max_amount: int) -> list:
-        word_states = ', '.join(["'%{}%'".format(x) for x in word_states])
-        print(word_states)
-        commands = (f"""
-        ---ищет среди всех и своих и чужих публичных
-        SELECT "quote_id" FROM "quotes" WHERE ("quote_id" = ANY((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[]) OR(
-        "quote_id" <> ALL((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[]) AND "private" = '0'
-        )) AND "text" ILIKE ANY(ARRAY[{word_states}])
-        ORDER BY RANDOM()
-        LIMIT {max_amount};
-        """, f"""
-        --- ищет по всем своим, которые написаны vk_id и добавлены 
-        SELECT "quote_id" FROM "quotes" 
-        WHERE "quote_id" = ANY((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[]) AND "text" ILIKE ANY(ARRAY[{word_states}])
-        ORDER BY RANDOM()
-        LIMIT {max_amount};					
-        """, f"""
-        ---поиск по высказываниям других пользователей
-        SELECT "quote_id" FROM "quotes" WHERE "quote_id" <> ALL((
-        SELECT "quotes" FROM "users" WHERE "vk_id" ={vk_id})::int[]) 
-        AND "private" = '0' AND "text" ILIKE ANY(ARRAY[{word_states}])
-        ORDER BY RANDOM()
-        LIMIT {max_amount};
-        """)
-        print(commands)
-        self.cursor.execute(commands[search_param.value])
-        quote_ids = [x[0] for x in self.cursor.fetchall()]
-        return quote_ids
-
+        with self.transaction() as cursor:
+            cursor.execute(command, {'probes': max_amount * RANDOM_PROBES_FACTOR})
+            quote_ids = [x[0] for x in cursor.fetchall()]
+            if len(quote_ids) < max_amount:
+                # few public quotes: probes keep hitting the same ones, all of them are fetched instead
+                cursor.execute("""SELECT "quote_id" FROM "quotes" WHERE "private" = '0' LIMIT %s;""",
+                               (SEARCH_CANDIDATES_LIMIT,))
+                quote_ids = [x[0] for x in cursor.fetchall()]
+            return sample_quote_ids(quote_ids, max_amount)
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def get_quotes_by_word(self, vk_id: int, word: str, search_param: SearchParams, max_amount: int) -> list:
+        command = """
+        SELECT "quote_id" FROM "quotes", plainto_tsquery('russian', %(word)s) AS "query"
+        WHERE {} AND "text_tsv" @@ "query"
+        ORDER BY ts_rank("text_tsv", "query") DESC
+        LIMIT %(max_amount)s;
+        """.format(QUOTE_VISIBILITY[search_param.value])
+        with self.transaction() as cursor:
+            cursor.execute(command, {'vk_id': vk_id, 'word': word, 'max_amount': max_amount})
+            quote_ids = [x[0] for x in cursor.fetchall()]
+            return quote_ids
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def get_lexemes(self, texts: list) -> list:
+        # lexemes of every text as the full-text search sees them, in the order of texts
+        command = """
+        SELECT tsvector_to_array(to_tsvector('russian', "text"))
+        FROM unnest(%(texts)s::TEXT[]) WITH ORDINALITY AS t("text", "position")
+        ORDER BY "position";
+        """
+        with self.transaction() as cursor:
+            cursor.execute(command, {'texts': texts})
+            return [x[0] for x in cursor.fetchall()]
+
+    @timed(db_query_seconds)
+    @reconnecting
+    def get_quotes_by_word_states(self, vk_id: int, word_states: list, search_param: SearchParams, max_amount: int) -> list:
+        word_states = ['%{}%'.format(x) for x in word_states]
+        command = """
+        SELECT "quote_id" FROM "quotes"
+        WHERE {} AND "text" ILIKE ANY(%(word_states)s::TEXT[])
+        ORDER BY "quote_id" DESC
+        LIMIT %(max_amount)s;
+        """.format(QUOTE_VISIBILITY[search_param.value])
+        with self.transaction() as cursor:
+            cursor.execute(command, {'vk_id': vk_id, 'word_states': word_states, 'max_amount': max_amount})
+            quote_ids = [x[0] for x in cursor.fetchall()]
+            return quote_ids
+
+    def add_tag_ids(self, tags: list):
+        # (case-folded text, tag id) pairs of inserted or found tags
+        with self.tag_ids_lock:
+            if self.tag_ids is None:
+                return
+            for key, tag_id in tags:
+                if tag_id not in self.tag_ids.setdefault(key, []):
+                    self.tag_ids[key].append(tag_id)
+
+    def resolve_tags(self, cursor, tags: list) -> list:
+        # ids of the tags equal to the given ones up to case; the map is reloaded every TAG_IDS_REFRESH_INTERVAL
+        # and unknown texts are looked up at once, in case another process created them
+        keys = {x.lower() for x in tags}
+        with self.tag_ids_lock:
+            stale = self.tag_ids is None or time.monotonic() - self.tag_ids_loaded_at > TAG_IDS_REFRESH_INTERVAL
+        if stale:
+            cursor.execute("""SELECT "text_key", "tag_id" FROM "tags";""")
+            tag_ids = {}
+            for key, tag_id in cursor.fetchall():
+                tag_ids.setdefault(key, []).append(tag_id)
+            with self.tag_ids_lock:
+                # tags are never deleted, ids added by writes that raced with the reload are kept
+                for key, ids in (self.tag_ids or {}).items():
+                    known = tag_ids.setdefault(key, [])
+                    known.extend([x for x in ids if x not in known])
+                self.tag_ids = tag_ids
+                self.tag_ids_loaded_at = time.monotonic()
+        with self.tag_ids_lock:
+            missing = [x for x in keys if x not in self.tag_ids]
+        if missing:
+            cursor.execute("""SELECT "text_key", "tag_id" FROM "tags" WHERE "text_key" = ANY(%s);""", (missing,))
+            self.add_tag_ids(cursor.fetchall())
+        with self.tag_ids_lock:
+            return [tag_id for key in keys for tag_id in self.tag_ids.get(key, ())]
+
+    @timed(db_query_seconds)
+    @reconnecting
     def get_quotes_by_tag(self, vk_id: int, tags: list, search_param: SearchParams, max_amount: int) -> list:
-        tags_arr = ', '.join(["'{}'".format(x) for x in tags])
-        commands = (f"""
-        ---ищет среди всех и своих и чужих публичных
-        SELECT "quote_id" FROM "quotes" WHERE ("quote_id" = ANY((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[]) OR(
-        "quote_id" <> ALL((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[]) AND "private" = '0'
-        )) AND "tags" && (SELECT ARRAY_AGG("tag_id") FROM "tags" WHERE "text" ILIKE ANY(ARRAY[{tags_arr}]))
-        ORDER BY RANDOM()
-        LIMIT {max_amount};
-        """, f"""
-        --- ищет по всем своим, которые написаны vk_id и добавлены 
-        SELECT "quote_id" FROM "quotes" WHERE "quote_id" = ANY((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[])
-        AND "tags" && (SELECT ARRAY_AGG("tag_id") FROM "tags" WHERE "text" ILIKE ANY(ARRAY[{tags_arr}]))
-        ORDER BY RANDOM()
-        LIMIT {max_amount};					
-        """, f"""
-        ---поиск по высказываниям других пользователей
-        SELECT "quote_id" FROM "quotes" WHERE "quote_id" <> ALL((SELECT "quotes" FROM "users" WHERE "vk_id" = {vk_id})::int[]) AND "private" = '0'
-        AND "tags" && (SELECT ARRAY_AGG("tag_id") FROM "tags" WHERE "text" ILIKE ANY(ARRAY[{tags_arr}]))   
-        ORDER BY RANDOM()
-        LIMIT {max_amount};
-        """)
-        print(commands)
-        self.cursor.execute(commands[search_param.value])
-        quote_ids = [x[0] for x in self.cursor.fetchall()]
-        return quote_ids
+        # the tag ids come from memory, quotes are found by the GIN index on quotes.tags
+        command = """
+        SELECT "quote_id" FROM "quotes"
+        WHERE {} AND "tags" && %(tag_ids)s::INTEGER[]
+        ORDER BY "quote_id" DESC
+        LIMIT %(max_amount)s;
+        """.format(QUOTE_VISIBILITY[search_param.value])
+        with self.transaction() as cursor:
+            tag_ids = self.resolve_tags(cursor, tags)
+            if not tag_ids:
+                return []
+            cursor.execute(command, {'vk_id': vk_id, 'tag_ids': tag_ids, 'max_amount': max_amount})
+            quote_ids = [x[0] for x in cursor.fetchall()]
+            return quote_ids
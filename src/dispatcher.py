@@ -0,0 +1,102 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from vk_api.bot_longpoll import VkBotEventType
+
+from src.log import get_logger
+from src.metrics import handler_failures_total
+
+DEFAULT_HANDLER_WORKERS = 16
+DEFAULT_MAX_PENDING_EVENTS = 1000
+
+logger = get_logger('dispatcher')
+
+
+def get_event_vk_id(event) -> int:
+    # events of one dialog share the key, so a user's messages and the group's replies to him stay ordered
+    if event.type == VkBotEventType.MESSAGE_NEW:
+        return event.message.from_id
+    return event.object.get('peer_id', event.object.get('from_id', 0))
+
+
+class EventDispatcher:
+    """
+    Runs a blocking event handler in a thread pool: events of the same user are handled strictly one after
+    another, events of different users are handled concurrently. An exception of the handler is logged and
+    counted, the next events are handled as usual.
+    """
+
+    def __init__(self, handler, *, max_workers=DEFAULT_HANDLER_WORKERS, max_pending=DEFAULT_MAX_PENDING_EVENTS):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='handler')
+        self.reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reader')
+        self.max_pending = max_pending
+        self.queues = {}  # vk_id -> deque of events waiting for the user's worker
+        self.tasks = set()
+        self._pending = None
+
+    def _init_loop_state(self):
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+
+    async def dispatch(self, event):
+        self._init_loop_state()
+        await self._pending.acquire()
+        vk_id = get_event_vk_id(event)
+        queue = self.queues.get(vk_id)
+        if queue is None:
+            queue = self.queues[vk_id] = deque()
+            task = asyncio.ensure_future(self._drain(vk_id, queue))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        queue.append(event)
+
+    async def _drain(self, vk_id: int, queue: deque):
+        loop = asyncio.get_running_loop()
+        try:
+            while queue:
+                event = queue.popleft()
+                try:
+                    await loop.run_in_executor(self.executor, self.handler, event)
+                except Exception as e:
+                    handler_failures_total.inc((type(e).__name__,))
+                    logger.exception('Ошибка при обработке события пользователя %s', vk_id)
+                finally:
+                    self._pending.release()
+        finally:
+            del self.queues[vk_id]
+
+    async def join(self):
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks))
+
+    async def serve(self, events):
+        # events is a blocking iterator, e.g. VkBotLongPoll.listen(); it is read from a dedicated thread
+        self._init_loop_state()
+        loop = asyncio.get_running_loop()
+        iterator = iter(events)
+        event = read = None
+        try:
+            while True:
+                read = loop.run_in_executor(self.reader, next, iterator, None)
+                # a running next() can not be cancelled, the read is shielded to keep the event it takes
+                event = await asyncio.shield(read)
+                if event is None:
+                    break
+                await self.dispatch(event)
+                event = None
+        finally:
+            if read is not None and not read.done():
+                # a cancelled serve waits for the reader, so the iterator is free for the next serve
+                event = await read
+            if event is not None:
+                await self.dispatch(event)
+            await self.join()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.reader.shutdown(wait=True)
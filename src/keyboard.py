@@ -4,43 +4,39 @@
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
 from src.methods import BotRuntimeError, Keyboard
 
+_keyboards = {}  # Keyboard -> serialized keyboard json
 
-def create_keyboard(which: Keyboard) -> VkKeyboard:
+
+def build_keyboard(rows: list) -> str:
+    # rows of buttons, a button is a label or a (label, color) pair
     keyboard = VkKeyboard(one_time=True)
+    for i, row in enumerate(rows):
+        if i:
+            keyboard.add_line()
+        for button in row:
+            label, color = button if isinstance(button, tuple) else (button, VkKeyboardColor.PRIMARY)
+            keyboard.add_button(label, color=color)
+    return keyboard.get_keyboard()
+
+
+def register_keyboard(which: Keyboard, rows: list):
+    _keyboards[which] = build_keyboard(rows)
 
-    if which == Keyboard.EMPTY:
-        return keyboard.get_keyboard()
-
-    if which == Keyboard.BOT_MENU:
-        keyboard.add_button("Создать цитату", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Найти цитату", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_line()
-        keyboard.add_button("Мои цитаты", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Изменить псевдоним", color=VkKeyboardColor.PRIMARY)
-
-    elif which == Keyboard.FAQ_AND_RETURN:
-        keyboard.add_button("Справка", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Вернуться", color=VkKeyboardColor.PRIMARY)
-
-    elif which == Keyboard.QUOTE_SEARCH:
-        keyboard.add_button("Поиск по слову", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Поиск по тегу", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_line()
-        keyboard.add_button("Случайный поиск", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Вернуться", color=VkKeyboardColor.PRIMARY)
-
-    elif which == Keyboard.MY_QUOTES:
-        keyboard.add_button("Создать цитату", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Удалить цитату", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_line()
-        keyboard.add_button("Добавить цитату", color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button("Вернуться", color=VkKeyboardColor.PRIMARY)
-
-    elif which == Keyboard.RETURN:
-        keyboard.add_button("Вернуться", color=VkKeyboardColor.PRIMARY)
-
-    else:
-        raise BotRuntimeError(BotRuntimeError.ErrorCodes.KEYBOARD_ERROR, 'unknown keyboard requested', False)
 
-    keyboard = keyboard.get_keyboard()
+def create_keyboard(which: Keyboard) -> str:
+    keyboard = _keyboards.get(which)
+    if keyboard is None:
+        raise BotRuntimeError(BotRuntimeError.ErrorCodes.KEYBOARD_ERROR, 'unknown keyboard requested', False)
     return keyboard
+
+
+register_keyboard(Keyboard.EMPTY, [])
+register_keyboard(Keyboard.BOT_MENU, [["Создать цитату", "Найти цитату"],
+                                      ["Мои цитаты", "Изменить псевдоним"]])
+register_keyboard(Keyboard.FAQ_AND_RETURN, [["Справка", "Вернуться"]])
+register_keyboard(Keyboard.QUOTE_SEARCH, [["Поиск по слову", "Поиск по тегу"],
+                                          ["Случайный поиск", "Вернуться"]])
+register_keyboard(Keyboard.MY_QUOTES, [["Создать цитату", "Удалить цитату"],
+                                       ["Добавить цитату", "Вернуться"]])
+register_keyboard(Keyboard.RETURN, [["Вернуться"]])
+register_keyboard(Keyboard.SEARCH_RESULTS, [["Дальше", "Вернуться"]])
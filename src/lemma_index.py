@@ -0,0 +1,142 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import re
+import threading
+import time
+from array import array
+
+from src.log import get_logger
+from src.methods import SearchParams, get_lemma
+
+LOAD_BATCH_SIZE = 10000  # quotes read per query when the index is loaded
+CATCH_UP_INTERVAL = 5  # seconds between reads of the quotes created or hidden by other bot instances
+CATCH_UP_WINDOW = 1000  # versions behind the last read one that are read again, see LemmaIndex.catch_up
+WORD_PATTERN = re.compile(r'\w+(?:-\w+)*')
+
+logger = get_logger('lemma_index')
+
+
+def contains(postings: array, quote_id: int) -> bool:
+    index = bisect.bisect_left(postings, quote_id)
+    return index < len(postings) and postings[index] == quote_id
+
+
+class LemmaIndex:
+    """
+    In-process inverted index for the word search in front of Database, with the same get_quotes_by_word:
+    lemma -> sorted array of quote ids. Quote texts are lemmatized once, when the index is loaded or a quote is
+    added, and a search lemmatizes only the query word. Quotes created or hidden by other bot instances or shards
+    are picked up by catch_up() at most every catch_up_interval seconds of searching: a quote gets a new version
+    from a sequence when it is created and when its visibility changes, and the index reads the versions after
+    the last read one.
+    """
+
+    def __init__(self, db, *, lemmatize=get_lemma, catch_up_interval=CATCH_UP_INTERVAL,
+                 catch_up_window=CATCH_UP_WINDOW):
+        self.db = db
+        self.lemmatize = lemmatize
+        self.catch_up_interval = catch_up_interval
+        self.catch_up_window = catch_up_window
+        self.postings = {}  # lemma -> array('i') of quote ids, ascending
+        self.private = set()  # private quote ids
+        self.indexed = bytearray()  # quote id -> 1 when the lemmas of the quote are in the postings
+        self.quotes = 0
+        self.last_version = 0  # quote versions up to this one were read from the database
+        self.caught_up_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.catch_up_lock = threading.Lock()
+
+    def get_lemmas(self, text: str) -> set:
+        return {self.lemmatize(word) for word in WORD_PATTERN.findall(text.lower())}
+
+    def add_quote(self, quote_id: int, text: str, private: bool):
+        # idempotent, the quote may be added by the bot before it is read by catch_up()
+        if self.is_indexed(quote_id):
+            with self.lock:
+                self.set_private(quote_id, private)
+            return
+        lemmas = self.get_lemmas(text)
+        with self.lock:
+            if quote_id >= len(self.indexed):
+                self.indexed.extend(bytes(max(quote_id + 1, 2 * len(self.indexed)) - len(self.indexed)))
+            if not self.indexed[quote_id]:
+                self.indexed[quote_id] = 1
+                self.quotes += 1
+            for lemma in lemmas:
+                postings = self.postings.get(lemma)
+                if postings is None:
+                    self.postings[lemma] = array('i', (quote_id,))
+                elif postings[-1] < quote_id:
+                    postings.append(quote_id)
+                elif not contains(postings, quote_id):
+                    postings.insert(bisect.bisect_left(postings, quote_id), quote_id)
+            self.set_private(quote_id, private)
+
+    def is_indexed(self, quote_id: int) -> bool:
+        return quote_id < len(self.indexed) and self.indexed[quote_id] == 1
+
+    def set_private(self, quote_id: int, private: bool):
+        if private:
+            self.private.add(quote_id)
+        else:
+            self.private.discard(quote_id)
+
+    def catch_up(self, *, batch_size=LOAD_BATCH_SIZE) -> int:
+        # reads the quotes changed after the last read version, the first call loads the whole table; a version
+        # is taken before its transaction commits, so one committed late may be lower than the last read one and
+        # the last catch_up_window versions are read again; returns the number of quotes added to the index
+        added = 0
+        self.caught_up_at = time.monotonic()
+        after_version = max(0, self.last_version - self.catch_up_window)
+        while True:
+            quotes = self.db.get_quote_texts(after_version=after_version, max_amount=batch_size)
+            for quote_id, text, private, version in quotes:
+                added += not self.is_indexed(quote_id)
+                self.add_quote(quote_id, text, private)
+            if quotes:
+                after_version = quotes[-1][3]
+                self.last_version = max(self.last_version, after_version)
+            if len(quotes) < batch_size:
+                return added
+            logger.debug('%s quotes indexed', added)
+
+    def load(self, *, batch_size=LOAD_BATCH_SIZE):
+        added = self.catch_up(batch_size=batch_size)
+        logger.info('Индекс лемм: %s цитат, %s лемм', added, len(self.postings))
+
+    def get_quotes_by_word(self, vk_id: int, word: str, search_param: SearchParams, max_amount: int) -> list:
+        # matches are returned newest first
+        if time.monotonic() - self.caught_up_at > self.catch_up_interval and self.catch_up_lock.acquire(False):
+            try:
+                self.catch_up()
+            finally:
+                self.catch_up_lock.release()
+        postings = self.postings.get(self.lemmatize(word.strip().lower()))
+        if postings is None:
+            return []
+        own = set(self.db.get_my_quotes(vk_id=vk_id)) if search_param != SearchParams.PUBLISHED else set()
+        with self.lock:
+            if search_param == SearchParams.PRIVATE:
+                return [x for x in sorted(own, reverse=True) if contains(postings, x)][:max_amount]
+            found = []
+            for quote_id in reversed(postings):
+                if len(found) == max_amount:
+                    break
+                if search_param == SearchParams.PUBLISHED:
+                    visible = quote_id not in self.private
+                elif search_param == SearchParams.PUBLIC:
+                    visible = quote_id not in self.private and quote_id not in own
+                else:
+                    visible = quote_id not in self.private or quote_id in own
+                if visible:
+                    found.append(quote_id)
+            return found
+
+    def stats(self) -> dict:
+        with self.lock:
+            postings = sum(len(x) for x in self.postings.values())
+            size = sum(x.buffer_info()[1] * x.itemsize for x in self.postings.values())
+        return {'quotes': self.quotes, 'lemmas': len(self.postings), 'postings': postings, 'postings_bytes': size,
+                'private': len(self.private)}
@@ -0,0 +1,86 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOGGER_NAME = 'quotes_bot'
+LOG_FILE = 'logs.txt'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_QUEUE_SIZE = 10000  # records waiting for the writer, newer ones are dropped when it is full
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s'
+RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger('{}.{}'.format(LOGGER_NAME, name))
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line, fields passed in extra= are kept as keys
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    # the handler thread never waits for the writer: a record that does not fit in the queue is dropped
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def attach_queue(log_queue, level):
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def setup_logging(level=logging.INFO, *, path=LOG_FILE, json_format=True, console=True,
+                  log_queue=None) -> QueueListener:
+    """
+    Records of the bot loggers are put in a queue and written by a background thread to the rotated log file
+    and to stderr. log_queue may be a multiprocessing queue shared with worker processes.
+    """
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if path:
+        handlers.append(RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf8'))
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if log_queue is None:
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    listener = QueueListener(log_queue, *handlers)
+    attach_queue(log_queue, level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,8 +1,15 @@
 # ! /usr/bin/env python
 # -*- coding: utf-8 -*-
+import threading
 import pymorphy2
 from enum import Enum
 
+from src.cache import LRUCache
+
+WORD_STATES_CACHE_SIZE = 10000
+LEMMAS_CACHE_SIZE = 100000  # distinct words of the indexed quotes
+WARM_UP_WORDS = ('цитата', 'жизнь', 'любовь')
+
 
 class State(Enum):
     ALIAS_INPUT = 0  # entering pseudonym
@@ -22,6 +29,19 @@ class SearchParams(Enum):
     ALL = 0
     PRIVATE = 1
     PUBLIC = 2
+    PUBLISHED = 3  # every public quote, own ones included: the same for all users
+
+
+class WordSearchEngine(Enum):
+    WORD_STATES = 0  # ILIKE over every form of the word
+    FULL_TEXT = 1  # indexed postgres full-text search
+    LEMMA_INDEX = 2  # in-process inverted index of lemmas, see src.lemma_index
+
+
+class Deployment(Enum):
+    SINGLE_PROCESS = 0  # one process serves the group
+    SHARDED = 1  # worker processes of one instance, every user is served by one of them
+    MULTI_INSTANCE = 2  # several instances serve the group, any of them may get an event of a user
 
 
 class Keyboard(Enum):
@@ -31,6 +51,7 @@ class Keyboard(Enum):
     MY_QUOTES = 3           # handling user's quotes
     RETURN = 5              # only return button
     EMPTY = 6               # empty
+    SEARCH_RESULTS = 7      # next page and return buttons
 
 
 class BotRuntimeError(Exception):
@@ -60,13 +81,45 @@ def check_args(args: dict):
             raise BotRuntimeError(BotRuntimeError.ErrorCodes.TYPE_ERROR.value, what, False)
 
 
+_morph = None
+_morph_lock = threading.Lock()
+word_states_cache = LRUCache(WORD_STATES_CACHE_SIZE)  # word -> frozenset of its forms
+lemmas_cache = LRUCache(LEMMAS_CACHE_SIZE)  # word -> normal form
+
+
+def get_morph_analyzer() -> pymorphy2.MorphAnalyzer:
+    # loading the dictionaries is expensive, so one analyzer is shared by the whole process
+    global _morph
+    if _morph is None:
+        with _morph_lock:
+            if _morph is None:
+                _morph = pymorphy2.MorphAnalyzer()
+    return _morph
+
+
+def warm_up_morph(words=WARM_UP_WORDS):
+    get_morph_analyzer()
+    for word in words:
+        get_word_states(word)
+
+
 def get_word_states(word: str) -> list:
-    word_states = []
-    morph = pymorphy2.MorphAnalyzer()
-    str = morph.parse(word.strip())[0]
-    for x in str.lexeme:
-        word_states.append(x.word)
-    return list(set(word_states))
+    word = word.strip().lower()
+    word_states = word_states_cache.get(word)
+    if word_states is None:
+        parsed = get_morph_analyzer().parse(word)[0]
+        word_states = frozenset(x.word for x in parsed.lexeme)
+        word_states_cache.put(word, word_states)
+    return list(word_states)
+
+
+def get_lemma(word: str) -> str:
+    word = word.strip().lower()
+    lemma = lemmas_cache.get(word)
+    if lemma is None:
+        lemma = get_morph_analyzer().parse(word)[0].normal_form
+        lemmas_cache.put(word, lemma)
+    return lemma
 
 
 if __name__ == '__main__':
@@ -0,0 +1,188 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.log import get_logger
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = get_logger('metrics')
+
+
+def format_labels(names: tuple, values: tuple, extra='') -> str:
+    labels = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> value
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def get(self, labels=()):
+        return self.series.get(labels, 0)
+
+    def collect(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, value in series:
+            lines.append('{}{} {}'.format(self.name, format_labels(self.labels, labels), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, labels=()) -> int:
+        series = self.series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def collect(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            series = sorted((labels, list(values)) for labels, values in self.series.items())
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name,
+                                                     format_labels(self.labels, labels, 'le="{}"'.format(bound)),
+                                                     cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, labels), values[-1]))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, labels), cumulative))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}  # label values -> value
+
+    def set(self, labels: tuple, value: float):
+        self.series[labels] = value
+
+    def get(self, labels=()):
+        return self.series.get(labels, 0)
+
+    def collect(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} gauge'.format(self.name)]
+        for labels, value in sorted(self.series.items()):
+            lines.append('{}{} {}'.format(self.name, format_labels(self.labels, labels), value))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.collect()) + '\n'
+
+
+registry = Registry()
+handler_seconds = registry.register(Histogram('quotes_bot_handler_seconds', 'Time to handle a message.',
+                                              ('command', 'state')))
+db_query_seconds = registry.register(Histogram('quotes_bot_db_query_seconds', 'Time of a Database method.',
+                                               ('method',)))
+vk_request_seconds = registry.register(Histogram('quotes_bot_vk_request_seconds', 'Time of a VK API request.',
+                                                 ('method',)))
+errors_total = registry.register(Counter('quotes_bot_errors_total', 'Errors raised by the handlers.', ('code',)))
+handler_failures_total = registry.register(Counter('quotes_bot_handler_failures_total',
+                                                   'Events left unhandled by an exception.', ('error',)))
+vk_errors_total = registry.register(Counter('quotes_bot_vk_errors_total', 'Errors returned by the VK API.',
+                                            ('method', 'code')))
+send_queue_depth = registry.register(Gauge('quotes_bot_send_queue_depth', 'Outbound VK API requests waiting.'))
+send_seconds = registry.register(Histogram('quotes_bot_send_seconds',
+                                           'Time from queueing an outbound VK API request to its answer.',
+                                           ('method',)))
+send_requests_total = registry.register(Counter('quotes_bot_send_requests_total',
+                                                'Outbound VK API requests and calls of execute by the outcome.',
+                                                ('result',)))
+search_cache_total = registry.register(Counter('quotes_bot_search_cache_total', 'Lookups of the search cache.',
+                                               ('scope', 'result')))
+quote_cache_total = registry.register(Counter('quotes_bot_quote_cache_total', 'Lookups of the rendered quotes.',
+                                              ('result',)))
+quote_cache_size = registry.register(Gauge('quotes_bot_quote_cache_size', 'Rendered quotes kept in memory.'))
+shard_queue_depth = registry.register(Gauge('quotes_bot_shard_queue_depth',
+                                            'Events handed to a worker process and not yet taken.', ('shard',)))
+callback_events_total = registry.register(Counter('quotes_bot_callback_events_total',
+                                                  'Callback API requests by the answer.', ('result',)))
+
+
+def timed(histogram: Histogram):
+    # observes the wall time of every call labeled by the function name
+    def decorator(function):
+        labels = (function.__name__,)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(labels, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int, host='') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info('Метрики доступны на порту %s%s', server.server_address[1], METRICS_PATH)
+    return server
@@ -0,0 +1,254 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from enum import Enum
+
+import vk_api
+from vk_api.exceptions import TOO_MANY_RPS_CODE
+
+from src import metrics
+from src.log import get_logger
+
+EXECUTE_CALLS_LIMIT = 25  # API calls allowed in one execute
+SEND_RATE = 20  # requests per second allowed for a community token
+SEND_BURST = 20
+SEND_WORKERS = 4
+SEND_RETRIES = 5
+RETRY_DELAY = 0.5  # seconds, doubled after every retry and jittered
+RETRY_MAX_DELAY = 8
+RATE_LIMIT_CODES = (TOO_MANY_RPS_CODE, 9, 29)  # too many requests per second, flood control, rate limit reached
+
+logger = get_logger('outbound')
+
+
+class SendPriority(Enum):
+    INTERACTIVE = 0  # replies to the user's action
+    BULK = 1  # lists of quotes
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # a token is reserved right away, the caller sleeps until the reservation is covered by the refill
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_DELAY * 2 ** attempts, RETRY_MAX_DELAY) * random.uniform(0.5, 1.5)
+
+
+class SendRequest:
+    __slots__ = ('method', 'values', 'raw', 'priority', 'attempts', 'enqueued', 'future')
+
+    def __init__(self, method: str, values: dict, raw: bool, priority: SendPriority):
+        self.method = method
+        self.values = values
+        self.raw = raw
+        self.priority = priority
+        self.attempts = 0
+        self.enqueued = time.monotonic()
+        self.future = Future()
+
+
+class SendQueue:
+    """
+    Outbound VK API requests throttled by a token bucket. Interactive requests overtake bulk ones, requests failed
+    with a rate-limit error are retried with a jittered exponential delay.
+    """
+
+    def __init__(self, session_factory, *, rate=SEND_RATE, burst=SEND_BURST, workers=SEND_WORKERS,
+                 autostart=True):
+        # every worker makes its own VkApi: a VkApi serializes its requests with a lock
+        self.session_factory = session_factory
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        if autostart:
+            self.start()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name='sender-{}'.format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put((len(SendPriority), next(self.order), None))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def put(self, request: SendRequest):
+        self.queue.put((request.priority.value, next(self.order), request))
+        metrics.send_queue_depth.set((), self.queue.qsize())
+
+    def submit(self, method: str, values: dict, *, raw=False, priority=SendPriority.INTERACTIVE) -> Future:
+        request = SendRequest(method, values, raw, priority)
+        self.put(request)
+        return request.future
+
+    def call(self, method: str, values: dict, *, raw=False, priority=SendPriority.INTERACTIVE):
+        return self.submit(method, values, raw=raw, priority=priority).result()
+
+    def work(self):
+        vk_session = self.session_factory()
+        vk_session.RPS_DELAY = 0
+        vk_session.error_handlers.pop(TOO_MANY_RPS_CODE, None)
+        while True:
+            request = self.queue.get()[2]
+            if request is None:
+                return
+            metrics.send_queue_depth.set((), self.queue.qsize())
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = vk_session.method(request.method, request.values, raw=request.raw)
+            except vk_api.ApiError as e:
+                metrics.vk_errors_total.inc((request.method, e.code))
+                if e.code in RATE_LIMIT_CODES and request.attempts < SEND_RETRIES:
+                    self.retry(request)
+                else:
+                    self.finish(request, error=e)
+            except Exception as e:
+                self.finish(request, error=e)
+            else:
+                self.finish(request, response=response)
+            finally:
+                metrics.vk_request_seconds.observe((request.method,), time.perf_counter() - start)
+
+    def retry(self, request: SendRequest):
+        delay = retry_delay(request.attempts)
+        request.attempts += 1
+        with self.stats_lock:
+            self.retries += 1
+        metrics.send_requests_total.inc(('retried',))
+        timer = threading.Timer(delay, self.put, (request,))
+        timer.daemon = True
+        timer.start()
+
+    def finish(self, request: SendRequest, *, response=None, error=None):
+        latency = time.monotonic() - request.enqueued
+        with self.stats_lock:
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        metrics.send_seconds.observe((request.method,), latency)
+        metrics.send_requests_total.inc(('sent' if error is None else 'failed',))
+        if error is None:
+            request.future.set_result(response)
+        else:
+            request.future.set_exception(error)
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            done = self.sent + self.failed
+            return {'depth': self.queue.qsize(), 'sent': self.sent, 'retries': self.retries, 'failed': self.failed,
+                    'latency_avg': self.latency_total / done if done else 0.0, 'latency_max': self.latency_max}
+
+
+def build_execute_code(calls: list) -> str:
+    # VKScript accepts JSON objects as method arguments; the calls run in the listed order and the code returns
+    # at the first failed one, so no later message is delivered before it
+    sends = ['r = API.messages.send({}); results.push(r); if (!r) {{ return results; }}'.format(
+        json.dumps(values, ensure_ascii=False)) for values in calls]
+    return 'var results = []; var r = 0; {} return results;'.format(' '.join(sends))
+
+
+class OutboundSender:
+    """
+    Delivers messages.send calls. Calls made by a thread inside batch() are collected and delivered together
+    when the block ends, as execute requests of up to EXECUTE_CALLS_LIMIT calls. Every request waits for its
+    delivery, so the messages of a user keep their order.
+    """
+
+    def __init__(self, send_queue: SendQueue):
+        self.send_queue = send_queue
+        self.local = threading.local()
+
+    @contextmanager
+    def batch(self):
+        calls = self.local.calls = []
+        try:
+            yield
+        finally:
+            self.local.calls = None
+            self.flush(calls)
+
+    def send(self, *, priority=SendPriority.INTERACTIVE, **values):
+        values = {key: value for key, value in values.items() if value is not None}
+        calls = getattr(self.local, 'calls', None)
+        if calls is None:
+            self.flush([(priority, values)])
+        else:
+            calls.append((priority, values))
+
+    def flush(self, calls: list):
+        # an execute stops at a failed call: a rate-limited one is delivered again with the calls after it after a
+        # jittered delay, a call failed otherwise is dropped and the rest are delivered
+        attempts = 0
+        while calls:
+            chunk = calls[:EXECUTE_CALLS_LIMIT]
+            delivered, error = self.deliver(chunk)
+            calls = calls[delivered:]
+            if delivered:
+                attempts = 0
+            if error is None:
+                continue
+            metrics.vk_errors_total.inc((error.get('method'), error.get('error_code')))
+            if error.get('error_code') in RATE_LIMIT_CODES and attempts < SEND_RETRIES:
+                metrics.send_requests_total.inc(('retried',))
+                time.sleep(retry_delay(attempts))
+                attempts += 1
+                continue
+            metrics.send_requests_total.inc(('failed',))
+            logger.warning('execute error in %s: %s %s', error.get('method'), error.get('error_code'),
+                           error.get('error_msg'))
+            calls = calls[1:]
+
+    def deliver(self, chunk: list) -> tuple:
+        # (calls delivered, error of the call that stopped the execute or None); an interactive call makes the
+        # whole chunk interactive
+        priority = min((priority for priority, values in chunk), key=lambda x: x.value)
+        if len(chunk) == 1:
+            self.send_queue.call('messages.send', chunk[0][1], priority=priority)
+            return 1, None
+        code = build_execute_code([values for priority, values in chunk])
+        response = self.send_queue.call('execute', {'code': code}, raw=True, priority=priority)
+        results = response.get('response', [])
+        if False not in results:
+            return len(results), None
+        errors = response.get('execute_errors') or [{}]
+        return results.index(False), errors[0]
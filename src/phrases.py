@@ -18,6 +18,7 @@ class UserPhrases(Enum):
     SEARCH_QUOTE = "найти цитату"
     FAQ = "справка"
     RETURN = "вернуться"
+    NEXT_PAGE = "дальше"
 
 
 class KeyboardHints(Enum):
@@ -33,6 +34,7 @@ class KeyboardHints(Enum):
     SEARCH_BY_WORD = "Напиши интересующее слово."
     SEARCH_BY_TAG = "Напиши один или несколько тегов через пробел."
     SEARCH_MENU = "Выбери подходящий способ поиска."
+    SEARCH_END = "Больше цитат по этому запросу нет."
 
     ALIAS_CHANGING = "Придумай новый псевдоним."
     MY_QUOTES_EMPTY = "Список ваших высказываний пуст."
@@ -67,7 +69,8 @@ class GroupPhrases(Enum):
                          "опубликованных цитат. Ты можешь изменить эту настройку, указав в конце сообщения " \
                          "один из параметров:\n\n" \
                          " @p - поиск только по твоим цитатам\n" \
-                         " @a - поиск по высказываниям других пользователей"
+                         " @a - поиск по высказываниям других пользователей\n\n" \
+                         "Слово \"дальше\" показывает следующие цитаты поиска, поэтому само его найти нельзя."
     SEARCH_BY_TAG_FAQ = "Ты можешь прочитать высказывания, добавленные другими пользователями. Все они будут " \
                         "содержать переданный тег. Или сразу несколько, если ты напишешь их через пробел. " \
                         "По умолчанию поиск происходит среди всех опубликованных цитат. Ты можешь изменить эту " \
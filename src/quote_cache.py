@@ -0,0 +1,55 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from src.cache import LRUCache
+from src.metrics import quote_cache_size, quote_cache_total
+
+QUOTE_CACHE_SIZE = 50000
+
+
+class RenderedQuote:
+    __slots__ = ('text', 'attachments', 'private')
+
+    def __init__(self, quote_data: dict):
+        self.text = quote_data['text'] + '\n©' + quote_data['author']
+        self.attachments = quote_data['attachments']
+        self.private = quote_data['private']
+
+
+class QuoteCache:
+    """
+    LRU of rendered quotes by quote_id in front of Database.get_quotes. A quote does not change after it is
+    created, except for the private flag set by remove_user_quote, which drops it from the cache.
+    """
+
+    def __init__(self, db, *, maxsize=QUOTE_CACHE_SIZE):
+        self.db = db
+        self.quotes = LRUCache(maxsize)
+
+    def put(self, quote_data: dict) -> RenderedQuote:
+        quote = RenderedQuote(quote_data)
+        self.quotes.put(quote_data['quote_id'], quote)
+        return quote
+
+    def get_quotes(self, quote_ids: list) -> list:
+        # (quote_id, RenderedQuote) in the order of quote_ids, unknown ids are skipped; misses are fetched at once
+        found = {quote_id: self.quotes.get(quote_id) for quote_id in quote_ids}
+        missing = [quote_id for quote_id, quote in found.items() if quote is None]
+        quote_cache_total.inc(('hit',), len(found) - len(missing))
+        if missing:
+            quote_cache_total.inc(('miss',), len(missing))
+            for quote_data in self.db.get_quotes(quote_ids=missing):
+                found[quote_data['quote_id']] = self.put(quote_data)
+            quote_cache_size.set((), len(self.quotes))
+        return [(quote_id, found[quote_id]) for quote_id in quote_ids if found[quote_id] is not None]
+
+    def get_quote(self, quote_id: int) -> RenderedQuote or None:
+        quotes = self.get_quotes([quote_id])
+        return quotes[0][1] if quotes else None
+
+    def invalidate(self, quote_id: int):
+        self.quotes.pop(quote_id)
+        quote_cache_size.set((), len(self.quotes))
+
+    def stats(self) -> dict:
+        return self.quotes.stats()
@@ -0,0 +1,153 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from array import array
+
+from src.cache import LRUCache
+from src.methods import SearchParams
+from src.metrics import search_cache_total
+
+SEARCH_CACHE_SIZE = 10000
+SEARCH_CACHE_TTL = 300  # seconds, bounds staleness after writes made by other bot instances
+
+
+def query_matches(query: tuple, text: str, tags: set, lexemes: set, word_lexemes: dict) -> bool:
+    # whether a new quote could be found by the query; a full-text query matches when the quote has all of its
+    # lexemes, a query whose lexemes are unknown is assumed to match
+    kind = query[0]
+    if kind == 'tag':
+        return bool(query[1] & tags)
+    if kind == 'word_states':
+        return any(state in text for state in query[1])
+    query_lexemes = word_lexemes.get(query[1])
+    return query_lexemes is None or query_lexemes <= lexemes
+
+
+class SearchCache:
+    """
+    Cache of search matches in front of Database, with the same search methods. Public matches of a query are
+    shared by all users, the matches among the quotes of a user are kept per user; a search combines the two by
+    SearchParams, own private matches following the public ones. Writes go through the cache and drop only the
+    entries they could change: a new quote is matched against the queries by its text, tags and lexemes, a removed
+    one is found in the entries by an index of the cached ids. When other worker processes serve the users too,
+    cache_published is off: a quote made private there would stay in the public matches here, so they are read from
+    the database on every search. Several bot instances do not use the cache at all.
+    """
+
+    def __init__(self, db, *, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, cache_published=True):
+        self.db = db
+        self.cache_published = cache_published
+        # ('published', query) or ('own', vk_id, query) -> array of ids
+        self.entries = LRUCache(maxsize, ttl=ttl, on_evict=self.unindex)
+        self.lock = threading.Lock()
+        self.index = {}  # quote id -> keys of the entries holding it
+        self.index_lock = threading.Lock()  # taken last, also under the lock of the entries
+        self.word_lexemes = {}  # normalised word of a cached full-text query -> its lexemes
+        self.generation = 0  # changed by every write, a lookup that raced with one is not stored
+
+    def lookup(self, key: tuple, fetch) -> array:
+        quote_ids = self.entries.get(key)
+        if quote_ids is not None:
+            search_cache_total.inc((key[0], 'hit'))
+            return quote_ids
+        search_cache_total.inc((key[0], 'miss'))
+        generation = self.generation
+        quote_ids = array('i', fetch())
+        with self.lock:
+            if generation == self.generation:
+                self.entries.put(key, quote_ids)
+                with self.index_lock:
+                    for quote_id in quote_ids:
+                        self.index.setdefault(quote_id, set()).add(key)
+        return quote_ids
+
+    def unindex(self, key: tuple, quote_ids: array):
+        with self.index_lock:
+            for quote_id in quote_ids:
+                keys = self.index.get(quote_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.index[quote_id]
+
+    def search(self, query: tuple, vk_id: int, search_param: SearchParams, max_amount: int, fetch) -> list:
+        own = self.lookup(('own', vk_id, query), lambda: fetch(SearchParams.PRIVATE))
+        if search_param == SearchParams.PRIVATE:
+            return own[:max_amount].tolist()
+        if self.cache_published:
+            published = self.lookup(('published', query), lambda: fetch(SearchParams.PUBLISHED))
+        else:
+            published = array('i', fetch(SearchParams.PUBLISHED))
+        own_ids = set(own)
+        if search_param == SearchParams.PUBLIC:
+            return [x for x in published if x not in own_ids][:max_amount]
+        published_ids = set(published)
+        return (published.tolist() + [x for x in own if x not in published_ids])[:max_amount]
+
+    def invalidate(self, predicate):
+        with self.lock:
+            self.entries.evict(predicate)
+            self.generation += 1
+
+    def get_lexemes(self, text: str) -> set:
+        # lexemes of the quote text, the words of the cached full-text queries are normalised in the same query
+        words = {key[-1][1] for key in self.entries.keys() if key[-1][0] == 'word'}
+        known = {word: self.word_lexemes[word] for word in words if word in self.word_lexemes}
+        missing = sorted(words - known.keys())
+        self.word_lexemes = known
+        if not words:
+            return set()
+        lexemes = self.db.get_lexemes([text] + missing)
+        known.update((word, frozenset(x)) for word, x in zip(missing, lexemes[1:]))
+        return set(lexemes[0])
+
+    def get_quotes_by_word(self, vk_id: int, word: str, search_param: SearchParams, max_amount: int) -> list:
+        return self.search(('word', word.lower(), max_amount), vk_id, search_param, max_amount,
+                           lambda param: self.db.get_quotes_by_word(vk_id=vk_id, word=word, search_param=param,
+                                                                    max_amount=max_amount))
+
+    def get_quotes_by_word_states(self, vk_id: int, word_states: list, search_param: SearchParams,
+                                  max_amount: int) -> list:
+        query = ('word_states', frozenset(x.lower() for x in word_states), max_amount)
+        return self.search(query, vk_id, search_param, max_amount,
+                           lambda param: self.db.get_quotes_by_word_states(vk_id=vk_id, word_states=word_states,
+                                                                           search_param=param, max_amount=max_amount))
+
+    def get_quotes_by_tag(self, vk_id: int, tags: list, search_param: SearchParams, max_amount: int) -> list:
+        query = ('tag', frozenset(x.lower() for x in tags), max_amount)
+        return self.search(query, vk_id, search_param, max_amount,
+                           lambda param: self.db.get_quotes_by_tag(vk_id=vk_id, tags=tags, search_param=param,
+                                                                   max_amount=max_amount))
+
+    def create_quote(self, vk_id: int, text: str, *, tags=None, author='', attachments=None, private=False) -> dict:
+        quote = self.db.create_quote(vk_id=vk_id, text=text, tags=tags, author=author, attachments=attachments,
+                                     private=private)
+        lexemes = self.get_lexemes(text)
+        word_lexemes = self.word_lexemes
+        text = text.lower()
+        tags = {x.lower() for x in tags or []}
+
+        def changed(key, quote_ids):
+            if key[0] == 'own':
+                return key[1] == vk_id and query_matches(key[2], text, tags, lexemes, word_lexemes)
+            return not private and query_matches(key[1], text, tags, lexemes, word_lexemes)
+        self.invalidate(changed)
+        return quote
+
+    def add_quote_to_user(self, vk_id: int, quote_id: int):
+        self.db.add_quote_to_user(vk_id=vk_id, quote_id=quote_id)
+        self.invalidate(lambda key, quote_ids: key[0] == 'own' and key[1] == vk_id)
+
+    def remove_user_quote(self, vk_id: int, quote_id: int):
+        # the quote may become private, public matches holding it are dropped too
+        self.db.remove_user_quote(vk_id=vk_id, quote_id=quote_id)
+        with self.lock:
+            with self.index_lock:
+                keys = [key for key in self.index.get(quote_id, ()) if key[0] == 'published' or key[1] == vk_id]
+            for key in keys:
+                self.entries.pop(key)
+            self.generation += 1
+
+    def stats(self) -> dict:
+        return self.entries.stats()
@@ -0,0 +1,149 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from array import array
+
+from src.cache import LRUCache
+from src.methods import State
+
+SESSION_CACHE_SIZE = 10000
+SESSION_TTL = 600  # seconds, several bot instances keep the sessions in the database, see SharedSessions
+
+
+class Session:
+    __slots__ = ('exists', 'state', 'alias')
+
+    def __init__(self, exists: bool, state=None, alias=None):
+        self.exists = exists
+        self.state = state
+        self.alias = alias
+
+
+class SearchCursor:
+    __slots__ = ('quote_ids', 'position')
+
+    def __init__(self, quote_ids: list):
+        self.quote_ids = array('i', quote_ids)  # ids matched by the last search, pages are served from position
+        self.position = 0
+
+
+class SessionCache:
+    """
+    Write-through cache of the per-user bookkeeping (exists, state, alias) in front of Database.
+    A user's events are handled one at a time, so a session is never changed concurrently.
+    The search cursor lives only here, apart from the session so that the session TTL does not end the paging:
+    it is dropped when the state changes or it is evicted by newer searches.
+    """
+
+    def __init__(self, db, *, maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL):
+        self.db = db
+        self.sessions = LRUCache(maxsize, ttl=ttl)
+        self.cursors = LRUCache(maxsize)  # vk_id -> SearchCursor
+
+    def get_session(self, vk_id: int) -> Session:
+        session = self.sessions.get(vk_id)
+        if session is None:
+            session = Session(self.db.user_exists(vk_id=vk_id))
+            self.sessions.put(vk_id, session)
+        return session
+
+    def invalidate(self, vk_id: int):
+        self.sessions.pop(vk_id)
+
+    def user_exists(self, vk_id: int) -> bool:
+        return self.get_session(vk_id).exists
+
+    def create_user(self, vk_id: int, alias: str):
+        self.db.create_user(vk_id=vk_id, alias=alias)
+        self.sessions.put(vk_id, Session(True, State.ALIAS_INPUT, alias))
+
+    def get_user_state(self, vk_id: int) -> State:
+        session = self.get_session(vk_id)
+        if session.state is None:
+            session.state = self.db.get_user_state(vk_id=vk_id)
+        return session.state
+
+    def set_user_state(self, vk_id: int, state: State):
+        session = self.get_session(vk_id)
+        if session.state == state:
+            return
+        self.db.set_user_state(vk_id=vk_id, state=state)
+        session.state = state
+        self.cursors.pop(vk_id)
+
+    def get_user_alias(self, vk_id: int) -> str:
+        session = self.get_session(vk_id)
+        if session.alias is None:
+            session.alias = self.db.get_user_alias(vk_id=vk_id)
+        return session.alias
+
+    def set_user_alias(self, vk_id: int, alias: str):
+        self.db.set_user_alias(vk_id=vk_id, alias=alias)
+        session = self.sessions.get(vk_id)
+        if session is not None:
+            session.alias = alias
+
+    def start_search(self, vk_id: int, quote_ids: list):
+        self.cursors.put(vk_id, SearchCursor(quote_ids))
+
+    def next_search_page(self, vk_id: int, amount: int) -> list:
+        cursor = self.cursors.get(vk_id)
+        if cursor is None:
+            return []
+        page = cursor.quote_ids[cursor.position:cursor.position + amount].tolist()
+        cursor.position += len(page)
+        return page
+
+    def search_remaining(self, vk_id: int) -> int:
+        cursor = self.cursors.get(vk_id)
+        return len(cursor.quote_ids) - cursor.position if cursor is not None else 0
+
+
+class SharedSessions:
+    """
+    The per-user bookkeeping of a bot that serves the group together with other instances, with the methods of
+    SessionCache. Another instance may handle the next event of the user, so the state, the alias and the search
+    cursor are read from and written to Database every time; only the existence of a user is cached, users are
+    never deleted.
+    """
+
+    def __init__(self, db, *, maxsize=SESSION_CACHE_SIZE):
+        self.db = db
+        self.existing = LRUCache(maxsize)  # vk_id -> True
+
+    def invalidate(self, vk_id: int):
+        pass
+
+    def user_exists(self, vk_id: int) -> bool:
+        if self.existing.get(vk_id) is not None:
+            return True
+        exists = self.db.user_exists(vk_id=vk_id)
+        if exists:
+            self.existing.put(vk_id, True)
+        return exists
+
+    def create_user(self, vk_id: int, alias: str):
+        self.db.create_user(vk_id=vk_id, alias=alias)
+        self.existing.put(vk_id, True)
+
+    def get_user_state(self, vk_id: int) -> State:
+        return self.db.get_user_state(vk_id=vk_id)
+
+    def set_user_state(self, vk_id: int, state: State):
+        # the statement leaves an equal state and its search cursor as they are
+        self.db.set_user_state(vk_id=vk_id, state=state)
+
+    def get_user_alias(self, vk_id: int) -> str:
+        return self.db.get_user_alias(vk_id=vk_id)
+
+    def set_user_alias(self, vk_id: int, alias: str):
+        self.db.set_user_alias(vk_id=vk_id, alias=alias)
+
+    def start_search(self, vk_id: int, quote_ids: list):
+        self.db.start_search(vk_id=vk_id, quote_ids=quote_ids)
+
+    def next_search_page(self, vk_id: int, amount: int) -> list:
+        return self.db.next_search_page(vk_id=vk_id, amount=amount)
+
+    def search_remaining(self, vk_id: int) -> int:
+        return self.db.search_remaining(vk_id=vk_id)
@@ -0,0 +1,222 @@
+# ! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from queue import Full
+import requests
+import vk_api
+from vk_api.bot_longpoll import VkBotLongPoll
+
+from src.methods import BotRuntimeError, Deployment, WordSearchEngine
+from src.outbound import SEND_BURST, SEND_RATE, SendQueue
+from src.dispatcher import get_event_vk_id
+from src.metrics import shard_queue_depth, start_metrics_server
+from src.log import attach_queue, get_logger
+
+SHARD_QUEUE_SIZE = 1000
+SHUTDOWN_TIMEOUT = 30
+STOP_POLL_INTERVAL = 0.1
+SHARD_PUT_TIMEOUT = 1  # seconds a full shard queue blocks the ingress before the worker is checked
+QUEUE_DEPTH_INTERVAL = 1  # seconds between updates of the shard queue depth gauge
+QUEUE_DEPTH_REPORT_INTERVAL = 60
+INGRESS_RETRY_DELAY = 1
+
+logger = get_logger('workers')
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def shard_events(queue: multiprocessing.Queue, received):
+    # raw events are passed between processes, the ingress stops a worker by sending None
+    while True:
+        raw_event = queue.get()
+        if raw_event is None:
+            return
+        with received.get_lock():
+            received.value += 1
+        event_class = VkBotLongPoll.CLASS_BY_EVENT_TYPE.get(raw_event['type'], VkBotLongPoll.DEFAULT_EVENT_CLASS)
+        yield event_class(raw_event)
+
+
+def worker_main(shard: int, shards: int, instances: int, queue: multiprocessing.Queue, received, group_auth: dict,
+                database_auth: dict, warm_up: bool, word_search: WordSearchEngine, metrics_port: int, log_queue,
+                log_level: int):
+    # the ingress process coordinates shutdown, a worker only drains its queue up to the stop marker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    from src.bot_base import BotBase
+
+    if log_queue is not None:
+        # records are written by the listener of the ingress process
+        attach_queue(log_queue, log_level)
+    if metrics_port:
+        # every worker process has its own metrics, the ingress uses metrics_port and shard N metrics_port + 1 + N
+        start_metrics_server(metrics_port + 1 + shard)
+    # the request rate of the group token is shared by the shards of all instances, every one throttles to its part
+    senders = shards * instances
+    send_queue = SendQueue(functools.partial(vk_api.VkApi, token=group_auth['group_token']),
+                           rate=SEND_RATE / senders, burst=max(1.0, SEND_BURST / senders))
+    deployment = Deployment.MULTI_INSTANCE if instances > 1 else Deployment.SHARDED
+    bot = BotBase(group_auth=group_auth, database_auth=database_auth, warm_up=warm_up, word_search=word_search,
+                  deployment=deployment, send_queue=send_queue)
+    while True:
+        try:
+            # a new iterator per run, the queue keeps the events the failed run did not take
+            bot.run(shard_events(queue, received))
+            break
+        except BotRuntimeError as e:
+            logger.error('shard %s: error accrued with code %s: %s', shard, e.code.value, e.what)
+        except Exception:
+            logger.exception('shard %s: error', shard)
+    bot.db.close_connection()
+
+
+class ShardedRunner:
+    def __init__(self, group_auth: dict, database_auth: dict, *, shards=None, instances=1,
+                 queue_size=SHARD_QUEUE_SIZE, warm_up=False, word_search=WordSearchEngine.FULL_TEXT, metrics_port=0,
+                 log_queue=None, log_level=logging.INFO, shutdown_timeout=SHUTDOWN_TIMEOUT):
+        self.group_auth = group_auth
+        self.database_auth = database_auth
+        self.group_id = group_auth['group_id']
+        self.bot_session = vk_api.VkApi(token=group_auth['group_token'])
+        self.shards = shards or multiprocessing.cpu_count()
+        self.instances = instances  # bot instances serving the group, this one included
+        self.queue_size = queue_size
+        self.warm_up = warm_up
+        self.word_search = word_search
+        self.metrics_port = metrics_port
+        self.log_queue = log_queue
+        self.log_level = log_level
+        self.shutdown_timeout = shutdown_timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.queues, self.received, self.processes = [], [], []
+        self.sent = [0] * self.shards
+        self.stopped = threading.Event()
+        self.metrics_server = None
+
+    def get_shard(self, vk_id: int) -> int:
+        return vk_id % self.shards
+
+    def start(self):
+        self.sent = [0] * self.shards
+        self.queues, self.received, self.processes = [None] * self.shards, [None] * self.shards, [None] * self.shards
+        for shard in range(self.shards):
+            self.start_shard(shard)
+
+    def start_shard(self, shard: int):
+        queue = self.context.Queue(maxsize=self.queue_size)
+        received = self.context.Value('q', 0)
+        process = self.context.Process(target=worker_main, name='shard-{}'.format(shard),
+                                       args=(shard, self.shards, self.instances, queue, received, self.group_auth,
+                                             self.database_auth, self.warm_up, self.word_search, self.metrics_port,
+                                             self.log_queue, self.log_level))
+        process.start()
+        self.queues[shard], self.received[shard], self.processes[shard] = queue, received, process
+        self.sent[shard] = 0
+
+    def restart_shard(self, shard: int):
+        # the queue of a dead worker may be left locked, the events waiting in it are dropped with it
+        lost = self.sent[shard] - self.received[shard].value
+        logger.error('Процесс шарда %s завершился с кодом %s, перезапуск; потеряно событий: %s', shard,
+                     self.processes[shard].exitcode, lost)
+        self.queues[shard].cancel_join_thread()
+        self.queues[shard].close()
+        self.start_shard(shard)
+
+    def put(self, event):
+        shard = self.get_shard(get_event_vk_id(event))
+        while True:
+            if not self.processes[shard].is_alive():
+                self.restart_shard(shard)
+            try:
+                self.queues[shard].put(event.raw, timeout=SHARD_PUT_TIMEOUT)
+                break
+            except Full:
+                logger.warning('Очередь шарда %s заполнена', shard)
+        self.sent[shard] += 1
+
+    def queue_depths(self) -> list:
+        # events handed to a shard and not yet taken by its worker
+        return [sent - received.value for sent, received in zip(self.sent, self.received)]
+
+    def update_queue_depths(self) -> list:
+        depths = self.queue_depths()
+        for shard, depth in enumerate(depths):
+            shard_queue_depth.set((shard,), depth)
+        return depths
+
+    def report_queue_depths(self):
+        reported = time.monotonic()
+        while not self.stopped.wait(QUEUE_DEPTH_INTERVAL):
+            depths = self.update_queue_depths()
+            if time.monotonic() - reported >= QUEUE_DEPTH_REPORT_INTERVAL:
+                reported = time.monotonic()
+                logger.info('shard queue depths: %s', depths)
+
+    def stop(self):
+        self.stopped.set()
+        deadline = time.monotonic() + self.shutdown_timeout
+        # a dead worker never takes the stop marker, a live one with a full queue gets it once there is room
+        pending = set(range(len(self.processes)))
+        while pending and time.monotonic() < deadline:
+            for shard in list(pending):
+                try:
+                    if self.processes[shard].is_alive():
+                        self.queues[shard].put_nowait(None)
+                    pending.discard(shard)
+                except Full:
+                    pass
+            if pending:
+                time.sleep(STOP_POLL_INTERVAL)
+        for shard in pending:
+            logger.warning('Очередь шарда %s заполнена, процесс будет остановлен принудительно', shard)
+        for queue, process in zip(self.queues, self.processes):
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            if process.exitcode != 0:
+                # nobody reads the events left in the queue, they are not waited for
+                queue.cancel_join_thread()
+            queue.close()
+            queue.join_thread()
+        self.queues, self.received, self.processes = [], [], []
+
+    def listen(self, events=None):
+        # events is a blocking iterator of bot events, by default the group long poll is listened
+        if events is not None:
+            for event in events:
+                self.put(event)
+            return
+        while True:
+            longpoll = VkBotLongPoll(self.bot_session, self.group_id)
+            try:
+                logger.info('Ожидание событий long poll')
+                for event in longpoll.listen():
+                    self.put(event)
+            except requests.exceptions.ReadTimeout:
+                continue
+            except Exception:
+                logger.exception('ingress error')
+                time.sleep(INGRESS_RETRY_DELAY)
+
+    def run(self, events=None):
+        signal.signal(signal.SIGTERM, _interrupt)
+        self.stopped.clear()
+        if self.metrics_port and self.metrics_server is None:
+            self.metrics_server = start_metrics_server(self.metrics_port)
+        self.start()
+        threading.Thread(target=self.report_queue_depths, name='queue-depths', daemon=True).start()
+        try:
+            self.listen(events)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
@@ -0,0 +1,115 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import requests
+import vk_api
+
+VK_API_URL = 'https://api.vk.ru'
+EXECUTE_CALL = 'API.messages.send('
+
+
+def parse_execute_code(code: str) -> list:
+    # arguments of every API.messages.send(...) in the code built by src.outbound.build_execute_code
+    decoder = json.JSONDecoder()
+    calls, position = [], code.find(EXECUTE_CALL)
+    while position != -1:
+        values, end = decoder.raw_decode(code, position + len(EXECUTE_CALL))
+        calls.append(values)
+        position = code.find(EXECUTE_CALL, end)
+    return calls
+
+
+class FakeVkSession(requests.Session):
+    # sends the requests vk_api makes to api.vk.ru to the local fake server instead
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(method, url.replace(VK_API_URL, self.url), *args, **kwargs)
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    # concurrent senders open many connections at once, a short listen queue delays them by SYN retries
+    request_queue_size = 128
+
+
+class FakeVkServer:
+    """
+    Local stand-in for the VK API: records every HTTP request and every delivered message.
+    Errors queued in errors are returned, one per request, before requests start to succeed. execute_errors
+    holds an error code or None per call inside execute; as the code built by build_execute_code, an execute
+    stops at its first failed call.
+    """
+
+    def __init__(self):
+        self.requests = []  # (method, values) per HTTP round trip
+        self.sent = []  # messages.send values in delivery order
+        self.errors = []  # error codes to answer with
+        self.execute_errors = []  # error codes of the calls inside execute, None lets a call succeed
+        self.lock = threading.Lock()
+        self.server = FakeHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(*self.server.server_address)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def vk_session(self) -> vk_api.VkApi:
+        vk_session = vk_api.VkApi(token='fake', session=FakeVkSession(self.url))
+        vk_session.RPS_DELAY = 0
+        return vk_session
+
+    def call(self, method: str, values: dict):
+        with self.lock:
+            self.requests.append((method, values))
+            if self.errors:
+                code = self.errors.pop(0)
+                return {'error': {'error_code': code, 'error_msg': 'fake error', 'request_params': []}}
+            if method == 'messages.send':
+                self.sent.append(values)
+                return {'response': len(self.sent)}
+            if method == 'execute':
+                results, errors = [], []
+                for call in parse_execute_code(values['code']):
+                    code = self.execute_errors.pop(0) if self.execute_errors else None
+                    if code is not None:
+                        results.append(False)
+                        errors.append({'method': 'messages.send', 'error_code': code, 'error_msg': 'fake error'})
+                        break
+                    self.sent.append(call)
+                    results.append(len(self.sent))
+                response = {'response': results}
+                if errors:
+                    response['execute_errors'] = errors
+                return response
+            return {'response': 1}
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8')
+                method = self.path.split('/method/', 1)[-1]
+                response = json.dumps(fake.call(method, dict(parse_qsl(body)))).encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,35 @@
+import io
+import unittest
+
+from src.bulk import ExportWriter, copy_rows, normalize_quote, read_quotes
+
+
+class MyTestCase(unittest.TestCase):
+    def test_read_csv(self):
+        file = io.StringIO('vk_id,author,text,tags,attachment,private\n'
+                           '1,автор,"строка, с ""кавычками""",жизнь;любовь,,t\n'
+                           '2,,текст,,photo1_2,0\n')
+        quotes = [normalize_quote(x) for x in read_quotes(file, 'csv')]
+        self.assertEqual(quotes, [(1, 'автор', 'строка, с "кавычками"', ['жизнь', 'любовь'], '', True),
+                                  (2, '', 'текст', [], 'photo1_2', False)])
+
+    def test_read_jsonl_skips_invalid(self):
+        file = io.StringIO('{"vk_id": 1, "text": "текст", "tags": ["a", "a"], "private": false}\n\n'
+                           '{"vk_id": "x", "text": "текст"}\n'
+                           '{"vk_id": 1, "text": "' + 'ж' * 501 + '"}\n')
+        quotes = [normalize_quote(x) for x in read_quotes(file, 'jsonl')]
+        self.assertEqual(quotes, [(1, '', 'текст', ['a'], '', False), None, None])
+
+    def test_copy_rows(self):
+        rows = copy_rows([(1, 'автор', 'a\tb\\c\nd', ['x"y', 'z'], '', False)], 7).read()
+        self.assertEqual(rows, '7\t1\tавтор\ta\\tb\\\\c\\nd\t{"x\\\\"y","z"}\t\tf\n')
+
+    def test_export_jsonl_unescapes(self):
+        file = io.StringIO()
+        writer = ExportWriter(file, 'jsonl')
+        writer.write(b'{"text":"a\\\\nb \\\\"c\\\\""}\n')
+        self.assertEqual(file.getvalue(), '{"text":"a\\nb \\"c\\""}\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
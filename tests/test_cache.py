@@ -0,0 +1,50 @@
+import time
+import unittest
+
+from src.cache import LRUCache
+
+
+class MyTestCase(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=0.01)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_on_evict(self):
+        evicted = []
+        cache = LRUCache(2, on_evict=lambda key, value: evicted.append((key, value)))
+        cache.put('a', 1)
+        cache.put('a', 2)
+        cache.put('b', 3)
+        cache.put('c', 4)
+        cache.pop('b')
+        cache.evict(lambda key, value: value == 4)
+        self.assertEqual(evicted, [('a', 1), ('a', 2), ('b', 3), ('c', 4)])
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.pop('a')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 0))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+import requests
+
+from benchmarks.memory_database import MemoryDatabase
+from src.bot_base import BotBase
+from src.callback import CallbackServer
+from tests.fake_vk import FakeVkServer
+
+
+def make_raw_event(vk_id, text, event_id, secret='secret'):
+    return {'type': 'message_new', 'group_id': 1, 'event_id': event_id, 'secret': secret,
+            'object': {'message': {'id': 1, 'date': 0, 'from_id': vk_id, 'peer_id': vk_id, 'text': text,
+                                   'attachments': []},
+                       'client_info': {}}}
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.callback = CallbackServer(1, 'confirm', secret='secret', host='127.0.0.1', queue_size=2)
+        self.callback.start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.callback.server_address[1])
+
+    def tearDown(self):
+        self.callback.close()
+
+    def post(self, raw_event) -> requests.Response:
+        return requests.post(self.url, json=raw_event, timeout=5)
+
+    def test_confirmation_and_checks(self):
+        response = self.post({'type': 'confirmation', 'group_id': 1})
+        self.assertEqual((response.status_code, response.text), (200, 'confirm'))
+        self.assertEqual(self.post({'type': 'confirmation', 'group_id': 2}).status_code, 403)
+        self.assertEqual(self.post(make_raw_event(7, 'начать', 'a', secret='wrong')).status_code, 403)
+        self.assertEqual(requests.post(self.url, data='{', timeout=5).status_code, 400)
+        self.assertTrue(self.callback.events_queue.empty())
+
+    def test_group_id_as_string(self):
+        callback = CallbackServer('1', 'confirm', host='127.0.0.1')
+        self.assertEqual(callback.accept({'type': 'confirmation', 'group_id': 1}), (200, 'confirm'))
+        self.assertEqual(callback.accept({'type': 'confirmation', 'group_id': '1'}), (200, 'confirm'))
+        self.assertEqual(callback.accept({'type': 'confirmation', 'group_id': 'x'})[0], 403)
+        callback.server_close()
+
+    def test_bounded_queue(self):
+        for event_id in ('a', 'a', 'b'):
+            response = self.post(make_raw_event(7, 'начать', event_id))
+            self.assertEqual((response.status_code, response.text), (200, 'ok'))
+        self.assertEqual(self.post(make_raw_event(7, 'начать', 'c')).status_code, 503)
+        events = self.callback.events()
+        self.assertEqual([next(events).raw['event_id'] for _ in range(2)], ['a', 'b'])
+
+    def test_repeated_events_of_several_instances(self):
+        db = MemoryDatabase()
+        other = CallbackServer(1, 'confirm', secret='secret', host='127.0.0.1', queue_size=1, db=db)
+        callback = CallbackServer(1, 'confirm', secret='secret', host='127.0.0.1', queue_size=1, db=db)
+        self.assertEqual(other.accept(make_raw_event(7, 'начать', 'a')), (200, 'ok'))
+        self.assertEqual(callback.accept(make_raw_event(7, 'начать', 'a')), (200, 'ok'))
+        self.assertTrue(callback.events_queue.empty())
+        # refused by a full queue, the repeated delivery is accepted by any instance
+        self.assertEqual(other.accept(make_raw_event(7, 'начать', 'b'))[0], 503)
+        self.assertEqual(callback.accept(make_raw_event(7, 'начать', 'b')), (200, 'ok'))
+        self.assertEqual(callback.events_queue.get_nowait()['event_id'], 'b')
+        other.server_close()
+        callback.server_close()
+
+    def test_events_handled_by_bot(self):
+        with FakeVkServer() as vk:
+            bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk.vk_session(),
+                          database=MemoryDatabase())
+            runner = threading.Thread(target=bot.run, args=(self.callback.events(),))
+            runner.start()
+            self.post(make_raw_event(7, 'начать', 'a'))
+            self.post(make_raw_event(7, 'псевдоним', 'b'))
+            self.callback.events_queue.put(None)
+            runner.join(10)
+            bot.send_queue.close()
+        self.assertFalse(runner.is_alive())
+        self.assertEqual([x['peer_id'] for x in vk.sent], ['7', '7'])
+        self.assertTrue(bot.sessions.user_exists(7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 
+import psycopg2
+
 from src.database import Database
-from src.methods import State
+from src.methods import SearchParams, State
 import json
 from random import randint
 import random, string
@@ -17,13 +19,36 @@ class MyTestCase(unittest.TestCase):
     def setUp(self):
         with open('../access_data.json') as json_file:
             data = json.load(json_file)
-            database_auth = data['database_auth']
+            self.database_auth = data['database_auth']
 
-        self.db = Database(database_auth)
+        self.db = Database(self.database_auth)
 
     def test_close_connection(self):
         self.db.close_connection()
 
+    def test_pool_keeps_connections(self):
+        with self.db.transaction():
+            with self.db.transaction():
+                with self.db.transaction() as cursor:
+                    connections = self.db.pool.minconn + 2
+                    cursor.execute("SELECT 1;")
+        self.assertEqual(len(self.db.pool._pool), connections)
+
+    def test_idle_connections_dropped_after_restart(self):
+        with self.db.transaction():
+            with self.db.transaction():
+                with self.db.transaction():
+                    with self.db.transaction():
+                        with self.db.transaction():
+                            with self.db.transaction():
+                                pass
+        # the server drops every connection of the pool, as after a restart
+        with psycopg2.connect(**self.database_auth) as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                           "WHERE datname = current_database() AND pid <> pg_backend_pid();")
+        self.assertFalse(self.db.user_exists(-1))
+        self.assertEqual(len(self.db.pool._pool), 1)
+
     def test_create_user(self):
         vk_id = randint(0, 1000000)
         alias = generate_random_string(10)
@@ -48,10 +73,60 @@ class MyTestCase(unittest.TestCase):
         alias = generate_random_string(10)
         quote = generate_random_string(10)
         self.db.create_user(vk_id, alias)
-        quote_id = self.db.create_quote(vk_id, quote)
+        created = self.db.create_quote(vk_id, quote, tags=['тег'], author='автор')
+        quote_id = created['quote_id']
+        self.assertEqual(created, self.db.get_quote(quote_id))
         self.assertIn(quote_id, self.db.get_my_quotes(vk_id))
         self.assertEqual(self.db.get_quote(quote_id)['text'], quote)
 
+    def test_tag_search_ignores_case(self):
+        vk_id = randint(0, 1000000)
+        tag = generate_random_string(10)
+        self.db.create_user(vk_id, generate_random_string(10))
+        quote_id = self.db.create_quote(vk_id, generate_random_string(10), tags=[tag.upper()])['quote_id']
+        self.assertEqual(self.db.get_quotes_by_tag(vk_id, [tag], SearchParams.PRIVATE, 10), [quote_id])
+        self.assertEqual(self.db.get_quotes_by_tag(vk_id, [tag + '%'], SearchParams.ALL, 10), [])
+
+    def test_tag_ids_refreshed(self):
+        vk_id = randint(0, 1000000)
+        tag = generate_random_string(10)
+        self.db.create_user(vk_id, generate_random_string(10))
+        first = self.db.create_quote(vk_id, generate_random_string(10), tags=[tag])['quote_id']
+        self.assertEqual(self.db.get_quotes_by_tag(vk_id, [tag], SearchParams.PRIVATE, 10), [first])
+        # another process creates a tag under the same key
+        second = Database(self.database_auth).create_quote(vk_id, generate_random_string(10),
+                                                           tags=[tag.upper()])['quote_id']
+        self.db.tag_ids_loaded_at = 0
+        self.assertEqual(self.db.get_quotes_by_tag(vk_id, [tag], SearchParams.PRIVATE, 10), [second, first])
+
+    def test_lexemes_match_word_search(self):
+        vk_id = randint(0, 1000000)
+        self.db.create_user(vk_id, generate_random_string(10))
+        text = 'Жизни прекрасны ' + generate_random_string(10)
+        quote_id = self.db.create_quote(vk_id, text, private=True)['quote_id']
+        quote_lexemes, word_lexemes = self.db.get_lexemes([text, 'жизнь'])
+        self.assertTrue(set(word_lexemes) <= set(quote_lexemes))
+        self.assertIn(quote_id, self.db.get_quotes_by_word(vk_id, 'жизнь', SearchParams.PRIVATE, 10))
+
+    def test_search_paging_in_database(self):
+        vk_id = randint(0, 1000000)
+        self.db.create_user(vk_id, generate_random_string(10))
+        self.db.set_user_state(vk_id, State.SEARCH_BY_TAG)
+        self.db.start_search(vk_id, list(range(1, 16)))
+        self.assertEqual(Database(self.database_auth).next_search_page(vk_id, 10), list(range(1, 11)))
+        self.assertEqual(self.db.search_remaining(vk_id), 5)
+        self.db.set_user_state(vk_id, State.SEARCH_BY_TAG)
+        self.assertEqual(self.db.next_search_page(vk_id, 10), list(range(11, 16)))
+        self.db.set_user_state(vk_id, State.BOT_MENU)
+        self.assertEqual(self.db.next_search_page(vk_id, 10), [])
+
+    def test_claim_event(self):
+        event_id = generate_random_string(20)
+        self.assertTrue(self.db.claim_event(event_id))
+        self.assertFalse(Database(self.database_auth).claim_event(event_id))
+        self.db.release_event(event_id)
+        self.assertTrue(self.db.claim_event(event_id))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import queue
+import threading
+import time
+import unittest
+
+from vk_api.bot_longpoll import VkBotMessageEvent
+
+from src.dispatcher import EventDispatcher, get_event_vk_id
+from src.metrics import handler_failures_total
+
+
+def make_event(vk_id, text):
+    return VkBotMessageEvent({'type': 'message_new', 'group_id': 1,
+                              'object': {'message': {'from_id': vk_id, 'peer_id': vk_id, 'text': text}}})
+
+
+class MyTestCase(unittest.TestCase):
+    def test_event_vk_id(self):
+        self.assertEqual(get_event_vk_id(make_event(42, 'начать')), 42)
+        reply = VkBotMessageEvent({'type': 'message_reply', 'group_id': 1,
+                                   'object': {'from_id': -1, 'peer_id': 42, 'text': ''}})
+        self.assertEqual(get_event_vk_id(reply), 42)
+
+    def test_user_order_kept(self):
+        handled = {1: [], 2: []}
+
+        def handler(event):
+            time.sleep(0.01)
+            handled[event.message.from_id].append(event.message.text)
+
+        events = [make_event(vk_id, str(i)) for i in range(10) for vk_id in (1, 2)]
+        dispatcher = EventDispatcher(handler, max_workers=4)
+        asyncio.run(dispatcher.serve(events))
+        dispatcher.close()
+        self.assertEqual(handled[1], [str(i) for i in range(10)])
+        self.assertEqual(handled[2], [str(i) for i in range(10)])
+
+    def test_users_handled_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def handler(event):
+            barrier.wait()
+
+        dispatcher = EventDispatcher(handler, max_workers=3)
+        asyncio.run(dispatcher.serve([make_event(vk_id, 'start') for vk_id in (1, 2, 3)]))
+        dispatcher.close()
+        self.assertFalse(barrier.broken)
+
+    def test_handler_error_isolated(self):
+        handled = []
+
+        def handler(event):
+            if event.message.text == 'fail':
+                raise ValueError(event.message.text)
+            handled.append(event.message.from_id)
+
+        failures = handler_failures_total.get(('ValueError',))
+        events = [make_event(1, 'fail')] + [make_event(vk_id, 'ok') for vk_id in range(2, 51)] + [make_event(1, 'ok')]
+        dispatcher = EventDispatcher(handler, max_workers=4)
+        asyncio.run(dispatcher.serve(events))
+        dispatcher.close()
+        self.assertEqual(sorted(handled), list(range(1, 51)))
+        self.assertEqual(handler_failures_total.get(('ValueError',)), failures + 1)
+
+    def test_cancelled_serve_keeps_event(self):
+        events = queue.Queue()
+
+        def read_events():
+            while True:
+                event = events.get()
+                if event is None:
+                    return
+                yield event
+
+        iterator = read_events()
+        handled = []
+
+        async def cancel_serve():
+            dispatcher = EventDispatcher(lambda event: handled.append(event.message.text))
+            task = asyncio.ensure_future(dispatcher.serve(iterator))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.sleep(0.05)
+            events.put(make_event(1, 'a'))
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            dispatcher.close()
+
+        asyncio.run(cancel_serve())
+        events.put(make_event(1, 'b'))
+        events.put(None)
+        dispatcher = EventDispatcher(lambda event: handled.append(event.message.text))
+        asyncio.run(dispatcher.serve(iterator))
+        dispatcher.close()
+        self.assertEqual(handled, ['a', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import json
+import unittest
+from enum import Enum
+
+from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+
+from src.keyboard import create_keyboard, register_keyboard
+from src.methods import BotRuntimeError, Keyboard
+
+
+class MyTestCase(unittest.TestCase):
+    def test_layout(self):
+        keyboard = VkKeyboard(one_time=True)
+        keyboard.add_button("Справка", color=VkKeyboardColor.PRIMARY)
+        keyboard.add_button("Вернуться", color=VkKeyboardColor.PRIMARY)
+        self.assertEqual(create_keyboard(Keyboard.FAQ_AND_RETURN), keyboard.get_keyboard())
+
+    def test_all_layouts_cached(self):
+        for which in Keyboard:
+            self.assertIs(create_keyboard(which), create_keyboard(which))
+
+    def test_register(self):
+        class CustomKeyboard(Enum):
+            CONFIRM = 0
+
+        register_keyboard(CustomKeyboard.CONFIRM, [[("Да", VkKeyboardColor.POSITIVE), "Нет"]])
+        buttons = json.loads(create_keyboard(CustomKeyboard.CONFIRM))['buttons']
+        self.assertEqual([button['action']['label'] for button in buttons[0]], ["Да", "Нет"])
+        self.assertEqual(buttons[0][0]['color'], VkKeyboardColor.POSITIVE.value)
+
+    def test_unknown(self):
+        with self.assertRaises(BotRuntimeError):
+            create_keyboard(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
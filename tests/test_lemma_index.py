@@ -0,0 +1,63 @@
+import unittest
+
+from benchmarks.memory_database import MemoryDatabase
+from src.lemma_index import LemmaIndex
+from src.methods import SearchParams
+
+LEMMAS = {'любви': 'любовь', 'любовью': 'любовь', 'жизни': 'жизнь'}
+
+
+def lemmatize(word: str) -> str:
+    return LEMMAS.get(word, word)
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDatabase()
+        for vk_id in (1, 2):
+            self.db.create_user(vk_id, 'alias{}'.format(vk_id))
+        self.first = self.db.create_quote(1, 'Всё о любви и жизни')['quote_id']
+        self.second = self.db.create_quote(2, 'С любовью', private=True)['quote_id']
+        self.index = LemmaIndex(self.db, lemmatize=lemmatize)
+        self.index.load(batch_size=1)
+
+    def test_load_and_search(self):
+        self.assertEqual(self.index.get_quotes_by_word(2, 'Любовь', SearchParams.ALL, 10), [self.second, self.first])
+        self.assertEqual(self.index.get_quotes_by_word(1, 'любви', SearchParams.ALL, 10), [self.first])
+        self.assertEqual(self.index.get_quotes_by_word(2, 'любовь', SearchParams.PRIVATE, 10), [self.second])
+        self.assertEqual(self.index.get_quotes_by_word(1, 'любовь', SearchParams.PUBLIC, 10), [])
+        self.assertEqual(self.index.get_quotes_by_word(1, 'смерть', SearchParams.ALL, 10), [])
+        self.assertEqual(self.index.stats()['postings'], 7)
+
+    def test_incremental_updates(self):
+        third = self.db.create_quote(1, 'жизнь')['quote_id']
+        self.index.add_quote(third, 'жизнь', False)
+        self.assertEqual(self.index.catch_up(), 0)
+        fourth = self.db.create_quote(2, 'любовь')['quote_id']
+        self.assertEqual(self.index.catch_up(), 1)
+        self.assertEqual(self.index.stats()['quotes'], 4)
+        self.assertEqual(self.index.get_quotes_by_word(2, 'жизни', SearchParams.ALL, 10), [third, self.first])
+        self.assertEqual(self.index.stats()['postings'], 9)
+        self.assertEqual(self.index.get_quotes_by_word(1, 'любви', SearchParams.ALL, 10), [fourth, self.first])
+        self.index.set_private(self.first, True)
+        self.assertEqual(self.index.get_quotes_by_word(2, 'жизни', SearchParams.PUBLISHED, 10), [third])
+        self.index.add_quote(self.first, 'жизни', False)
+        self.assertEqual(list(self.index.postings['жизнь']), [self.first, third])
+
+    def test_catch_up_of_other_processes(self):
+        index = LemmaIndex(self.db, lemmatize=lemmatize, catch_up_window=2)
+        index.load()
+        # another shard hides the quote: it gets a new version
+        self.db.remove_user_quote(1, self.first)
+        self.assertEqual(index.catch_up(), 0)
+        self.assertEqual(index.get_quotes_by_word(2, 'любовь', SearchParams.PUBLISHED, 10), [])
+        # a version taken before the last read one commits late
+        late = self.db.create_quote(1, 'жизни')['quote_id']
+        self.db.create_quote(1, 'любовь')
+        self.db.versions[late] = index.last_version - 1
+        self.assertEqual(index.catch_up(), 2)
+        self.assertEqual(index.get_quotes_by_word(2, 'жизнь', SearchParams.ALL, 10), [late])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import tempfile
+import unittest
+
+from src.log import DroppingQueueHandler, JsonFormatter, get_logger, setup_logging
+
+
+class MyTestCase(unittest.TestCase):
+    def test_json_formatter(self):
+        record = logging.makeLogRecord({'name': 'quotes_bot.bot', 'levelname': 'DEBUG', 'msg': 'message %s',
+                                        'args': ('handled',), 'vk_id': 1})
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'message handled')
+        self.assertEqual(entry['vk_id'], 1)
+        self.assertEqual(entry['level'], 'DEBUG')
+
+    def test_full_queue_drops(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        for i in range(3):
+            handler.handle(logging.makeLogRecord({'msg': str(i)}))
+        self.assertEqual(handler.dropped, 2)
+
+    def test_setup_logging(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'logs.txt')
+            listener = setup_logging(logging.INFO, path=path, console=False)
+            logger = get_logger('test')
+            logger.debug('skipped %s', 'debug')
+            logger.info('written', extra={'quote_id': 5})
+            atexit.unregister(listener.stop)
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+            with open(path, encoding='utf8') as file:
+                entries = [json.loads(line) for line in file]
+        self.assertEqual([(x['message'], x['quote_id']) for x in entries], [('written', 5)])
+        logging.getLogger('quotes_bot').handlers.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import urllib.request
+
+from src.metrics import Counter, Histogram, start_metrics_server, timed, registry
+
+
+class MyTestCase(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test.', ('command', 'state'), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(('FAQ', 'BOT_MENU'), value)
+        lines = histogram.collect()
+        self.assertIn('test_seconds_bucket{command="FAQ",state="BOT_MENU",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{command="FAQ",state="BOT_MENU",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{command="FAQ",state="BOT_MENU",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{command="FAQ",state="BOT_MENU"} 5.65', lines)
+        self.assertIn('test_seconds_count{command="FAQ",state="BOT_MENU"} 4', lines)
+
+    def test_counter_escapes_labels(self):
+        counter = Counter('test_total', 'Test.', ('code',))
+        counter.inc(('a"b',))
+        counter.inc(('a"b',), 2)
+        self.assertEqual(counter.collect()[-1], 'test_total{code="a\\"b"} 3')
+
+    def test_timed(self):
+        histogram = Histogram('test_timed_seconds', 'Test.', ('method',))
+
+        @timed(histogram)
+        def query():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            query()
+        self.assertEqual(histogram.count(('query',)), 1)
+
+    def test_endpoint(self):
+        server = start_metrics_server(0, '127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(response.read().decode('utf8'), registry.render())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
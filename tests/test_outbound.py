@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+
+import vk_api
+
+from src.outbound import OutboundSender, SendPriority, SendQueue, TokenBucket, EXECUTE_CALLS_LIMIT
+from src.metrics import send_requests_total
+from tests.fake_vk import FakeVkServer
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.vk = FakeVkServer().__enter__()
+        self.send_queue = SendQueue(self.vk.vk_session, rate=1000, burst=1000)
+        self.sender = OutboundSender(self.send_queue)
+
+    def tearDown(self):
+        self.send_queue.close()
+        self.vk.__exit__()
+
+    def test_send_without_batch(self):
+        self.sender.send(peer_id=1, message='a', keyboard=None)
+        self.sender.send(peer_id=1, message='b')
+        self.assertEqual([method for method, values in self.vk.requests], ['messages.send', 'messages.send'])
+        self.assertEqual([values['message'] for values in self.vk.sent], ['a', 'b'])
+        self.assertNotIn('keyboard', self.vk.sent[0])
+
+    def test_batch_single_execute(self):
+        with self.sender.batch():
+            for i in range(5):
+                self.sender.send(peer_id=1, message='цитата "{}"\n©автор'.format(i), attachment='')
+        self.assertEqual([method for method, values in self.vk.requests], ['execute'])
+        self.assertEqual([values['message'] for values in self.vk.sent],
+                         ['цитата "{}"\n©автор'.format(i) for i in range(5)])
+
+    def test_batch_split(self):
+        with self.sender.batch():
+            for i in range(EXECUTE_CALLS_LIMIT + 1):
+                self.sender.send(peer_id=1, message=str(i))
+        self.assertEqual([method for method, values in self.vk.requests], ['execute', 'messages.send'])
+        self.assertEqual([values['message'] for values in self.vk.sent],
+                         [str(i) for i in range(EXECUTE_CALLS_LIMIT + 1)])
+
+    def test_batch_flushed_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.sender.batch():
+                self.sender.send(peer_id=1, message='before error')
+                raise ValueError
+        self.assertEqual([values['message'] for values in self.vk.sent], ['before error'])
+
+    def test_retry_rate_limit(self):
+        self.vk.errors = [6, 9]
+        retried = send_requests_total.get(('retried',))
+        self.sender.send(peer_id=1, message='a')
+        self.assertEqual([values['message'] for values in self.vk.sent], ['a'])
+        self.assertEqual(len(self.vk.requests), 3)
+        self.assertEqual(self.send_queue.stats()['retries'], 2)
+        self.assertEqual(send_requests_total.get(('retried',)) - retried, 2)
+
+    def test_retry_rate_limit_in_execute(self):
+        self.vk.execute_errors = [None, 9]
+        with self.sender.batch():
+            for i in range(4):
+                self.sender.send(peer_id=1, message=str(i))
+        self.assertEqual([method for method, values in self.vk.requests], ['execute', 'execute'])
+        self.assertEqual([values['message'] for values in self.vk.sent], ['0', '1', '2', '3'])
+
+    def test_failed_call_in_execute_skipped(self):
+        self.vk.execute_errors = [None, 901]
+        with self.sender.batch():
+            for i in range(4):
+                self.sender.send(peer_id=1, message=str(i))
+        self.assertEqual([values['message'] for values in self.vk.sent], ['0', '2', '3'])
+
+    def test_chunk_priority(self):
+        send_queue = SendQueue(self.vk.vk_session, rate=1000, burst=1000, workers=1, autostart=False)
+        sender = OutboundSender(send_queue)
+        bulk = send_queue.submit('messages.send', {'peer_id': 1, 'message': 'bulk'}, priority=SendPriority.BULK)
+        thread = threading.Thread(target=sender.flush, args=([(SendPriority.BULK, {'peer_id': 2, 'message': 'a'}),
+                                                              (SendPriority.INTERACTIVE,
+                                                               {'peer_id': 2, 'message': 'b'})],))
+        thread.start()
+        while send_queue.queue.qsize() < 2:
+            time.sleep(0.001)
+        send_queue.start()
+        thread.join()
+        bulk.result()
+        send_queue.close()
+        self.assertEqual([values['message'] for values in self.vk.sent], ['a', 'b', 'bulk'])
+
+    def test_no_retry_other_errors(self):
+        self.vk.errors = [901]
+        with self.assertRaises(vk_api.ApiError):
+            self.sender.send(peer_id=1, message='a')
+        self.assertEqual(self.send_queue.stats()['failed'], 1)
+
+    def test_interactive_first(self):
+        send_queue = SendQueue(self.vk.vk_session, rate=1000, burst=1000, workers=1, autostart=False)
+        bulk = send_queue.submit('messages.send', {'peer_id': 1, 'message': 'bulk'}, priority=SendPriority.BULK)
+        interactive = send_queue.submit('messages.send', {'peer_id': 2, 'message': 'interactive'})
+        send_queue.start()
+        bulk.result()
+        interactive.result()
+        send_queue.close()
+        self.assertEqual([values['message'] for values in self.vk.sent], ['interactive', 'bulk'])
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.045)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from enum import Enum
+
+import vk_api
+from vk_api.bot_longpoll import VkBotMessageEvent
+
+from src.bot_base import BotBase, Command, build_command_phrases
+from src.methods import BotRuntimeError, SearchParams, State
+from src.phrases import ErrorPhrases
+from benchmarks.memory_database import MemoryDatabase
+from tests.fake_vk import FakeVkServer
+
+
+class MyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk_api.VkApi(token='fake'),
+                          database=object())
+
+    def assertReply(self, raw_message: str, state: State, phrase: ErrorPhrases):
+        with self.assertRaises(BotRuntimeError) as error:
+            self.bot.parse_message(raw_message=raw_message, state=state)
+        self.assertEqual(error.exception.reply, phrase.value)
+
+    def test_commands(self):
+        for raw_message, command in [('Начать', Command.BOT_START), ('start', Command.BOT_START),
+                                     ('создать цитату', Command.CREATE_QUOTE), ('ВЕРНУТЬСЯ', Command.RETURN)]:
+            result = self.bot.parse_message(raw_message=raw_message, state=State.QUOTE_CREATION_BM)
+            self.assertTrue(result.bot_command)
+            self.assertEqual(result.command, command)
+
+    def test_unmapped_phrase(self):
+        with self.assertRaises(ValueError):
+            build_command_phrases(Enum('Phrases', {'FAQ': 'справка', 'UNKNOWN': 'неизвестно'}))
+
+    def test_next_page_outside_search(self):
+        with FakeVkServer() as vk:
+            bot = BotBase({'group_token': 'fake', 'group_id': 1}, {}, bot_session=vk.vk_session(),
+                          database=MemoryDatabase())
+            bot.sessions.create_user(vk_id=7, alias='псевдоним')
+            bot.sessions.set_user_state(vk_id=7, state=State.MY_QUOTES)
+            bot.handle_event(VkBotMessageEvent({'type': 'message_new', 'group_id': 1, 'object': {
+                'message': {'from_id': 7, 'peer_id': 7, 'text': 'Дальше', 'attachments': []}}}))
+            bot.send_queue.close()
+        self.assertEqual([x['message'] for x in vk.sent], ['Ошибка: {}.'.format(ErrorPhrases.STATE_ERROR.value)])
+        self.assertEqual(bot.sessions.get_user_state(vk_id=7), State.BOT_MENU)
+
+    def test_quote(self):
+        result = self.bot.parse_message(raw_message='жизнь @a "Лев Толстой" @t "мир война" @p',
+                                        state=State.QUOTE_CREATION_MQ)
+        self.assertFalse(result.bot_command)
+        self.assertEqual((result.text, result.author, result.tags, result.private),
+                         ('жизнь', 'Лев Толстой', ['мир', 'война'], True))
+        result = self.bot.parse_message(raw_message='жизнь @t мир', state=State.QUOTE_CREATION_BM)
+        self.assertEqual((result.author, result.tags, result.private), ('', ['мир'], False))
+
+    def test_quote_errors(self):
+        state = State.QUOTE_CREATION_BM
+        self.assertReply('@a автор', state, ErrorPhrases.QUOTE_CREATION_ERROR_1)
+        self.assertReply('  @a автор', state, ErrorPhrases.QUOTE_CREATION_ERROR_1)
+        self.assertReply('текст @@a автор', state, ErrorPhrases.QUOTE_CREATION_ERROR_2)
+        self.assertReply('текст @a', state, ErrorPhrases.QUOTE_CREATION_ERROR_2)
+        self.assertReply('текст @x автор', state, ErrorPhrases.QUOTE_CREATION_ERROR_3)
+        self.assertReply('текст @a ""', state, ErrorPhrases.QUOTE_CREATION_ERROR_4)
+        self.assertReply('текст @a "а"б"', state, ErrorPhrases.QUOTE_CREATION_ERROR_5)
+        self.assertReply('текст @a а @a б', state, ErrorPhrases.QUOTE_CREATION_ERROR_6)
+        self.assertReply('текст @a а б', state, ErrorPhrases.QUOTE_CREATION_ERROR_7)
+        self.assertReply('текст @t а @t б', state, ErrorPhrases.QUOTE_CREATION_ERROR_8)
+        self.assertReply('текст @t а б', state, ErrorPhrases.QUOTE_CREATION_ERROR_10)
+        self.assertReply('т' * 501, state, ErrorPhrases.QUOTE_CREATION_ERROR_11)
+        self.assertReply('текст @t ' + 'т' * 21, state, ErrorPhrases.QUOTE_CREATION_ERROR_14)
+        self.assertReply('текст @a ' + 'а' * 21, state, ErrorPhrases.QUOTE_CREATION_ERROR_15)
+
+    def test_search(self):
+        result = self.bot.parse_message(raw_message='жизнь @a', state=State.SEARCH_BY_WORD)
+        self.assertEqual((result.text, result.search_param), ('жизнь', SearchParams.PUBLIC))
+        result = self.bot.parse_message(raw_message='мир война @p', state=State.SEARCH_BY_TAG)
+        self.assertEqual((result.tags, result.search_param), (['мир', 'война'], SearchParams.PRIVATE))
+        self.assertReply('а @a @p', State.SEARCH_BY_TAG, ErrorPhrases.SEARCH_ERROR_1)
+        self.assertReply('а @x', State.SEARCH_BY_WORD, ErrorPhrases.SEARCH_ERROR_2)
+        self.assertReply('а б', State.SEARCH_BY_WORD, ErrorPhrases.SEARCH_ERROR_3)
+
+    def test_text_and_unknown_state(self):
+        self.assertEqual(self.bot.parse_message(raw_message=' 42 ', state=State.QUOTE_DELETING).text, '42')
+        self.assertReply('текст', State.BOT_MENU, ErrorPhrases.PARSE_UNKNOWN_BEHAVIOR)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from benchmarks.memory_database import MemoryDatabase
+from src.metrics import quote_cache_size
+from src.quote_cache import QuoteCache
+
+
+class CountingDatabase(MemoryDatabase):
+    def __init__(self):
+        super().__init__()
+        self.requested = []
+
+    def get_quotes(self, quote_ids):
+        self.requested.append(list(quote_ids))
+        return super().get_quotes(quote_ids)
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = CountingDatabase()
+        self.db.create_user(1, 'alias')
+        self.first = self.db.create_quote(1, 'жизнь', author='автор', attachments=['photo1_2'])['quote_id']
+        self.second = self.db.create_quote(1, 'мир', author='автор')['quote_id']
+        self.quotes = QuoteCache(self.db)
+
+    def test_misses_fetched_at_once(self):
+        quotes = self.quotes.get_quotes([self.second, 100, self.first])
+        self.assertEqual([(x, quote.text) for x, quote in quotes],
+                         [(self.second, 'мир\n©автор'), (self.first, 'жизнь\n©автор')])
+        self.assertEqual(quotes[1][1].attachments, ['photo1_2'])
+        self.assertEqual(self.quotes.get_quote(self.first).text, 'жизнь\n©автор')
+        self.assertEqual(self.db.requested, [[self.second, 100, self.first]])
+        self.assertEqual(quote_cache_size.get(), 2)
+        self.assertEqual(self.quotes.stats()['hits'], 1)
+
+    def test_invalidate(self):
+        self.assertFalse(self.quotes.get_quote(self.first).private)
+        self.db.quotes[self.first]['private'] = True
+        self.assertFalse(self.quotes.get_quote(self.first).private)
+        self.quotes.invalidate(self.first)
+        self.assertTrue(self.quotes.get_quote(self.first).private)
+        self.assertEqual(len(self.db.requested), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from collections import Counter
+
+from benchmarks.memory_database import MemoryDatabase
+from src.methods import SearchParams
+from src.search_cache import SearchCache
+
+
+class CountingDatabase(MemoryDatabase):
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+
+    def get_quotes_by_tag(self, vk_id, tags, search_param, max_amount):
+        self.calls['get_quotes_by_tag'] += 1
+        return super().get_quotes_by_tag(vk_id, tags, search_param, max_amount)
+
+    def get_quotes_by_word(self, vk_id, word, search_param, max_amount):
+        self.calls['get_quotes_by_word'] += 1
+        return super().get_quotes_by_word(vk_id, word, search_param, max_amount)
+
+    def get_quotes_by_word_states(self, vk_id, word_states, search_param, max_amount):
+        self.calls['get_quotes_by_word_states'] += 1
+        return super().get_quotes_by_word_states(vk_id, word_states, search_param, max_amount)
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = CountingDatabase()
+        self.searches = SearchCache(self.db)
+        for vk_id in (1, 2):
+            self.db.create_user(vk_id, 'alias{}'.format(vk_id))
+        self.public = self.searches.create_quote(1, 'жизнь прекрасна', tags=['жизнь'])['quote_id']
+        self.private = self.searches.create_quote(2, 'жизнь сложна', tags=['жизнь'], private=True)['quote_id']
+
+    def search(self, vk_id, search_param, tag='Жизнь'):
+        return self.searches.get_quotes_by_tag(vk_id, [tag], search_param, 100)
+
+    def test_visibility(self):
+        self.assertEqual(self.search(2, SearchParams.ALL), [self.public, self.private])
+        self.assertEqual(self.search(2, SearchParams.PRIVATE), [self.private])
+        self.assertEqual(self.search(1, SearchParams.PUBLIC), [])
+        self.assertEqual(self.search(1, SearchParams.ALL), [self.public])
+
+    def test_public_matches_shared(self):
+        self.search(1, SearchParams.ALL)
+        self.search(1, SearchParams.PUBLIC)
+        self.search(2, SearchParams.ALL)
+        # public matches once, own matches once per user
+        self.assertEqual(self.db.calls['get_quotes_by_tag'], 3)
+        self.assertEqual(self.searches.stats()['hits'], 3)
+
+    def test_published_not_cached(self):
+        searches = SearchCache(self.db, cache_published=False)
+        self.assertEqual(searches.get_quotes_by_tag(1, ['жизнь'], SearchParams.ALL, 100), [self.public])
+        # another process makes the quote private
+        self.db.remove_user_quote(1, self.public)
+        self.assertEqual(searches.get_quotes_by_tag(2, ['жизнь'], SearchParams.PUBLIC, 100), [])
+
+    def test_precise_invalidation(self):
+        self.search(1, SearchParams.ALL)
+        self.search(1, SearchParams.ALL, 'мир')
+        self.searches.get_quotes_by_word_states(1, ['сложна'], SearchParams.ALL, 100)
+        self.db.calls.clear()
+        quote_id = self.searches.create_quote(2, 'мир', tags=['мир'])['quote_id']
+        self.assertEqual(self.search(1, SearchParams.ALL), [self.public])
+        self.assertEqual(self.searches.get_quotes_by_word_states(1, ['сложна'], SearchParams.ALL, 100), [])
+        self.assertEqual(sum(self.db.calls.values()), 0)
+        self.assertEqual(self.search(1, SearchParams.ALL, 'мир'), [quote_id])
+        self.assertEqual(self.db.calls['get_quotes_by_tag'], 1)
+
+    def test_word_invalidation(self):
+        for word in ('Жизнь', 'мир'):
+            self.searches.get_quotes_by_word(1, word, SearchParams.ALL, 100)
+        self.db.calls.clear()
+        quote_id = self.searches.create_quote(2, 'Мир велик', tags=[])['quote_id']
+        self.assertEqual(self.searches.get_quotes_by_word(1, 'жизнь', SearchParams.ALL, 100), [self.public])
+        self.assertEqual(self.db.calls['get_quotes_by_word'], 0)
+        self.assertEqual(self.searches.get_quotes_by_word(1, 'мир', SearchParams.ALL, 100), [quote_id])
+        self.assertEqual(self.db.calls['get_quotes_by_word'], 1)
+
+    def test_index_of_cached_ids(self):
+        self.search(1, SearchParams.ALL)
+        self.search(1, SearchParams.ALL, 'мир')
+        self.assertEqual(self.searches.index[self.public], {('published', ('tag', frozenset({'жизнь'}), 100)),
+                                                          ('own', 1, ('tag', frozenset({'жизнь'}), 100))})
+        self.searches.remove_user_quote(1, self.public)
+        self.assertEqual(self.searches.stats()['size'], 2)
+        self.assertNotIn(self.public, self.searches.index)
+        self.assertEqual(self.search(1, SearchParams.ALL), [])
+
+    def test_writes_of_user_quotes(self):
+        self.assertEqual(self.search(2, SearchParams.PUBLIC), [self.public])
+        self.searches.add_quote_to_user(2, self.public)
+        self.assertEqual(self.search(2, SearchParams.PUBLIC), [])
+        self.assertEqual(self.search(1, SearchParams.ALL), [self.public])
+        self.searches.remove_user_quote(1, self.public)
+        self.searches.remove_user_quote(2, self.public)
+        self.assertEqual(self.search(1, SearchParams.ALL), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
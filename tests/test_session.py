@@ -0,0 +1,117 @@
+import time
+import unittest
+from collections import Counter
+
+from benchmarks.memory_database import MemoryDatabase
+from src.methods import State
+from src.session import SessionCache, SharedSessions
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.users = {}
+        self.calls = Counter()
+
+    def user_exists(self, vk_id):
+        self.calls['user_exists'] += 1
+        return vk_id in self.users
+
+    def create_user(self, vk_id, alias):
+        self.calls['create_user'] += 1
+        self.users[vk_id] = {'state': State.ALIAS_INPUT, 'alias': alias}
+
+    def get_user_state(self, vk_id):
+        self.calls['get_user_state'] += 1
+        return self.users[vk_id]['state']
+
+    def set_user_state(self, vk_id, state):
+        self.calls['set_user_state'] += 1
+        self.users[vk_id]['state'] = state
+
+    def get_user_alias(self, vk_id):
+        self.calls['get_user_alias'] += 1
+        return self.users[vk_id]['alias']
+
+    def set_user_alias(self, vk_id, alias):
+        self.calls['set_user_alias'] += 1
+        self.users[vk_id]['alias'] = alias
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.sessions = SessionCache(self.db)
+
+    def test_steady_state_without_queries(self):
+        self.assertFalse(self.sessions.user_exists(1))
+        self.sessions.create_user(1, 'alias')
+        self.sessions.set_user_state(1, State.BOT_MENU)
+        self.db.calls.clear()
+        for _ in range(3):
+            self.assertTrue(self.sessions.user_exists(1))
+            self.assertEqual(self.sessions.get_user_state(1), State.BOT_MENU)
+            self.sessions.set_user_state(1, State.BOT_MENU)
+            self.assertEqual(self.sessions.get_user_alias(1), 'alias')
+        self.assertEqual(sum(self.db.calls.values()), 0)
+
+    def test_write_through(self):
+        self.db.create_user(2, 'old')
+        self.sessions.set_user_state(2, State.MY_QUOTES)
+        self.sessions.set_user_alias(2, 'new')
+        self.assertEqual(self.db.users[2], {'state': State.MY_QUOTES, 'alias': 'new'})
+        self.assertEqual(self.sessions.get_user_alias(2), 'new')
+
+    def test_invalidate(self):
+        self.db.create_user(3, 'old')
+        self.assertEqual(self.sessions.get_user_alias(3), 'old')
+        self.db.users[3]['alias'] = 'changed elsewhere'
+        self.sessions.invalidate(3)
+        self.assertEqual(self.sessions.get_user_alias(3), 'changed elsewhere')
+
+    def test_search_pages(self):
+        self.sessions.create_user(4, 'alias')
+        self.sessions.set_user_state(4, State.SEARCH_BY_TAG)
+        self.sessions.start_search(4, list(range(25)))
+        self.db.calls.clear()
+        self.assertEqual(self.sessions.next_search_page(4, 10), list(range(10)))
+        self.assertEqual(self.sessions.next_search_page(4, 10), list(range(10, 20)))
+        self.assertEqual(self.sessions.search_remaining(4), 5)
+        self.assertEqual(self.sessions.next_search_page(4, 10), list(range(20, 25)))
+        self.assertEqual(self.sessions.search_remaining(4), 0)
+        self.assertEqual(sum(self.db.calls.values()), 0)
+        self.sessions.start_search(4, [1, 2])
+        self.sessions.set_user_state(4, State.QUOTE_SEARCH)
+        self.assertEqual(self.sessions.next_search_page(4, 10), [])
+
+    def test_search_outlives_session(self):
+        sessions = SessionCache(self.db, ttl=0.01)
+        sessions.create_user(5, 'alias')
+        sessions.set_user_state(5, State.SEARCH_BY_WORD)
+        sessions.start_search(5, list(range(15)))
+        self.assertEqual(sessions.next_search_page(5, 10), list(range(10)))
+        time.sleep(0.02)
+        self.assertEqual(sessions.get_user_state(5), State.SEARCH_BY_WORD)
+        self.assertEqual(sessions.next_search_page(5, 10), list(range(10, 15)))
+
+    def test_shared_sessions(self):
+        db = MemoryDatabase()
+        first, second = SharedSessions(db), SharedSessions(db)
+        self.assertFalse(first.user_exists(6))
+        second.create_user(6, 'alias')
+        self.assertTrue(first.user_exists(6))
+        first.set_user_state(6, State.SEARCH_BY_TAG)
+        first.start_search(6, list(range(15)))
+        # the next event of the user goes to the other instance
+        self.assertEqual(second.get_user_state(6), State.SEARCH_BY_TAG)
+        second.set_user_state(6, State.SEARCH_BY_TAG)
+        self.assertEqual(second.next_search_page(6, 10), list(range(10)))
+        self.assertEqual(first.next_search_page(6, 10), list(range(10, 15)))
+        self.assertEqual(second.search_remaining(6), 0)
+        second.set_user_alias(6, 'new')
+        self.assertEqual(first.get_user_alias(6), 'new')
+        first.set_user_state(6, State.BOT_MENU)
+        self.assertEqual(second.next_search_page(6, 10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import multiprocessing
+import time
+import unittest
+
+from vk_api.bot_longpoll import VkBotMessageEvent
+
+from src.metrics import shard_queue_depth
+from src.workers import ShardedRunner, shard_events
+
+
+class SleepingRunner(ShardedRunner):
+    # shards are processes that never read their queues, the first one dies at once
+    def start_shard(self, shard: int):
+        started = self.processes[shard] is not None
+        self.queues[shard] = self.context.Queue(maxsize=self.queue_size)
+        self.received[shard] = self.context.Value('q', 0)
+        self.processes[shard] = self.context.Process(target=time.sleep, args=(30 if started or shard else 0,))
+        self.processes[shard].start()
+        self.sent[shard] = 0
+
+
+def make_raw_event(vk_id, text):
+    return {'type': 'message_new', 'group_id': 1,
+            'object': {'message': {'from_id': vk_id, 'peer_id': vk_id, 'text': text}}}
+
+
+class MyTestCase(unittest.TestCase):
+    def test_shard_events(self):
+        queue = multiprocessing.Queue()
+        received = multiprocessing.Value('q', 0)
+        for i in range(3):
+            queue.put(make_raw_event(7, str(i)))
+        queue.put(None)
+        events = list(shard_events(queue, received))
+        self.assertEqual([event.message.text for event in events], ['0', '1', '2'])
+        self.assertTrue(all(isinstance(event, VkBotMessageEvent) for event in events))
+        self.assertEqual(received.value, 3)
+
+    def test_shard_events_after_failed_run(self):
+        queue = multiprocessing.Queue()
+        received = multiprocessing.Value('q', 0)
+        for i in range(2):
+            queue.put(make_raw_event(7, str(i)))
+        queue.put(None)
+        self.assertEqual(next(shard_events(queue, received)).message.text, '0')
+        self.assertEqual([event.message.text for event in shard_events(queue, received)], ['1'])
+
+    def test_queue_depth_gauge(self):
+        runner = ShardedRunner({'group_token': 'fake', 'group_id': 1}, {}, shards=2)
+        runner.sent = [5, 3]
+        runner.received = [multiprocessing.Value('q', 2), multiprocessing.Value('q', 3)]
+        self.assertEqual(runner.update_queue_depths(), [3, 0])
+        self.assertEqual(shard_queue_depth.get((0,)), 3)
+        self.assertEqual(shard_queue_depth.get((1,)), 0)
+
+    def test_dead_shard_restarted(self):
+        runner = SleepingRunner({'group_token': 'fake', 'group_id': 1}, {}, shards=2, queue_size=1,
+                                shutdown_timeout=1)
+        runner.start()
+        dead = runner.processes[0]
+        dead.join()
+        runner.put(VkBotMessageEvent(make_raw_event(2, 'начать')))
+        self.assertIsNot(runner.processes[0], dead)
+        self.assertTrue(runner.processes[0].is_alive())
+        self.assertEqual(runner.sent, [1, 0])
+        # both queues are full and never read, the shards are terminated at the shutdown timeout
+        runner.put(VkBotMessageEvent(make_raw_event(1, 'начать')))
+        start = time.monotonic()
+        runner.stop()
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()